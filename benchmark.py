@@ -0,0 +1,376 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Callable
+from common import Contact, Filter, Commands, ServerResponse, Snapshot, WireFormat, ImportReport, encode_object, decode_object
+from phonebook import PhonebookClient
+from server import RequestHandler, ThreadedServer, AsyncServer
+from storage import Storage, DatabaseConnection, MemoryStorage
+
+NAMES: tuple[str, ...] = ('Александр', 'Алексей', 'Анна', 'Борис', 'Валентина', 'Виктор', 'Галина', 'Дмитрий', 'Евгения',
+                          'Екатерина', 'Иван', 'Ирина', 'Константин', 'Людмила', 'Максим', 'Мария', 'Наталья', 'Николай',
+                          'Ольга', 'Павел', 'Сергей', 'Светлана', 'Татьяна', 'Юлия')
+SURNAMES: tuple[str, ...] = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+                             'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров',
+                             'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин')
+PATRONYMICS: tuple[str, ...] = ('Александрович', 'Алексеевич', 'Андреевич', 'Борисович', 'Викторович', 'Дмитриевич',
+                                'Иванович', 'Максимович', 'Николаевич', 'Павлович', 'Петрович', 'Сергеевич')
+NOTES: tuple[str, ...] = ('', 'Работа', 'Дом', 'Друг', 'Коллега', 'Сосед', 'Врач', 'Бухгалтерия', 'Звонить после обеда')
+FEMALE: frozenset[str] = frozenset({'Анна', 'Валентина', 'Галина', 'Евгения', 'Екатерина', 'Ирина', 'Людмила', 'Мария',
+                                    'Наталья', 'Ольга', 'Светлана', 'Татьяна', 'Юлия'})
+
+OPERATIONS: tuple[str, ...] = ('update', 'search', 'add', 'delete')  # update — UPDATE без фильтра, search — с фильтром.
+MIX: str = 'update=20,search=50,add=15,delete=15'
+SEARCH_FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number')
+PERCENTILES: tuple[int, ...] = (50, 95, 99)
+
+
+def generate_contact(random_: random.Random, number: str) -> Contact:
+    """Создаёт контакт со случайными русскими ФИО и заметкой."""
+    name: str = random_.choice(NAMES)
+    surname: str = random_.choice(SURNAMES)
+    patronymic: str = random_.choice(PATRONYMICS)
+    if name in FEMALE:
+        surname += 'а'
+        patronymic = patronymic[:-2] + 'на'  # Александрович → Александровна.
+    return Contact(name=name, surname=surname, patronymic=patronymic, number=number, note=random_.choice(NOTES))
+
+
+def generate_contacts(count: int, seed: int) -> list[Contact]:
+    """Создаёт count контактов с номерами +79000000000, +79000000001 и т. д."""
+    random_ = random.Random(seed)
+    return [generate_contact(random_, '+79{0:09d}'.format(index)) for index in range(count)]
+
+
+def random_filter(random_: random.Random) -> Filter:
+    """Фильтр по подстроке из триграммы значения случайного поля (так поиск может использовать индекс)."""
+    field: str = random_.choice(SEARCH_FIELDS)
+    if field == 'number':
+        value: str = '{0:09d}'.format(random_.randrange(10 ** 9))
+    else:
+        value: str = random_.choice({'name': NAMES, 'surname': SURNAMES, 'patronymic': PATRONYMICS}[field])
+    start: int = random_.randrange(len(value) - 2)
+    return Filter(field=field, text=value[start:start + 3])
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    """Разбирает доли операций вида «update=20,search=50,add=15,delete=15»."""
+    mix: dict[str, float] = {}
+    for part in text.split(','):
+        operation, separator, weight = part.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS or not separator:
+            raise argparse.ArgumentTypeError('Некорректная доля операции: {0}. Допустимые операции: {1}.'.format(
+                part, ', '.join(OPERATIONS)))
+        mix[operation] = float(weight)
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError('Сумма долей операций должна быть положительной.')
+    return mix
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Перцентиль упорядоченной по возрастанию выборки (метод ближайшего ранга)."""
+    if not values:
+        return 0.0
+    rank: int = max(1, -(-len(values) * percent // 100))  # Округление вверх.
+    return values[int(rank) - 1]
+
+
+def summarize(seconds: list[float]) -> dict[str, float | int]:
+    """Сводка измерений длительности: число, среднее, минимум, максимум и перцентили [мс]."""
+    values: list[float] = sorted(value * 1000 for value in seconds)
+    summary: dict[str, float | int] = {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) if values else 0.0,
+        'min_ms': values[0] if values else 0.0,
+        'max_ms': values[-1] if values else 0.0,
+    }
+    for percent in PERCENTILES:
+        summary['p{0}_ms'.format(percent)] = percentile(values, percent)
+    return summary
+
+
+def measure(function: Callable[[], object], repeat: int) -> dict[str, float | int]:
+    """Выполняет function repeat раз и возвращает сводку длительностей."""
+    seconds: list[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def open_storage(kind: str, directory: str, shared: bool = False) -> Storage:
+    """Открывает хранилище заданного типа, файлы которого находятся в directory. Если shared == True, с базой данных
+    SQLite одновременно работают другие процессы."""
+    if kind == 'memory':
+        storage: Storage = MemoryStorage(snapshot_name=os.path.join(directory, MemoryStorage.SNAPSHOT_NAME),
+                                         log_name=os.path.join(directory, MemoryStorage.LOG_NAME))
+    else:
+        storage: Storage = DatabaseConnection(database_name=os.path.join(directory, DatabaseConnection.DATABASE_NAME),
+                                              shared=shared)
+    storage.createDatabase()
+    return storage
+
+
+def seed_storage(storage: Storage, contacts: list[Contact]) -> ImportReport:
+    return storage.insertMany(enumerate(contacts, start=1), ImportReport())
+
+
+def serve(kind: str, directory: str, mode: str, pipe: Connection, port: int = 0, shared: bool = False):
+    """Запускает сервер на порту port localhost (0 — на свободном порту) и передаёт номер порта через pipe. Выполняется
+    в дочернем процессе, чтобы сервер не конкурировал за GIL с потоками клиентов. Если shared == True, порт и базу
+    данных делят несколько таких процессов (как процессы-обработчики server.py --workers)."""
+    storage: Storage = open_storage(kind, directory, shared)
+    handler = RequestHandler(storage)
+    listener = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+    if shared:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(socket.SOMAXCONN)
+    if mode == 'asyncio':
+        server = AsyncServer(listener, handler)
+    else:
+        server = ThreadedServer(listener, handler, threading.Event())
+    pipe.send(listener.getsockname()[1])
+    server.server_loop()
+
+
+class LoadClient:
+    """Имитация клиента: выполняет случайную последовательность запросов с заданными долями операций.
+
+    Удаляются контакты, добавленные этим же клиентом, а пока их нет — закреплённые за клиентом исходные контакты,
+    поэтому удаления клиентов не пересекаются и всегда находят контакт."""
+    def __init__(self, index: int, port: int, mix: dict[str, float], own: list[Contact], seed: int, timeout: float):
+        self.index: int = index
+        self.random = random.Random(seed * 1000003 + index)
+        self.client = PhonebookClient(host='127.0.0.1', port=port, timeout=timeout, attempts=3)
+        self.operations: list[str] = list(mix)
+        self.weights: list[float] = list(mix.values())
+        self.own: list[Contact] = own  # Контакты, которые клиент может удалить.
+        self.added: list[Contact] = []
+        self.next_number: int = 0
+        self.latencies: dict[str, list[float]] = {operation: [] for operation in OPERATIONS}
+        self.errors: dict[str, int] = {operation: 0 for operation in OPERATIONS}
+        self.rejected: dict[str, int] = {operation: 0 for operation in OPERATIONS}  # ADD и DELETE, вернувшие False.
+
+    def __execute(self, operation: str):
+        match operation:
+            case 'update':
+                self.client.getContacts()
+            case 'search':
+                self.client.getContacts(random_filter(self.random))
+            case 'add':
+                contact: Contact = generate_contact(self.random, '+78{0:03d}{1:07d}'.format(self.index, self.next_number))
+                self.next_number += 1
+                if self.client.addContact(contact):
+                    self.added.append(contact)
+                else:
+                    self.rejected[operation] += 1
+            case 'delete':
+                victims: list[Contact] = self.added or self.own
+                if not victims:
+                    self.rejected[operation] += 1
+                    return
+                contact: Contact = victims.pop(self.random.randrange(len(victims)))
+                if not self.client.deleteContact(contact):
+                    self.rejected[operation] += 1
+
+    def run(self, start: threading.Barrier, deadline: Callable[[], float]):
+        self.client.connect()
+        start.wait()
+        stop: float = deadline()
+        while time.perf_counter() < stop:
+            operation: str = self.random.choices(self.operations, self.weights)[0]
+            began: float = time.perf_counter()
+            try:
+                self.__execute(operation)
+            except Exception as error:
+                self.errors[operation] += 1
+                continue
+            self.latencies[operation].append(time.perf_counter() - began)
+        self.client.close()
+
+
+def run_load(port: int, contacts: list[Contact], clients: int, duration: float, mix: dict[str, float], seed: int,
+             timeout: float) -> dict:
+    """Нагружает сервер clients клиентами в течение duration секунд. Возвращает пропускную способность и задержки
+    по операциям."""
+    workers: list[LoadClient] = [LoadClient(index, port, mix, contacts[index::clients], seed, timeout)
+                                 for index in range(clients)]
+    times: dict[str, float] = {}
+
+    def __begin():  # Выполняется одним потоком, когда все клиенты подключились.
+        times['start'] = time.perf_counter()
+        times['stop'] = times['start'] + duration
+
+    start = threading.Barrier(clients, action=__begin)
+    threads: list[threading.Thread] = [threading.Thread(target=worker.run, args=(start, lambda: times['stop']))
+                                       for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed: float = time.perf_counter() - times['start']
+
+    commands: dict[str, dict] = {}
+    for operation in OPERATIONS:
+        latencies: list[float] = [value for worker in workers for value in worker.latencies[operation]]
+        summary: dict = summarize(latencies)
+        summary['throughput'] = len(latencies) / elapsed
+        summary['errors'] = sum(worker.errors[operation] for worker in workers)
+        summary['rejected'] = sum(worker.rejected[operation] for worker in workers)
+        commands[operation] = summary
+    total: list[float] = [value for worker in workers for values in worker.latencies.values() for value in values]
+    overall: dict = summarize(total)
+    overall['throughput'] = len(total) / elapsed
+    overall['errors'] = sum(summary['errors'] for summary in commands.values())
+    return {'elapsed': elapsed, 'overall': overall, 'commands': commands}
+
+
+def micro_storage(storage: Storage, seed: int, repeat: int) -> dict:
+    """Время getFilteredPhones без фильтра и со случайными фильтрами."""
+    random_ = random.Random(seed)
+    filters: list[Filter] = [random_filter(random_) for _ in range(repeat)]
+    filtered = iter(filters)
+    return {
+        'unfiltered': measure(lambda: storage.getFilteredPhones(None), max(1, repeat // 10)),
+        'filtered': measure(lambda: storage.getFilteredPhones(next(filtered)), len(filters)),
+    }
+
+
+def micro_serialization(contacts: list[Contact], repeat: int) -> dict:
+    """Время сериализации и десериализации ответа UPDATE со всеми контактами в каждом формате."""
+    responses: dict[str, ServerResponse] = {
+        'contacts': ServerResponse(command=Commands.UPDATE, flag=True, data=contacts),
+        'snapshot': ServerResponse(command=Commands.UPDATE, flag=True, data=Snapshot(revision=len(contacts), contacts=contacts)),
+    }
+    results: dict[str, dict] = {}
+    for name, response in responses.items():
+        for format in WireFormat:
+            data: bytes = encode_object(response, format)
+            results['{0}_{1}'.format(name, format.value)] = {
+                'size': len(data),
+                'encode': measure(lambda: encode_object(response, format), repeat),
+                'decode': measure(lambda: decode_object(data), repeat),
+            }
+    return results
+
+
+def micro_table(contacts: list[Contact], repeat: int) -> dict:
+    """Время Table.setData с перерисовкой: первое отображение, повторное без изменений, после добавления контакта
+    в начало и после прокрутки в середину. Требует графической среды."""
+    from tkinter import Tk, TclError
+    from client import Table
+    try:
+        root = Tk()
+    except TclError as error:
+        return {'skipped': str(error)}
+    try:
+        root.geometry('800x600')
+        table = Table(root)
+        table.pack(fill='both', expand=True)
+        root.update()
+
+        def __render(data: list[Contact]):
+            table.setData(data)
+            root.update_idletasks()
+
+        shifted: list[Contact] = [Contact(name='Абрам', surname='Ааронов', patronymic='Абрамович', number='+70000000000', note='')] + contacts
+        results: dict[str, dict] = {}
+        results['initial'] = measure(lambda: (table.clear(), __render(contacts)), repeat)
+        results['unchanged'] = measure(lambda: __render(contacts), repeat)
+        results['shifted'] = measure(lambda: (__render(contacts), __render(shifted)), repeat)
+        results['scrolled'] = measure(lambda: (table.scrollTo(random.randrange(len(contacts))), root.update_idletasks()),
+                                      repeat)
+        return results
+    finally:
+        root.destroy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование и микробенчмарки сервера телефонной книги.')
+    parser.add_argument('--contacts', type=int, default=10000, help='Сколько контактов загрузить в хранилище перед запуском.')
+    parser.add_argument('--clients', type=int, default=8, help='Число одновременных клиентов.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Длительность нагрузки [с].')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(MIX),
+                        help='Доли операций (update — UPDATE без фильтра, search — с фильтром). По умолчанию: {0}.'.format(MIX))
+    parser.add_argument('--mode', choices=('threads', 'asyncio'), default='threads', help='Режим работы сервера.')
+    parser.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite', help='Хранилище сервера.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Число процессов сервера, слушающих общий порт (только для хранилища sqlite).')
+    parser.add_argument('--timeout', type=float, default=PhonebookClient.TIMEOUT, help='Время ожидания ответа сервера [с].')
+    parser.add_argument('--repeat', type=int, default=100, help='Число повторений каждого микробенчмарка.')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел.')
+    parser.add_argument('--skip-load', action='store_true', help='Не выполнять нагрузочное тестирование.')
+    parser.add_argument('--skip-micro', action='store_true', help='Не выполнять микробенчмарки.')
+    parser.add_argument('--output', default='benchmark.json', help='Файл JSON с результатами.')
+    args = parser.parse_args()
+    if args.workers > 1 and args.storage != 'sqlite':
+        parser.error('Несколько процессов сервера могут работать только с хранилищем sqlite.')
+
+    contacts: list[Contact] = generate_contacts(args.contacts, args.seed)
+    results: dict = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='phonebook-benchmark-') as directory:
+        storage: Storage = open_storage(args.storage, directory)
+        seed_storage(storage, contacts)
+        if not args.skip_micro:
+            print('Микробенчмарки...')
+            results['micro'] = {
+                'getFilteredPhones': micro_storage(storage, args.seed, args.repeat),
+                'serialization': micro_serialization(contacts, max(1, args.repeat // 10)),
+                'Table.setData': micro_table(contacts, args.repeat),
+            }
+        storage.close()
+
+        if not args.skip_load:
+            print('Нагрузка: {0} клиентов, {1} с...'.format(args.clients, args.duration))
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            shared: bool = args.workers > 1
+            processes: list[multiprocessing.Process] = []
+            try:
+                port: int = 0
+                for index in range(args.workers):  # Следующие процессы слушают порт, выбранный первым.
+                    process = multiprocessing.Process(target=serve, args=(args.storage, directory, args.mode, sender,
+                                                                          port, shared), daemon=True)
+                    process.start()
+                    processes.append(process)
+                    port = receiver.recv()
+                results['load'] = run_load(port, contacts, args.clients, args.duration, args.mix, args.seed, args.timeout)
+                with PhonebookClient(host='127.0.0.1', port=port, timeout=args.timeout) as client:
+                    # Показатели сервера (см. metrics.ServerMetrics); при нескольких процессах — одного из них.
+                    results['load']['server'] = client.getStatistics()
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.join()
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if 'load' in results:
+        print('{0:<10}{1:>10}{2:>12}{3:>10}{4:>10}{5:>10}{6:>8}'.format('Операция', 'Запросов', 'Запросов/с', 'p50, мс',
+                                                                      'p95, мс', 'p99, мс', 'Ошибок'))
+        for name, summary in [*results['load']['commands'].items(), ('всего', results['load']['overall'])]:
+            print('{0:<10}{1:>10}{2:>12.1f}{3:>10.2f}{4:>10.2f}{5:>10.2f}{6:>8}'.format(
+                name, summary['count'], summary['throughput'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+                summary['errors']))
+    print('Результаты записаны в {0}.'.format(args.output))
+
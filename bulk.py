@@ -0,0 +1,206 @@
+import argparse
+import csv
+import io
+import json
+import os
+import socket
+from typing import BinaryIO, Iterable, Iterator, TextIO
+from common import (Contact, Filter, Commands, ClientRequest, ServerResponse, BulkFormat, BulkImport, ExportRequest,
+                    ImportReport, Compression, Handshake, CHUNK_SIZE, PORT, send_object, receive_object)
+from storage import Storage
+
+FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number', 'note')
+REQUIRED_FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number')
+ENCODING: str = 'utf-8-sig'  # При чтении пропускает метку порядка байтов, которую добавляют табличные редакторы.
+
+
+def guess_format(path: str) -> BulkFormat:
+    """Определяет формат файла по расширению."""
+    extension: str = os.path.splitext(path)[1].lower()
+    return BulkFormat.JSONL if extension in ('.jsonl', '.json', '.ndjson') else BulkFormat.CSV
+
+
+class ChunkStream(io.RawIOBase):
+    """Поток, читающий данные из последовательности фрагментов (например, принятых по сети)."""
+    def __init__(self, chunks: Iterator[bytes]):
+        super().__init__()
+        self.__chunks: Iterator[bytes] = chunks
+        self.__chunk: memoryview = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.__chunk:
+            chunk: bytes | None = next(self.__chunks, None)
+            if chunk is None:
+                return 0
+            self.__chunk = memoryview(chunk)
+        count: int = min(len(buffer), len(self.__chunk))
+        buffer[:count] = self.__chunk[:count]
+        self.__chunk = self.__chunk[count:]
+        return count
+
+
+def open_chunks(chunks: Iterator[bytes]) -> TextIO:
+    """Возвращает текстовый поток, читающий последовательность фрагментов."""
+    return io.TextIOWrapper(io.BufferedReader(ChunkStream(chunks), CHUNK_SIZE), encoding=ENCODING, newline='')
+
+
+def _to_contact(row: int, record: dict, report: ImportReport) -> Contact | None:
+    """Проверяет поля строки. Возвращает None, если строка отклонена."""
+    number = record.get('number')
+    for field in REQUIRED_FIELDS:
+        if not isinstance(record.get(field), str):
+            report.reject(row, number if isinstance(number, str) else None, 'Не заполнено поле {0}.'.format(field))
+            return None
+    note = record.get('note')
+    if note is not None and not isinstance(note, str):
+        report.reject(row, number, 'Поле note должно быть строкой.')
+        return None
+    if not number:
+        report.reject(row, number, 'Пустой номер телефона.')
+        return None
+    return Contact(name=record['name'], surname=record['surname'], patronymic=record['patronymic'], number=number, note=note)
+
+
+def read_contacts(file: TextIO, format: BulkFormat, report: ImportReport) -> Iterator[tuple[int, Contact]]:
+    """Читает контакты из файла, возвращая их вместе с номерами строк. Некорректные строки заносятся в отчёт.
+
+    Файл CSV должен начинаться со строки с названиями полей, порядок столбцов произвольный. Заголовок без
+    обязательных полей приводит к ValueError."""
+    if format == BulkFormat.CSV:
+        reader = csv.DictReader(file)
+        if reader.fieldnames is None:
+            return  # Пустой файл.
+        missing: list[str] = [field for field in REQUIRED_FIELDS if field not in reader.fieldnames]
+        if missing:
+            raise ValueError('В заголовке CSV нет полей: {0}.'.format(', '.join(missing)))
+        row: int = 0
+        try:
+            for row, record in enumerate(reader, start=1):
+                contact: Contact | None = _to_contact(row, record, report)
+                if contact is not None:
+                    yield row, contact
+        except csv.Error as error:
+            raise ValueError('Ошибка CSV после строки {0}: {1}'.format(row, error))
+    else:
+        for row, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                report.reject(row, None, 'Некорректный JSON: {0}'.format(error))
+                continue
+            if not isinstance(record, dict):
+                report.reject(row, None, 'Строка не является объектом JSON.')
+                continue
+            contact: Contact | None = _to_contact(row, record, report)
+            if contact is not None:
+                yield row, contact
+
+
+def encode_contacts(contacts: Iterable[Contact], format: BulkFormat, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Преобразует контакты в содержимое файла, возвращая его фрагментами примерно по chunk_size символов."""
+    buffer = io.StringIO()
+    if format == BulkFormat.CSV:
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(FIELDS)
+        for contact in contacts:
+            writer.writerow((contact.name, contact.surname, contact.patronymic, contact.number, contact.note))
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    else:
+        for contact in contacts:
+            buffer.write(json.dumps({'name': contact.name, 'surname': contact.surname, 'patronymic': contact.patronymic,
+                                     'number': contact.number, 'note': contact.note}, ensure_ascii=False))
+            buffer.write('\n')
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def import_file(storage: Storage, path: str, format: BulkFormat) -> ImportReport:
+    """Загружает контакты из локального файла непосредственно в хранилище."""
+    report = ImportReport()
+    with open(path, encoding=ENCODING, newline='') as file:
+        storage.insertMany(read_contacts(file, format, report), report)
+    return report
+
+
+def export_file(storage: Storage, path: str, format: BulkFormat, filter: Filter | None = None) -> None:
+    """Выгружает контакты из хранилища в локальный файл."""
+    with open(path, 'wb') as file:
+        for chunk in encode_contacts(storage.iterContacts(filter), format):
+            file.write(chunk)
+
+
+def _receive_response(sock: socket.socket, command: Commands) -> ServerResponse:
+    """Принимает ответ на команду, пропуская уведомления об изменениях."""
+    while True:
+        response: ServerResponse | None = receive_object(sock)
+        if response is None:
+            raise ConnectionError('Сервер закрыл соединение.')
+        if response.command == command:
+            return response
+
+
+def handshake(sock: socket.socket, compression: list[Compression]) -> Handshake:
+    """Согласует с сервером сжатие ответов. Возвращает выбранные сервером параметры."""
+    send_object(sock, ClientRequest(command=Commands.HELLO, data=Handshake(compression=compression)))
+    return _receive_response(sock, Commands.HELLO).data
+
+
+def upload(sock: socket.socket, file: BinaryIO, format: BulkFormat) -> ServerResponse:
+    """Загружает содержимое файла на сервер. Поле data ответа содержит ImportReport (или описание ошибки)."""
+    send_object(sock, ClientRequest(command=Commands.BULK_IMPORT, data=BulkImport(format)))
+    while chunk := file.read(CHUNK_SIZE):
+        send_object(sock, ClientRequest(command=Commands.BULK_IMPORT, data=chunk))
+    send_object(sock, ClientRequest(command=Commands.BULK_IMPORT, data=b''))
+    return _receive_response(sock, Commands.BULK_IMPORT)
+
+
+def download(sock: socket.socket, file: BinaryIO, format: BulkFormat, filter: Filter | None = None) -> ServerResponse:
+    """Выгружает контакты с сервера в файл. Возвращает завершающий ответ сервера."""
+    send_object(sock, ClientRequest(command=Commands.EXPORT, data=ExportRequest(filter=filter, format=format)))
+    while True:
+        response: ServerResponse = _receive_response(sock, Commands.EXPORT)
+        if not response.flag or response.data is None:
+            return response
+        file.write(response.data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Массовая загрузка и выгрузка контактов через сервер телефонной книги.')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('file', help='Файл CSV или JSON Lines.')
+    parser.add_argument('--format', choices=[format.value for format in BulkFormat], default=None,
+                        help='Формат файла (по умолчанию определяется по расширению).')
+    parser.add_argument('--host', default='localhost', help='Адрес сервера.')
+    parser.add_argument('--field', choices=FIELDS, default=None, help='Поле фильтра выгрузки.')
+    parser.add_argument('--text', default=None, help='Подстрока, которую должно содержать поле фильтра выгрузки.')
+    args = parser.parse_args()
+
+    format: BulkFormat = BulkFormat(args.format) if args.format else guess_format(args.file)
+    with socket.create_connection((args.host, PORT)) as sock:
+        handshake(sock, [Compression.ZLIB])
+        if args.action == 'import':
+            with open(args.file, 'rb') as file:
+                response: ServerResponse = upload(sock, file, format)
+            if response.flag:
+                print(response.data)
+                for conflict in response.data.conflicts:
+                    print(conflict)
+            else:
+                print('Ошибка загрузки: {0}'.format(response.data))
+        else:
+            with open(args.file, 'wb') as file:
+                response: ServerResponse = download(sock, file, format, Filter(field=args.field, text=args.text))
+            if not response.flag:
+                print('Ошибка выгрузки: {0}'.format(response.data))
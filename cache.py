@@ -0,0 +1,84 @@
+import concurrent.futures
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class ResponseCache:
+    """LRU-кэш сериализованных ответов.
+
+    Кэш действителен в пределах одной ревизии телефонной книги: invalidate вызывается после фиксации каждого изменения. 
+    Одинаковые запросы, пришедшие одновременно, объединяются: ответ вычисляется один раз, остальные запросы ждут его. 
+    Суммарный размер хранимых ответов ограничен max_size байт."""
+    MAX_SIZE: int = 64 * 1024 * 1024  # [байт]
+
+    def __init__(self, max_size: int = MAX_SIZE):
+        self.max_size: int = max_size
+        self.__lock = threading.Lock()
+        self.__entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self.__size: int = 0  # Суммарный размер хранимых ответов [байт].
+        self.__pending: dict[Hashable, concurrent.futures.Future] = {}  # Ответы, которые вычисляются прямо сейчас.
+        self.__generation: int = 0  # Увеличивается при каждой инвалидации.
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0  # Запросы, дождавшиеся ответа, вычисляемого для другого клиента.
+        self.evictions: int = 0
+
+    def get(self, key: Hashable, compute: Callable[[], bytes]) -> bytes:
+        """Возвращает ответ из кэша, а при его отсутствии вычисляет с помощью compute и сохраняет."""
+        with self.__lock:
+            data: bytes | None = self.__entries.get(key)
+            if data is not None:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return data
+            future: concurrent.futures.Future | None = self.__pending.get(key)
+            if future is not None:
+                self.coalesced += 1
+                owner: bool = False
+            else:
+                future = concurrent.futures.Future()
+                self.__pending[key] = future
+                self.misses += 1
+                owner: bool = True
+                generation: int = self.__generation
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = compute()
+        except BaseException as error:
+            with self.__lock:
+                if self.__pending.get(key) is future:
+                    del self.__pending[key]
+            future.set_exception(error)
+            raise
+
+        with self.__lock:
+            if self.__pending.get(key) is future:
+                del self.__pending[key]
+            # Ответ, вычисленный до инвалидации, мог устареть, поэтому в кэш он не попадает.
+            if generation == self.__generation and len(data) <= self.max_size:
+                self.__entries[key] = data
+                self.__size += len(data)
+                while self.__size > self.max_size:
+                    _, evicted = self.__entries.popitem(last=False)
+                    self.__size -= len(evicted)
+                    self.evictions += 1
+        future.set_result(data)
+        return data
+
+    def invalidate(self, *args):
+        """Очищает кэш. Сигнатура позволяет использовать метод как слушателя изменений хранилища."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+            self.__pending.clear()  # Новые запросы не должны ждать ответов, вычисляемых по устаревшим данным.
+            self.__generation += 1
+
+    def statistics(self) -> dict[str, int]:
+        with self.__lock:
+            return {'entries': len(self.__entries), 'size': self.__size, 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'evictions': self.evictions}
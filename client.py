@@ -1,13 +1,42 @@
+import bisect
+import concurrent.futures
 import enum
-import pickle
-import socket
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
 from tkinter import *
-from tkinter import ttk
-from common import Contact, PORT, ClientRequest, Commands, ServerResponse, Filter
+from tkinter import ttk, messagebox
+from typing import Callable, Sequence
+from common import (Contact, ClientRequest, Commands, ServerResponse, Filter, UpdateRequest, Query, Page, Snapshot,
+                    Delta, Compression, Handshake)
+from phonebook import PhonebookClient
+from replica import Replica
+from search import SearchCache
 
 
 class ClientForm(Tk):
-    AUTOUPDATE_PERIOD: int = 1000  # [мс]
+    """Окно клиента.
+
+    Обмен данными с сервером выполняется фоновыми потоками NetworkWorker (через PhonebookClient), ответы
+    обрабатываются обратными вызовами в главном потоке, поэтому интерфейс не ожидает сеть. Пока не получены ответы
+    на запросы данных (подписки или страницы), уведомления сервера откладываются и применяются после них.
+
+    Телефонная книга, полученная без фильтра, сохраняется в локальной копии (Replica). При запуске и после разрыва
+    соединения показываются контакты копии, поиск без соединения выполняется по ней, а после подключения у сервера
+    запрашиваются только изменения, произошедшие после ревизии копии.
+
+    Поиск, уточняющий фильтр подписки (или выполняемый по локальной копии), выполняется без обращения к серверу по
+    результатам недавних поисков (SearchCache) сразу при вводе. Подписка при этом не меняется: уведомления обновляют
+    её данные, по которым заново находятся показанные контакты. К серверу поиск обращается после паузы во вводе,
+    только если фильтр расширяется."""
+    POLL_PERIOD: int = 20  # Период обработки событий сетевых потоков [мс].
+    RESPONSE_TIMEOUT: float = 30  # Время ожидания ответа сервера [с].
+    SEARCH_DELAY: int = 300  # Пауза во вводе, после которой отправляется запрос поиска [мс].
+    PAGING_THRESHOLD: int = 50000  # Телефонная книга большего размера загружается с сервера постранично.
+    SORT: str = 'surname'  # Поле, по которому упорядочиваются контакты при постраничной загрузке.
+    COMPRESSION: list[Compression] = [Compression.ZLIB, Compression.LZMA]  # Способы сжатия ответов в порядке предпочтения.
 
     def __init__(self):
         super().__init__()
@@ -16,6 +45,16 @@ class ClientForm(Tk):
 
         self.__phonebook: list[Contact] = []
         self.__selected_contact: Contact | None = None
+        self.__revision: int | None = None  # Ревизия, которой соответствует телефонная книга клиента.
+        self.__synced_filter: Filter | None = None  # Фильтр, с которым была получена телефонная книга.
+        self.__view_filter: Filter | None = None  # Фильтр показанных контактов (уточняет фильтр данных поиска).
+        self.__search = SearchCache()  # Данные подписки (или локальной копии) и результаты поисков по ним.
+        self.__requested_filter: Filter | None = None  # Фильтр последнего отправленного запроса подписки.
+        self.__subscription: int = 0  # Номер последнего запроса подписки (0 — подписка ещё не запрашивалась).
+        self.__loading: int = 0  # Число запросов данных, ожидающих ответа.
+        self.__paging: bool = False  # Загружается ли телефонная книга постранично.
+        self.__paged: PagedContacts | None = None  # Постранично загружаемые контакты.
+        self.__replica: Replica | None = None  # Локальная копия телефонной книги.
 
         self.connection_bar = ConnectionBar(parent=self)  # Строка подключения.
         self.connection_bar.button.config(command=self.__onReconnectButtonClick)
@@ -35,40 +74,164 @@ class ClientForm(Tk):
         self.add_panel.button_add.config(command=self.__addContact)
         self.add_panel.pack(side=RIGHT, fill=X, padx=2, expand=True)
 
-        self.__selected_bind = self.table.table.bind('<<TreeviewSelect>>', self.__onSelected)
+        self.table.bind('<<ContactSelect>>', self.__onSelected)
 
-        self.__socket: socket.socket | None = None
+        self.__network: NetworkWorker | None = None
+        self.__notifications: deque[Delta] = deque()  # Уведомления, отложенные до получения ответов на запросы данных.
 
         self.__after_id: str | None = None
+        self.__search_after_id: str | None = None
 
         self.__onReconnectButtonClick()
 
-    def startAutoupdate(self):
-        """Запускает периодическое автообновление данных."""
+    def startListening(self):
+        """Запускает периодическую обработку событий сетевых потоков (ответов и уведомлений сервера)."""
         assert self.__after_id is None
 
-        def __autoupdate_function():
+        def __listen_function():
             assert self.__after_id is not None
-            if self.updateData(self.filter):  # Обновляем список контактов клиента.
-                self.__after_id = self.after(self.AUTOUPDATE_PERIOD, __autoupdate_function)
+            network: NetworkWorker | None = self.__network
+            if network is not None and network.poll():
+                self.__after_id = self.after(self.POLL_PERIOD, __listen_function)
             else:
-                self.close_connection()
+                self.__after_id = None  # Соединение закрыто, обработчики уже обновили интерфейс.
 
-        self.__after_id = self.after(self.AUTOUPDATE_PERIOD, __autoupdate_function)
+        self.__after_id = self.after(self.POLL_PERIOD, __listen_function)
 
-    def stopAutoupdate(self):
-        """Останавливает периодическое автообновление данных."""
+    def stopListening(self):
+        """Останавливает обработку событий сетевых потоков."""
         if self.__after_id is not None:
             self.after_cancel(self.__after_id)
             self.__after_id = None
 
+    def __onNotification(self, delta: Delta):
+        """Уведомление сервера об изменениях."""
+        self.__notifications.append(delta)
+        self.__processNotifications()
+
+    def __processNotifications(self):
+        """Применяет отложенные уведомления, если не ожидаются ответы на запросы данных."""
+        while self.__loading == 0 and self.__notifications and self.__network is not None:
+            self.__applyNotification(self.__notifications.popleft())
+
+    def __applyNotification(self, delta: Delta):
+        """Применяет уведомление об изменениях."""
+        if self.__revision is None or delta.revision <= self.__revision:
+            return  # Изменения уже учтены (или данные ещё не получены).
+        elif delta.since <= self.__revision:
+            if self.__paged is not None:
+                if delta.modified:
+                    self.__paged.apply(delta)
+                    self.table.refresh()
+            else:
+                self.__applyData(delta, self.__synced_filter)
+            self.__revision = delta.revision
+        else:  # Часть изменений пропущена, запрашиваем их у сервера.
+            self.updateData(self.__synced_filter)
+
+    def __openReplica(self, host: str):
+        """Открывает локальную копию телефонной книги сервера host и показывает её контакты."""
+        if self.__replica is not None:
+            if self.__replica.host == host:
+                return
+            self.__replica.close()
+        try:
+            self.__replica = Replica(host=host)
+        except sqlite3.Error as error:
+            print('Локальная копия телефонной книги недоступна: {0}.'.format(error))
+            self.__replica = None
+        self.__showReplica()
+
+    def __showReplica(self):
+        """Показывает удовлетворяющие фильтру контакты локальной копии или, если копии нет, очищает таблицу."""
+        self.__view_filter = self.filter
+        if self.__replica is not None and self.__replica.revision is not None:
+            self.__setContacts(self.__replica.contacts, None)
+        else:
+            self.__setContacts([], None)
+
+    def __setContacts(self, contacts: list[Contact], filter: Filter | None):
+        """Заменяет данные поиска контактами, удовлетворяющими filter, и показывает те из них, которые удовлетворяют 
+        фильтру показанных контактов."""
+        self.__search.reset(filter, contacts)
+        shown: list[Contact] | None = self.__search.search(self.__view_filter)
+        if shown is None:  # Фильтр показанных контактов шире фильтра данных.
+            self.__view_filter = self.__search.filter
+            shown = contacts
+        if shown is not self.phonebook:
+            self.phonebook = shown
+
+    def __refine(self) -> bool:
+        """Показывает контакты, удовлетворяющие фильтру панели поиска, если их можно найти в данных поиска. 
+        Данные должны соответствовать фильтру последнего запроса подписки, иначе ответ на него их заменит."""
+        filter: Filter | None = self.filter
+        if self.__paging or self.__requested_filter != self.__search.filter:
+            return False
+        shown: list[Contact] | None = self.__search.search(filter)
+        if shown is None:
+            return False
+        self.__view_filter = filter
+        if shown is not self.phonebook:
+            self.phonebook = shown
+        return True
+
+    @property
+    def __replica_status(self) -> str:
+        """Пояснение для строки подключения о показанной локальной копии."""
+        if self.__replica is None or self.__replica.revision is None:
+            return ''
+        return ' Показана сохранённая копия телефонной книги (ревизия {0}).'.format(self.__replica.revision)
+
+    def __applyData(self, data: Snapshot | Delta, filter: Filter | None):
+        """Применяет к данным поиска снимок или изменения контактов, удовлетворяющих filter. Данные всей телефонной 
+        книги (filter is None) сохраняются и в локальной копии; при ошибке записи копия отключается."""
+        if filter is None and self.__replica is not None:
+            replica: Replica = self.__replica
+            try:
+                contacts: list[Contact] = replica.replace(data) if isinstance(data, Snapshot) else replica.apply(data)
+            except (sqlite3.Error, ValueError) as error:
+                print('Локальная копия телефонной книги отключена: {0}.'.format(error))
+                replica.close()
+                self.__replica = None
+                # Изменения могли быть запрошены от ревизии копии, поэтому применяются к её контактам.
+                contacts: list[Contact] = data.contacts if isinstance(data, Snapshot) else data.apply(replica.contacts)
+        elif isinstance(data, Snapshot):
+            contacts: list[Contact] = data.contacts
+        elif data.modified:
+            contacts: list[Contact] = data.apply(self.__search.contacts)
+        else:
+            return  # Данные не изменились.
+        self.__setContacts(contacts, filter)
+
     def __onReconnectButtonClick(self):
         """Событие, которое выполняется при нажатии на кнопку "Попробовать переподключиться"."""
-        if self.connect():
-            if self.updateData(self.filter):  # Обновляем список контактов клиента.
-                self.startAutoupdate()
-            else:
-                self.close_connection()
+        if self.__network is None:
+            self.__openReplica(self.connection_bar.host)
+            self.connection_bar.setEnabled(False)
+            self.connection_bar.setText('Подключение...')
+            self.__network = NetworkWorker(host=self.connection_bar.host, on_connect=self.__onConnected,
+                                           on_notify=self.__onNotification, on_close=self.close_connection,
+                                           timeout=self.RESPONSE_TIMEOUT, compression=self.COMPRESSION)
+            self.startListening()
+
+    def __onConnected(self, error: str | None):
+        """Результат подключения к серверу."""
+        if error is None:
+            self.add_panel.setEnabled(True)
+            handshake: Handshake | None = self.__network.handshake
+            self.connection_bar.setText('Соединение с сервером успешно установлено (сжатие ответов: {0}).'.format(
+                handshake.compression[0].name.lower() if handshake is not None else 'none'))
+
+            def __onCounted(total: int | None):
+                self.__paging = total is not None and total > self.PAGING_THRESHOLD
+                self.__view_filter = self.filter
+                self.updateData(self.filter)  # Обновляем список контактов клиента.
+
+            self.countContacts(callback=__onCounted)
+        else:
+            self.__network = None
+            self.connection_bar.setText('Соединение не установлено. Ошибка: {0}.{1}'.format(error, self.__replica_status))
+            self.connection_bar.setEnabled(True)
 
     def __onSelected(self, event: Event):
         """Событие, которое выполняется при выборе строки в таблице."""
@@ -76,22 +239,39 @@ class ClientForm(Tk):
 
     def __addContact(self):
         """Событие, которое выполняется при нажатии на кнопку "Добавить"."""
-        if self.addContact(self.add_panel.current_contact):
-            self.add_panel.clear()
-            if not self.updateData(self.filter):  # Обновляем список контактов клиента.
-                self.close_connection()
-        else:
-            self.close_connection()
+        contact: Contact = self.add_panel.current_contact
+
+        def __onAdded(success: bool):
+            if success:
+                self.add_panel.clear()
+            else:  # Ошибки соединения обрабатывает NetworkWorker, поэтому отказ означает конфликт номера.
+                messagebox.showwarning('Добавление контакта',
+                                       'Контакт с номером {0} уже существует.'.format(contact.number), parent=self)
+
+        self.addContact(contact, callback=__onAdded)
 
     def __deleteContact(self):
         """Событие, которое выполняется при нажатии на кнопку "Удалить"."""
         contact: Contact | None = self.delete_panel.current_contact
         if contact is not None:
-            if self.deleteContact(contact):
-                if not self.updateData(self.filter):  # Обновляем список контактов клиента.
-                    self.close_connection()
-            else:
-                self.close_connection()
+            self.deleteContact(contact, callback=lambda success: None if success else self.close_connection())
+
+    def search(self):
+        """Показывает контакты, удовлетворяющие фильтру панели поиска. Если их нельзя найти без обращения к серверу, 
+        запрашивает их после паузы во вводе: изменения фильтра, сделанные до истечения паузы, объединяются в один запрос."""
+        if self.__search_after_id is not None:
+            self.after_cancel(self.__search_after_id)
+            self.__search_after_id = None
+        if not self.__refine():
+            self.__search_after_id = self.after(self.SEARCH_DELAY, self.__onSearch)
+
+    def __onSearch(self):
+        self.__search_after_id = None
+        filter: Filter | None = self.filter
+        # До первой подписки фильтр будет учтён при её запросе.
+        if not self.__refine() and self.__subscription and filter != self.__requested_filter:
+            self.__view_filter = filter
+            self.updateData(filter)
 
     @property
     def selected_contact(self) -> Contact | None:
@@ -113,152 +293,134 @@ class ClientForm(Tk):
     @phonebook.setter
     def phonebook(self, new_phonebook: list[Contact]):
         self.__phonebook = new_phonebook
-
-        self.table.table.unbind('<<TreeviewSelect>>', self.__selected_bind)
-        self.table.setData(self.phonebook)
-        '''---------Восстанавливаем выбор строки---------'''
-        if self.selected_contact is not None:
-            self.table.selectContact(self.selected_contact)
-        else:
-            self.selected_contact = None
-        '''----------------------------------------------'''
-        self.__selected_bind = self.table.table.bind('<<TreeviewSelect>>', self.__onSelected)
+        self.__paged = None
+        self.table.setData(self.phonebook)  # Таблица сохраняет выбор строки.
 
     def close_connection(self):
         self.add_panel.setEnabled(False)
-        self.stopAutoupdate()
-        if self.__socket is not None:
-            self.__socket.close()
-            self.__socket = None
-        self.table.clear()
-        self.connection_bar.setText('Соединение отсутствует! Попробуйте переподключиться!')
+        self.stopListening()
+        if self.__network is not None:
+            self.__network.close()
+            self.__network = None
+        self.__notifications.clear()
+        self.__revision = None
+        self.__requested_filter = None
+        self.__subscription = 0
+        self.__loading = 0
+        self.__paging = False
+        self.__paged = None
+        self.__showReplica()
+        self.connection_bar.setText('Соединение отсутствует! Попробуйте переподключиться!{0}'.format(self.__replica_status))
         self.connection_bar.setEnabled(True)
 
-    def connect(self) -> bool:
-        if self.__socket is None:
-            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            address: tuple[str, int] = (self.connection_bar.host, PORT)
-            try:
-                self.__socket.connect(address)  # Подключаемся к серверному сокету.
-            except Exception as error:
-                self.__socket.close()
-                self.__socket = None
-                self.connection_bar.setText('Соединение не установлено. Ошибка: {0}.'.format(error))
-                return False
-            else:  # Если исключения не было.
-                self.connection_bar.setEnabled(False)
-                self.add_panel.setEnabled(True)
-                self.connection_bar.setText('Соединение с сервером успешно установлено.')
-                return True
-        else:
-            return False
-
     def destroy(self):
+        if self.__search_after_id is not None:
+            self.after_cancel(self.__search_after_id)
+            self.__search_after_id = None
         self.close_connection()
+        if self.__replica is not None:
+            self.__replica.close()
+            self.__replica = None
         super().destroy()
 
-    def updateData(self, filter: Filter | None) -> bool:
-        """Обновляет список контактов клиента."""
-        request = ClientRequest(command=Commands.UPDATE, data=filter)
-        dump = pickle.dumps(request)  # Сериализация.
-        try:
-            self.__socket.send(dump)  # Отправляем сообщение.
-        except Exception as error:
-            print('Функция: socket.send. Ошибка: {0}.'.format(error))
-            return False
-        else:  # Если исключения не было.
-            try:
-                data = self.__socket.recv(1024)  # Получаем список телефонных номеров.
-            except Exception as error:
-                print('Функция: socket.recv. Ошибка: {0}.'.format(error))
-                return False
-            else:  # Если исключения не было.
-                if data == b'':
-                    print('Сервер вернул пустой ответ!')
-                    return False
+    def updateData(self, filter: Filter | None):
+        """Обновляет список контактов клиента и подписывается на уведомления об изменениях контактов, удовлетворяющих фильтру.
+
+        Если фильтр не изменился, запрашивает у сервера только изменения, произошедшие после известной клиенту ревизии.
+        Ответ обрабатывается асинхронно; ответы на запросы, после которых был отправлен новый, отбрасываются."""
+        if self.__network is None:
+            return
+        if self.__paging:
+            request = ClientRequest(command=Commands.SUBSCRIBE,
+                                    data=Query(filter=filter, sort=self.SORT, limit=PagedContacts.PAGE_SIZE))
+        else:
+            revision: int | None = self.__revision if filter == self.__synced_filter else None
+            if revision is None and filter is None and self.__replica is not None:
+                # Данные без фильтра применяются к локальной копии (__applyData), поэтому достаточно изменений после её ревизии.
+                revision = self.__replica.revision
+            request = ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest(filter=filter, revision=revision))
+        self.__subscription += 1
+        subscription: int = self.__subscription
+        self.__requested_filter = filter
+        self.__loading += 1
+
+        def __onResponse(response: ServerResponse):
+            self.__loading -= 1
+            if not response.flag:
+                print('Ошибка выполнения запроса ({0}) на сервере!'.format(response.command))
+                self.close_connection()
+                return
+            if subscription == self.__subscription:  # Ответ на последний запрос подписки.
+                if isinstance(response.data, Page):
+                    self.__phonebook = []
+                    self.__paged = PagedContacts(self.__fetchPage, request.data, response.data, on_load=self.table.refresh)
+                    self.table.setData(self.__paged)
                 else:
-                    response = pickle.loads(data)
-                    if isinstance(response, ServerResponse):
-                        if response.command == Commands.UPDATE:
-                            if response.flag:
-                                self.phonebook = response.data
-                                return True
-                            else:
-                                print('Ошибка выполнения запроса ({0}) на сервере!'.format(response.command))
-                                return False
-                        else:
-                            print('Ответ сервера ({0}) не соответствует запросу ({1})!'.format(response.command, Commands.UPDATE))
-                            return False
-                    else:
-                        print('Некорректный тип сообщения от сервера ({0})!'.format(type(response)))
-                        return False
-
-    def addContact(self, new_contact: Contact) -> bool:
-        """Добавляет контакт в телефонную книгу."""
+                    self.__applyData(response.data, filter)
+                self.__revision = response.data.revision
+                self.__synced_filter = filter
+            self.__processNotifications()
+
+        self.__network.request(request, __onResponse)
+
+    def __query(self, query: Query, callback: Callable[[Page | None], None]):
+        """Запрашивает страницу контактов (без подписки на изменения). callback получит None при ошибке на сервере."""
+        if self.__network is None:
+            return
+        self.__loading += 1
+
+        def __onResponse(response: ServerResponse):
+            self.__loading -= 1
+            if response.flag:
+                callback(response.data)
+            else:
+                print('Ошибка выполнения запроса страницы на сервере ({0})!'.format(response.data))
+                callback(None)
+            self.__processNotifications()
+
+        self.__network.request(ClientRequest(command=Commands.UPDATE, data=query), __onResponse)
+
+    def __fetchPage(self, query: Query, callback: Callable[[Page], None]):
+        """Запрашивает страницу для PagedContacts. При ошибке соединение закрывается."""
+        def __onPage(page: Page | None):
+            if page is None:
+                self.close_connection()
+            else:
+                callback(page)
+
+        self.__query(query, __onPage)
+
+    def countContacts(self, callback: Callable[[int | None], None], filter: Filter | None = None):
+        """Запрашивает число удовлетворяющих фильтру контактов.
+        callback получит None, если сервер не поддерживает такой запрос."""
+        self.__query(Query(filter=filter, count_only=True), lambda page: callback(None if page is None else page.total))
+
+    def addContact(self, new_contact: Contact, callback: Callable[[bool], None]):
+        """Добавляет контакт в телефонную книгу. callback получит результат выполнения запроса."""
+        if self.__network is None:
+            return
         print('Запрос на добавление {0}.'.format(str(new_contact)))
-        request = ClientRequest(command=Commands.ADD, data=new_contact)
-        dump = pickle.dumps(request)  # Сериализация.
-        try:
-            self.__socket.send(dump)  # Отправляем сообщение.
-        except ConnectionResetError as cre:
-            print('Функция: socket.send. Ошибка: {0}.'.format(cre))
-            return False
-        except Exception as error:
-            print('Функция: socket.send. Ошибка: {0}.'.format(error))
-            return False
-        else:  # Если исключения не было.
-            try:
-                data = self.__socket.recv(1024)  # Получаем список телефонных номеров.
-            except Exception as error:
-                print('Функция: socket.recv. Ошибка: {0}.'.format(error))
-                return False
-            else:  # Если исключения не было.
-                response = pickle.loads(data)
-                if isinstance(response, ServerResponse):
-                    if response.command == Commands.ADD:
-                        if response.flag:
-                            print('Добавление успешно выполнено.')
-                            return True
-                        else:
-                            print('Ошибка выполнения запроса ({0}) на сервере!'.format(response.command))
-                            return False
-                    else:
-                        print('Ответ сервера ({0}) не соответствует запросу ({1})!'.format(response.command, request.command))
-                        return False
-                else:
-                    print('Некорректный тип сообщения от сервера ({0})!'.format(type(response)))
-                    return False
 
-    def deleteContact(self, contact: Contact) -> bool:
-        """Удаляет контакт из телефонной книги."""
-        request = ClientRequest(command=Commands.DELETE, data=contact)
-        dump = pickle.dumps(request)  # Сериализация.
-        try:
-            self.__socket.send(dump)  # Отправляем сообщение.
-        except Exception as error:
-            print('Функция: socket.send. Ошибка: {0}.'.format(error))
-            return False
-        else:  # Если исключения не было.
-            try:
-                data = self.__socket.recv(1024)  # Получаем список телефонных номеров.
-            except Exception as error:
-                print('Функция: socket.recv. Ошибка: {0}.'.format(error))
-                return False
-            else:  # Если исключения не было.
-                response = pickle.loads(data)
-                if isinstance(response, ServerResponse):
-                    if response.command == Commands.DELETE:
-                        if response.flag:
-                            return True
-                        else:
-                            print('Ошибка выполнения запроса ({0}) на сервере!'.format(response.command))
-                            return False
-                    else:
-                        print('Ответ сервера ({0}) не соответствует запросу ({1})!'.format(response.command, request.command))
-                        return False
-                else:
-                    print('Некорректный тип сообщения от сервера ({0})!'.format(type(response)))
-                    return False
+        def __onResponse(response: ServerResponse):
+            if response.flag:
+                print('Добавление успешно выполнено.')
+            else:
+                print('Контакт с номером {0} уже существует.'.format(new_contact.number))
+            callback(response.flag)
+
+        self.__network.request(ClientRequest(command=Commands.ADD, data=new_contact), __onResponse)
+
+    def deleteContact(self, contact: Contact, callback: Callable[[bool], None]):
+        """Удаляет контакт из телефонной книги. callback получит результат выполнения запроса."""
+        if self.__network is None:
+            return
+
+        def __onResponse(response: ServerResponse):
+            if not response.flag:
+                print('Ошибка выполнения запроса ({0}) на сервере!'.format(response.command))
+            callback(response.flag)
+
+        self.__network.request(ClientRequest(command=Commands.DELETE, data=contact), __onResponse)
 
 
 class Columns(enum.Enum):
@@ -300,65 +462,428 @@ class ConnectionBar(Frame):
         return self.var.get()
 
 
+class NetworkEvents(enum.Enum):
+    """События сетевых потоков клиента."""
+    CONNECTED = 1
+    FAILED = 2  # Соединение не установлено.
+    NOTIFY = 3  # Уведомление сервера.
+    RESPONSE = 4  # Ответ на запрос (или ошибка его выполнения).
+    CLOSED = 5  # Соединение разорвано.
+
+
+class NetworkWorker:
+    """Соединение с сервером (PhonebookClient), события которого обрабатываются в главном потоке.
+
+    Фоновый поток подключается к серверу и отправляет запросы, ответы и уведомления принимает поток чтения
+    PhonebookClient. События потоков передаются через очередь и обрабатываются методом poll(), поэтому обратные вызовы
+    выполняются в вызывающем его (главном) потоке. Запросы отправляются, не дожидаясь ответов на предыдущие, а сервер
+    может отвечать на них в любом порядке."""
+    def __init__(self, host: str, on_connect: Callable[[str | None], None], on_notify: Callable[[Delta], None],
+                 on_close: Callable[[], None], timeout: float, compression: list[Compression]):
+        self.__on_connect: Callable[[str | None], None] = on_connect  # Получает описание ошибки или None.
+        self.__on_notify: Callable[[Delta], None] = on_notify
+        self.__on_close: Callable[[], None] = on_close  # Вызывается при разрыве соединения, но не при вызове close().
+        self.__timeout: float = timeout
+        self.__events: queue.Queue[tuple[NetworkEvents, object]] = queue.Queue()
+        self.__requests: queue.Queue[tuple[int, ClientRequest] | None] = queue.Queue()  # None завершает поток отправки.
+        # Запросы, ожидающие ответа, с обратными вызовами и временем отправки, по номерам в порядке отправки.
+        # Используется только в главном потоке.
+        self.__pending: dict[int, tuple[ClientRequest, Callable[[ServerResponse], None], float]] = {}
+        self.__next_number: int = 1
+        self.__closed: bool = False
+        self.__client = PhonebookClient(host=host, timeout=timeout, attempts=1, compression=compression,
+                                        on_notify=lambda delta: self.__events.put((NetworkEvents.NOTIFY, delta)),
+                                        on_disconnect=lambda: self.__events.put((NetworkEvents.CLOSED, None)))
+        threading.Thread(target=self.__sendLoop, daemon=True).start()
+
+    @property
+    def handshake(self) -> Handshake | None:
+        """Параметры соединения, согласованные с сервером."""
+        return self.__client.handshake
+
+    def __sendLoop(self):
+        """Подключается к серверу и отправляет запросы. Выполняется в отдельном потоке."""
+        try:
+            self.__client.connect()
+        except Exception as error:
+            self.__events.put((NetworkEvents.FAILED, str(error)))
+            return
+        self.__events.put((NetworkEvents.CONNECTED, None))
+        while (item := self.__requests.get()) is not None:
+            number, request = item
+            try:
+                future: concurrent.futures.Future = self.__client.submit(request)
+            except ConnectionError:
+                break  # Соединение закрыто.
+            # Ответ передаётся в очередь потоком чтения, поэтому сохраняет порядок относительно уведомлений.
+            future.add_done_callback(lambda future, number=number: self.__events.put((NetworkEvents.RESPONSE, (number, future))))
+
+    def request(self, request: ClientRequest, callback: Callable[[ServerResponse], None]):
+        """Ставит запрос в очередь отправки. callback будет вызван из poll() с ответом сервера."""
+        if not self.__closed:
+            number: int = self.__next_number
+            self.__next_number += 1
+            self.__pending[number] = (request, callback, time.monotonic())
+            self.__requests.put((number, request))
+
+    def poll(self) -> bool:
+        """Обрабатывает события сетевых потоков, вызывая обратные вызовы. Возвращает False, если соединение закрыто."""
+        while not self.__closed:
+            try:
+                event, data = self.__events.get_nowait()
+            except queue.Empty:
+                if self.__pending:
+                    request, callback, sent = next(iter(self.__pending.values()))  # Самый давний запрос.
+                    if time.monotonic() - sent > self.__timeout:
+                        print('Сервер не ответил на запрос ({0})!'.format(request.command))
+                        self.__fail()
+                break
+            if event == NetworkEvents.CONNECTED:
+                self.__on_connect(None)
+            elif event == NetworkEvents.FAILED:
+                self.__closed = True
+                self.__on_connect(data)
+            elif event == NetworkEvents.CLOSED:
+                self.__fail()
+            elif event == NetworkEvents.NOTIFY:
+                self.__on_notify(data)
+            else:
+                number, future = data
+                if number not in self.__pending:
+                    continue  # Ответ на запрос, отправленный до разрыва соединения.
+                request, callback, sent = self.__pending.pop(number)
+                if future.exception() is not None:
+                    print('Ошибка выполнения запроса ({0}): {1}.'.format(request.command, future.exception()))
+                    self.__fail()
+                elif future.result().command != request.command:
+                    print('Неожиданное сообщение от сервера ({0})!'.format(future.result().command))
+                    self.__fail()
+                else:
+                    callback(future.result())
+        return not self.__closed
+
+    def __fail(self):
+        self.close()
+        self.__on_close()
+
+    def close(self):
+        """Закрывает соединение. Ответы на отправленные запросы больше не обрабатываются."""
+        self.__closed = True
+        self.__pending.clear()
+        self.__requests.put(None)
+        self.__client.close()
+
+
+class PagedContacts:
+    """Последовательность контактов, загружаемых с сервера страницами по мере обращения к ним.
+
+    Хранится только загруженное начало выборки. Страницы запрашиваются по курсору (keyset pagination), поэтому для
+    обращения к строкам далеко за загруженными они запрашиваются крупными порциями по JUMP_PAGE_SIZE. Изменения
+    применяются к загруженным строкам с сохранением порядка; контакт, место которого находится за последней
+    загруженной строкой, будет получен со следующей страницей.
+
+    Страницы загружаются асинхронно: обращение к ещё не загруженным строкам запрашивает страницу и возвращает только
+    загруженные контакты, а после получения страницы вызывается on_load."""
+    PAGE_SIZE: int = 500
+    JUMP_PAGE_SIZE: int = 10000
+
+    def __init__(self, fetch: Callable[[Query, Callable[[Page], None]], None], query: Query, page: Page,
+                 on_load: Callable[[], None]):
+        self.__fetch: Callable[[Query, Callable[[Page], None]], None] = fetch  # Запрос страницы у сервера.
+        self.__on_load: Callable[[], None] = on_load
+        self.query: Query = query
+        self.__loading: bool = False  # Запрошена ли следующая страница.
+        self.__contacts: list[Contact] = []
+        self.__keys: list[tuple[str, str]] = []  # Ключи сортировки загруженных контактов.
+        self.__cursor: str | None = None
+        self.__boundary: tuple[str, str] | None = None  # Ключ последнего контакта последней загруженной страницы.
+        self.total: int = 0
+        self.__total_revision: int = 0  # Ревизия, которой соответствует total.
+        self.__addPage(page)
+
+    def __key(self, contact: Contact) -> tuple[str, str]:
+        return getattr(contact, self.query.sort), contact.number
+
+    def __addPage(self, page: Page):
+        self.__contacts.extend(page.contacts)
+        self.__keys.extend(self.__key(contact) for contact in page.contacts)
+        self.__cursor = page.cursor
+        if page.contacts:
+            self.__boundary = self.__key(page.contacts[-1])
+        if page.revision >= self.__total_revision:
+            self.total = page.total
+            self.__total_revision = page.revision
+
+    @property
+    def complete(self) -> bool:
+        """Загружены ли все контакты."""
+        return self.__cursor is None
+
+    def __load(self, stop: int):
+        """Запрашивает следующую страницу, если загружено меньше stop контактов. Пока страница не получена, новые
+        запросы не отправляются; после её получения on_load приведёт к повторному обращению за строками."""
+        if len(self.__contacts) < stop and not self.complete and not self.__loading:
+            limit: int = self.PAGE_SIZE if stop - len(self.__contacts) <= self.PAGE_SIZE else self.JUMP_PAGE_SIZE
+            self.__loading = True
+            self.__fetch(Query(filter=self.query.filter, sort=self.query.sort, descending=self.query.descending,
+                               limit=limit, cursor=self.__cursor), self.__onPage)
+
+    def __onPage(self, page: Page):
+        self.__loading = False
+        self.__addPage(page)
+        self.__on_load()
+
+    def __position(self, key: tuple[str, str]) -> int:
+        """Позиция, на которой контакт с ключом key находится (или должен находиться) среди загруженных."""
+        if not self.query.descending:
+            return bisect.bisect_left(self.__keys, key)
+        low, high = 0, len(self.__keys)
+        while low < high:
+            middle: int = (low + high) // 2
+            if self.__keys[middle] > key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __discard(self, contact: Contact):
+        key: tuple[str, str] = self.__key(contact)
+        position: int = self.__position(key)
+        if position < len(self.__keys) and self.__keys[position] == key:
+            del self.__keys[position]
+            del self.__contacts[position]
+
+    def apply(self, delta: Delta):
+        """Применяет изменения. Изменения, уже учтённые в загруженных страницах, применяются повторно без последствий."""
+        for contact in delta.deleted:
+            self.__discard(contact)
+        for contact in delta.inserted:
+            self.__discard(contact)
+            key: tuple[str, str] = self.__key(contact)
+            if self.complete or (key >= self.__boundary if self.query.descending else key <= self.__boundary):
+                position: int = self.__position(key)
+                self.__keys.insert(position, key)
+                self.__contacts.insert(position, contact)
+
+        if delta.since >= self.__total_revision:
+            self.total += len(delta.inserted) - len(delta.deleted)
+            self.__total_revision = delta.revision
+        elif delta.revision > self.__total_revision:  # Изменения частично учтены в total, подсчитываем заново.
+            self.__fetch(Query(filter=self.query.filter, count_only=True), self.__onCount)
+
+    def __onCount(self, page: Page):
+        if page.revision >= self.__total_revision:
+            self.total = page.total
+            self.__total_revision = page.revision
+            self.__on_load()
+
+    def __len__(self) -> int:
+        return len(self.__contacts) if self.complete else max(self.total, len(self.__contacts))
+
+    def __getitem__(self, index: int | slice) -> Contact | list[Contact]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            self.__load(stop)
+            return self.__contacts[index]
+        else:
+            self.__load(index + 1 if index >= 0 else len(self))
+            return self.__contacts[index]
+
+
 class Table(Frame):
-    """Таблица."""
-    def __init__(self, parent: ClientForm, phonebook: list[Contact] | None = None):
+    """Таблица.
+
+    Элементы ttk.Treeview создаются только для строк, помещающихся в окне, и при прокрутке заполняются данными
+    других строк. Поэтому время перерисовки и расход памяти зависят от высоты окна, а не от размера телефонной книги.
+    Таблица не копирует данные: строки читаются из последовательности контактов (списка или PagedContacts,
+    загружающего страницы с сервера) по мере прокрутки.
+
+    Элемент таблицы соответствует номеру телефона. При перерисовке удаляются только элементы ушедших из окна
+    контактов, добавляются элементы появившихся и обновляются значения изменившихся, поэтому перерисовка без
+    изменений не обращается к ttk.Treeview."""
+    ROW_HEIGHT: int = 20  # Высота строки [пиксели].
+    OVERSCAN: int = 10  # Сколько строк за пределами окна запрашивается у последовательности заранее.
+    WHEEL_STEP: int = 3  # На сколько строк прокручивает таблицу один шаг колеса мыши.
+
+    def __init__(self, parent: ClientForm, phonebook: Sequence[Contact] | None = None):
         super().__init__(master=parent, borderwidth=1, relief=SOLID)
 
-        '''Все строки, состоящие только из цифр и начинающиеся с нулей, ttk.Treeview при чтении значений из ячеек 
-        автоматически конвертирует в int, отсекая нули в начале. Поэтому, чтобы недопустить ошибок, отображаемые данные 
-        необходимо куда-то дублировать.'''
-        self.__phonebook: list[Contact] = []
+        '''Все строки, состоящие только из цифр и начинающиеся с нулей, ttk.Treeview при чтении значений из ячеек
+        автоматически конвертирует в int, отсекая нули в начале. Поэтому отображаемые контакты хранятся в __shown.'''
+        self.__contacts: Sequence[Contact] = []
+        self.__rows: list[Contact] = []  # Отображаемые контакты по порядку.
+        self.__items: dict[str, str] = {}  # Номер телефона → идентификатор элемента таблицы.
+        self.__shown: dict[str, Contact] = {}  # Идентификатор элемента → отображаемый в нём контакт.
+        self.__next_item: int = 0  # Счётчик для идентификаторов новых элементов.
+        self.__selected_item: str | None = None  # Выделенный элемент таблицы.
+        self.__scroll: tuple[float, float] | None = None  # Положение, установленное полосе прокрутки.
+        self.__top: int = 0  # Индекс первой отображаемой строки.
+        self.__visible: int = 1  # Сколько строк помещается в окне.
+        self.__selected: Contact | None = None
 
         title = Label(master=self, text='ТЕЛЕФОННАЯ КНИГА')
         title.pack(side=TOP, fill=X)
 
-        self.table = ttk.Treeview(master=self, columns=tuple(Columns.__members__.keys()), show='headings', selectmode='browse')
+        ttk.Style(self).configure('Phonebook.Treeview', rowheight=self.ROW_HEIGHT)
+        self.table = ttk.Treeview(master=self, columns=tuple(Columns.__members__.keys()), show='headings',
+                                  selectmode='browse', style='Phonebook.Treeview')
+        self.scrollbar = ttk.Scrollbar(master=self, orient=VERTICAL, command=self.__onScroll)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
         self.table.pack(fill=BOTH, expand=True)
 
         for column in Columns:
             self.table.heading(column=str(column.name), text=column.value)
 
+        self.table.bind('<Configure>', self.__onResize)
+        self.table.bind('<<TreeviewSelect>>', self.__onTreeviewSelect)
+        self.table.bind('<MouseWheel>', self.__onMouseWheel)
+        self.table.bind('<Button-4>', lambda event: self.scrollTo(self.__top - self.WHEEL_STEP))
+        self.table.bind('<Button-5>', lambda event: self.scrollTo(self.__top + self.WHEEL_STEP))
+        self.table.bind('<Up>', lambda event: self.__moveSelection(-1))
+        self.table.bind('<Down>', lambda event: self.__moveSelection(1))
+        self.table.bind('<Prior>', lambda event: self.__moveSelection(-self.__visible))
+        self.table.bind('<Next>', lambda event: self.__moveSelection(self.__visible))
+        self.table.bind('<Home>', lambda event: self.__moveSelection(-len(self.__contacts)))
+        self.table.bind('<End>', lambda event: self.__moveSelection(len(self.__contacts)))
+
         if phonebook is not None:
-            self.add(phonebook)  # Добавляем строки в таблицу.
+            self.setData(phonebook)
 
     def clear(self):
         """Очищает таблицу."""
-        self.table.delete(*self.table.get_children())
-        self.__phonebook.clear()
-
-    def add(self, phones: list[Contact]):
-        """Добавляет строки в таблицу."""
-        for p in phones:
-            self.__phonebook.append(p)
-            row: int = len(self.__phonebook) - 1
-            self.table.insert('', END, text=str(row), values=(p.surname, p.name, p.patronymic, p.number, p.note))
-
-    def setData(self, phonebook: list[Contact]):
-        self.clear()  # Очищаем таблицу.
-        self.add(phonebook)  # Добавляем строки в таблицу.
-
-    def __getContactFromRowId(self, row_id: str) -> Contact:
-        pb_row: int = int(self.table.item(row_id)['text'])
-        return self.__phonebook[pb_row]
-
-    def selectContact(self, contact: Contact) -> bool:
-        for i in self.table.get_children():
-            current_contact: Contact = self.__getContactFromRowId(i)
-            if current_contact == contact:
-                self.table.selection_set(i)
-                return True
-        return False
+        self.setData([])
+
+    def setData(self, contacts: Sequence[Contact]):
+        """Отображает последовательность контактов, сохраняя положение прокрутки."""
+        self.__contacts = contacts
+        self.refresh()
+
+    def refresh(self):
+        """Перерисовывает видимые строки (например, после изменения последовательности контактов)."""
+        count: int = len(self.__contacts)
+        self.__top = max(0, min(self.__top, count - self.__visible))
+        rows: list[Contact] = list(self.__contacts[self.__top:self.__top + self.__visible + self.OVERSCAN][:self.__visible])
+        numbers: list[str] = [p.number for p in rows]
+
+        if numbers != [p.number for p in self.__rows]:  # Изменился состав или порядок строк.
+            kept: set[str] = set(numbers)
+            removed: list[str] = [number for number in self.__items if number not in kept]
+            if removed:
+                self.table.delete(*(self.__items[number] for number in removed))
+                for number in removed:
+                    del self.__shown[self.__items.pop(number)]
+            # Если оставшиеся строки сохранили взаимный порядок, новые строки вставляются на свои места без перестановок.
+            reorder: bool = ([p.number for p in self.__rows if p.number in self.__items]
+                             != [number for number in numbers if number in self.__items])
+            for position, p in enumerate(rows):
+                item: str | None = self.__items.get(p.number)
+                if item is None:
+                    item = 'I{0}'.format(self.__next_item)
+                    self.__next_item += 1
+                    self.table.insert('', position, iid=item, values=(p.surname, p.name, p.patronymic, p.number, p.note))
+                    self.__items[p.number] = item
+                    self.__shown[item] = p
+                elif reorder:
+                    self.table.move(item, '', position)
+
+        for p in rows:
+            item: str = self.__items[p.number]
+            shown: Contact = self.__shown[item]
+            if shown is not p and shown != p:
+                self.table.item(item, values=(p.surname, p.name, p.patronymic, p.number, p.note))
+            self.__shown[item] = p
+        self.__rows = rows
+
+        selected_item: str | None = None
+        if self.__selected is not None:
+            item: str | None = self.__items.get(self.__selected.number)
+            if item is not None and self.__shown[item] == self.__selected:
+                selected_item = item
+        if selected_item != self.__selected_item:
+            if selected_item is not None:
+                self.table.selection_set(selected_item)
+            elif self.table.selection():
+                self.table.selection_remove(*self.table.selection())
+            self.__selected_item = selected_item
+
+        if count > 0:
+            scroll: tuple[float, float] = (self.__top / count, min(1.0, (self.__top + self.__visible) / count))
+        else:
+            scroll: tuple[float, float] = (0.0, 1.0)
+        if scroll != self.__scroll:
+            self.scrollbar.set(*scroll)
+            self.__scroll = scroll
+
+    def scrollTo(self, top: int):
+        """Прокручивает таблицу так, чтобы первой отображалась строка с индексом top."""
+        if top != self.__top:
+            self.__top = top
+            self.refresh()
+
+    def __onScroll(self, action: str, value: str, unit: str | None = None):
+        """Команда полосы прокрутки."""
+        if action == 'moveto':
+            self.scrollTo(int(float(value) * len(self.__contacts)))
+        elif unit == 'pages':
+            self.scrollTo(self.__top + int(value) * self.__visible)
+        else:
+            self.scrollTo(self.__top + int(value))
+
+    def __onMouseWheel(self, event: Event):
+        if event.delta:
+            self.scrollTo(self.__top + (-self.WHEEL_STEP if event.delta > 0 else self.WHEEL_STEP))
+
+    def __onResize(self, event: Event):
+        items: tuple[str, ...] = self.table.get_children()
+        bbox = self.table.bbox(items[0]) if items else None
+        header: int = bbox[1] if bbox else self.ROW_HEIGHT  # Первая строка начинается сразу под заголовками столбцов.
+        visible: int = max(1, (event.height - header) // self.ROW_HEIGHT)
+        if visible != self.__visible:
+            self.__visible = visible
+            self.refresh()
+
+    def __onTreeviewSelect(self, event: Event):
+        """Событие выбора строки. Выбранный контакт остаётся выбранным и после того, как его строка уйдёт из окна."""
+        items: tuple[str, ...] = self.table.selection()
+        if items:
+            self.__selected = self.__shown[items[0]]
+            self.__selected_item = items[0]
+        elif self.__selected_item is not None:
+            self.__selected = None  # Пользователь снял выбор с видимой строки.
+            self.__selected_item = None
+        self.event_generate('<<ContactSelect>>')
+
+    def __moveSelection(self, step: int) -> str:
+        """Перемещает выбор на step строк, прокручивая таблицу при необходимости."""
+        count: int = len(self.__contacts)
+        if count == 0:
+            return 'break'
+        if self.__selected_item is not None:
+            index: int = self.__top + self.__rows.index(self.__shown[self.__selected_item]) + step
+        else:
+            index: int = self.__top if step > 0 else self.__top + len(self.__rows) - 1
+        index = max(0, min(index, count - 1))
+        if index < self.__top:
+            self.__top = index
+        elif index >= self.__top + self.__visible:
+            self.__top = index - self.__visible + 1
+        rows: Sequence[Contact] = self.__contacts[index:index + 1]
+        if rows:
+            self.__selected = rows[0]
+        self.refresh()
+        if self.table.selection():
+            self.table.focus(self.table.selection()[0])
+        self.event_generate('<<ContactSelect>>')
+        return 'break'  # Стандартная обработка клавиш ttk.Treeview не знает о строках за пределами окна.
+
+    def selectContact(self, contact: Contact | None):
+        """Выбирает контакт. Строка контакта будет выделена, когда окажется в окне."""
+        self.__selected = contact
+        self.refresh()
 
     def getSelectedContact(self) -> Contact | None:
         """Возвращает выбранный контакт."""
-        row_id_list: tuple[str, ...] = self.table.selection()
-        if row_id_list:
-            row_id: str = row_id_list[0]
-            pb_row: int = int(self.table.item(row_id)['text'])
-            return self.__phonebook[pb_row]
-        else:
-            return None
+        return self.__selected
 
 
 class EntryBar(Frame):
@@ -487,7 +1012,7 @@ class SearchPanel(Frame):
         self.var = StringVar()
 
         def __onEntryChanged(*args):
-            parent.updateData(filter=self.filter)  # Обновляем список контактов клиента.
+            parent.search()  # Обновляем список контактов клиента после паузы во вводе.
 
         self.var.trace("w", __onEntryChanged)
 
@@ -495,7 +1020,7 @@ class SearchPanel(Frame):
         title.pack(side=TOP)
 
         def onSelected(event):
-            parent.updateData(filter=self.filter)  # Обновляем список контактов клиента.
+            parent.search()  # Обновляем список контактов клиента после паузы во вводе.
 
         field_frame = Frame(master=self)
         field_label = Label(master=field_frame, text='Поле:')
@@ -1,8 +1,24 @@
+import array
+import asyncio
+import base64
 import enum
+import io
+import itertools
+import json
+import lzma
+import operator
+import pickle
+import socket
+import struct
+import sys
+import zlib
 
 HOST: str = ''  # Строка, представляющая либо имя хоста в нотации домена Интернета, либо IPv4-адрес.
 PORT: int = 12333
 
+CHUNK_SIZE: int = 64 * 1024  # Максимальный размер полезной нагрузки одного кадра [байт].
+FRAME_HEADER = struct.Struct('!BI')  # Заголовок кадра: тип кадра и длина полезной нагрузки.
+
 
 class Contact:
     def __init__(self, name: str, surname: str, patronymic: str, number: str, note: str):
@@ -28,21 +44,959 @@ class Filter:
         self.field: str | None = field
         self.text: str | None = text
 
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Filter):
+            return self.field == other.field and self.text == other.text
+        else:
+            return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self.field, self.text))
+
+    @staticmethod
+    def normalize(filter: 'Filter | None') -> 'Filter | None':
+        """Возвращает None для фильтра, не накладывающего ограничений."""
+        return None if filter is None or filter.field is None or filter.text is None else filter
+
+    def match(self, contact: Contact) -> bool:
+        """Проверяет, удовлетворяет ли контакт фильтру (поиск подстроки с учётом регистра)."""
+        if self.field is None or self.text is None:
+            return True
+        value: str | None = getattr(contact, self.field)
+        return value is not None and self.text in value
+
 
 class Commands(enum.Enum):
     ADD = 1
     DELETE = 2
     UPDATE = 3
+    SUBSCRIBE = 4  # Получение данных и подписка на уведомления об изменениях.
+    NOTIFY = 5  # Уведомление об изменениях, отправляемое сервером подписанным клиентам без запроса.
+    BULK_IMPORT = 6  # Потоковая загрузка контактов в формате BulkFormat.
+    EXPORT = 7  # Потоковая выгрузка контактов в формате BulkFormat.
+    HELLO = 8  # Согласование параметров соединения (Handshake).
+    STATS = 9  # Показатели работы сервера (словарь, см. metrics.ServerMetrics).
+    BATCH = 10  # Пакет изменений, выполняемых одной транзакцией (BatchRequest).
+
+
+class UpdateRequest:
+    """Запрос обновления данных.
+
+    Если указана ревизия, сервер вернёт только изменения, произошедшие после неё (Delta), иначе — все
+    удовлетворяющие фильтру контакты (Snapshot)."""
+    def __init__(self, filter: Filter | None = None, revision: int | None = None):
+        self.filter: Filter | None = filter
+        self.revision: int | None = revision
+
+
+class Query:
+    """Запрос одной страницы удовлетворяющих фильтру контактов, упорядоченных по полю sort, а при равенстве — по номеру.
+
+    Следующая страница запрашивается с курсором cursor из предыдущей страницы Page. Курсор содержит ключ сортировки 
+    последнего контакта страницы, поэтому сервер продолжает выборку с него по индексу (keyset pagination), и стоимость 
+    запроса не зависит от того, насколько далеко пролистана телефонная книга. Если count_only == True, возвращается 
+    только число контактов."""
+    SORT_FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number')  # Поле note может быть пустым (NULL).
+    PAGE_SIZE: int = 100
+
+    def __init__(self, filter: Filter | None = None, sort: str = 'number', descending: bool = False,
+                 limit: int = PAGE_SIZE, cursor: str | None = None, count_only: bool = False):
+        self.filter: Filter | None = filter
+        self.sort: str = sort
+        self.descending: bool = descending
+        self.limit: int = limit  # Размер страницы.
+        self.cursor: str | None = cursor
+        self.count_only: bool = count_only
+
+    def __key(self) -> tuple:
+        return Filter.normalize(self.filter), self.sort, self.descending, self.limit, self.cursor, self.count_only
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Query):
+            return self.__key() == other.__key()
+        else:
+            return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.__key())
+
+    def encodeCursor(self, contact: Contact) -> str:
+        """Возвращает курсор страницы, следующей за контактом contact."""
+        data: str = json.dumps([self.sort, self.descending, getattr(contact, self.sort), contact.number], ensure_ascii=False)
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decodeCursor(self) -> tuple[str, str] | None:
+        """Возвращает ключ сортировки (значение поля sort, номер), после которого начинается страница."""
+        if self.cursor is None:
+            return None
+        try:
+            sort, descending, value, number = json.loads(base64.urlsafe_b64decode(self.cursor))
+        except (ValueError, TypeError):
+            raise ValueError('Некорректный курсор.')
+        if sort != self.sort or descending != self.descending:
+            raise ValueError('Курсор получен для другого порядка сортировки.')
+        return value, number
+
+
+class Page:
+    """Страница контактов. total — общее число удовлетворяющих фильтру контактов, cursor — курсор следующей страницы 
+    (None, если страница последняя)."""
+    def __init__(self, revision: int, total: int, contacts: list[Contact], cursor: str | None):
+        self.revision: int = revision
+        self.total: int = total
+        self.contacts: list[Contact] = contacts
+        self.cursor: str | None = cursor
+
+
+class Snapshot:
+    """Все удовлетворяющие фильтру контакты на момент ревизии revision."""
+    def __init__(self, revision: int, contacts: list[Contact]):
+        self.revision: int = revision
+        self.contacts: list[Contact] = contacts
+
+
+class Delta:
+    """Изменения, произошедшие между ревизиями since и revision."""
+    def __init__(self, since: int, revision: int, inserted: list[Contact], deleted: list[Contact]):
+        self.since: int = since
+        self.revision: int = revision
+        self.inserted: list[Contact] = inserted
+        self.deleted: list[Contact] = deleted
+
+    @property
+    def modified(self) -> bool:
+        return bool(self.inserted or self.deleted)
+
+    def apply(self, phonebook: list[Contact]) -> list[Contact]:
+        """Применяет изменения к списку контактов и возвращает новый список."""
+        deleted: set[str] = {contact.number for contact in self.deleted}
+        deleted.update(contact.number for contact in self.inserted)
+        result: list[Contact] = [contact for contact in phonebook if contact.number not in deleted]
+        result.extend(self.inserted)
+        return result
+
+
+class BulkFormat(enum.Enum):
+    """Формат массовой загрузки и выгрузки контактов."""
+    CSV = 'csv'  # Первая строка содержит названия полей.
+    JSONL = 'jsonl'  # Каждая строка — объект JSON с полями контакта.
+
+
+class BulkImport:
+    """Запрос массовой загрузки контактов.
+
+    Вслед за запросом клиент отправляет данные фрагментами: запросами BULK_IMPORT, поле data которых содержит байты 
+    файла. Фрагмент без данных (b'') завершает загрузку, после чего сервер отвечает отчётом ImportReport."""
+    def __init__(self, format: BulkFormat = BulkFormat.CSV):
+        self.format: BulkFormat = format
+
+
+class ExportRequest:
+    """Запрос массовой выгрузки контактов.
+
+    Сервер отвечает последовательностью ответов EXPORT, поле data которых содержит байты файла. Ответ без данных 
+    (None) завершает выгрузку."""
+    def __init__(self, filter: Filter | None = None, format: BulkFormat = BulkFormat.CSV):
+        self.filter: Filter | None = filter
+        self.format: BulkFormat = format
+
+
+class ImportConflict:
+    """Строка загружаемых данных, которая не была добавлена в телефонную книгу."""
+    def __init__(self, row: int, number: str | None, reason: str):
+        self.row: int = row  # Номер строки данных (без учёта заголовка), начиная с 1.
+        self.number: str | None = number
+        self.reason: str = reason
+
+    def __str__(self):
+        return 'Строка {0} ({1}): {2}'.format(self.row, self.number, self.reason)
+
+
+class ImportReport:
+    """Отчёт о массовой загрузке контактов.
+
+    Подробно перечисляются только первые MAX_CONFLICTS отклонённых строк, остальные лишь подсчитываются."""
+    MAX_CONFLICTS: int = 10000
+
+    def __init__(self):
+        self.imported: int = 0  # Сколько контактов добавлено.
+        self.rejected: int = 0  # Сколько строк отклонено.
+        self.conflicts: list[ImportConflict] = []
+        self.revision: int | None = None  # Ревизия телефонной книги после загрузки последнего контакта.
+
+    def reject(self, row: int, number: str | None, reason: str):
+        self.rejected += 1
+        if len(self.conflicts) < self.MAX_CONFLICTS:
+            self.conflicts.append(ImportConflict(row=row, number=number, reason=reason))
+
+    def __str__(self):
+        return 'Добавлено контактов: {0}. Отклонено строк: {1}.'.format(self.imported, self.rejected)
+
+
+class BatchAction(enum.Enum):
+    """Операция пакета изменений."""
+    INSERT = 'insert'  # Добавить контакт contact. Не выполняется, если номер уже занят.
+    UPSERT = 'upsert'  # Добавить контакт contact или заменить им контакт с тем же номером (редактирование).
+    DELETE = 'delete'  # Удалить контакт с номером number. Не выполняется, если такого номера нет.
+    DELETE_MATCHING = 'delete_matching'  # Удалить все контакты, удовлетворяющие фильтру filter.
+
+
+class BatchOperation:
+    """Операция пакета изменений. Заполняется только поле, нужное операции action."""
+    def __init__(self, action: BatchAction, contact: Contact | None = None, number: str | None = None,
+                 filter: Filter | None = None):
+        self.action: BatchAction = action
+        self.contact: Contact | None = contact
+        self.number: str | None = number
+        self.filter: Filter | None = filter
+
+    @staticmethod
+    def insert(contact: Contact) -> 'BatchOperation':
+        return BatchOperation(BatchAction.INSERT, contact=contact)
+
+    @staticmethod
+    def upsert(contact: Contact) -> 'BatchOperation':
+        return BatchOperation(BatchAction.UPSERT, contact=contact)
+
+    @staticmethod
+    def delete(number: str) -> 'BatchOperation':
+        return BatchOperation(BatchAction.DELETE, number=number)
+
+    @staticmethod
+    def deleteMatching(filter: Filter) -> 'BatchOperation':
+        return BatchOperation(BatchAction.DELETE_MATCHING, filter=filter)
+
+
+class BatchRequest:
+    """Пакет изменений. Операции выполняются по порядку (каждая видит результат предыдущих) и фиксируются одной 
+    транзакцией.
+
+    Если atomic == True и хотя бы одна операция не может быть выполнена (добавление занятого номера, удаление 
+    отсутствующего), не выполняется ни одна операция пакета. Иначе невыполнимые операции пропускаются."""
+    MAX_OPERATIONS: int = 10000
+
+    def __init__(self, operations: list[BatchOperation], atomic: bool = True):
+        self.operations: list[BatchOperation] = operations
+        self.atomic: bool = atomic
+
+
+class BatchResult:
+    """Результат пакета изменений.
+
+    results содержит для каждой операции число затронутых контактов (0 — операция не выполнена). committed == False, 
+    если атомарный пакет отменён; revision — ревизия телефонной книги после пакета."""
+    def __init__(self, results: list[int], committed: bool, revision: int):
+        self.results: list[int] = results
+        self.committed: bool = committed
+        self.revision: int = revision
+
+    @property
+    def failed(self) -> list[int]:
+        """Номера (индексы) невыполненных операций."""
+        return [index for index, result in enumerate(self.results) if not result]
+
+
+class Compression(enum.Enum):
+    """Способ сжатия сообщений."""
+    NONE = 0
+    ZLIB = 1  # Быстрое сжатие.
+    LZMA = 2  # Более сильное, но медленное сжатие.
+
+
+class Handshake:
+    """Согласование параметров соединения, которое клиент выполняет сразу после подключения.
+
+    В запросе клиент перечисляет поддерживаемые способы сжатия в порядке предпочтения и предлагает порог. Сервер 
+    отвечает Handshake с выбранным способом (единственным элементом compression) и окончательным порогом: ответы 
+    длиннее threshold байт отправляются сжатыми. Без согласования ответы не сжимаются."""
+    THRESHOLD: int = 4096  # [байт]
+
+    def __init__(self, compression: list[Compression], threshold: int = THRESHOLD):
+        self.compression: list[Compression] = compression
+        self.threshold: int = threshold
 
 
 class ClientRequest:
-    def __init__(self, command: Commands, data: Contact | Filter | None = None):
+    """Запрос клиента.
+
+    Запрос с идентификатором id клиент может отправить, не дожидаясь ответов на предыдущие (конвейерная передача): 
+    сервер вернёт ответ с тем же идентификатором, возможно, раньше ответов на предыдущие запросы. Запросы без 
+    идентификатора выполняются строго по очереди. Идентификатор передаётся вне сериализованного объекта (tag_message)."""
+    def __init__(self, command: Commands, data: Contact | Filter | UpdateRequest | Query | BulkImport | ExportRequest | Handshake | BatchRequest | bytes | None = None,
+                 id: int | None = None):
         self.command: Commands = command
-        self.data: Contact | Filter | None = data
+        self.data: Contact | Filter | UpdateRequest | Query | BulkImport | ExportRequest | Handshake | BatchRequest | bytes | None = data
+        self.id: int | None = id
 
 
 class ServerResponse:
-    def __init__(self, command: Commands, flag: bool, data=None):
+    def __init__(self, command: Commands, flag: bool, data=None, id: int | None = None):
         self.command: Commands = command
         self.flag: bool = flag
         self.data = data
+        self.id: int | None = id  # Идентификатор запроса, на который отвечает сервер (None для уведомлений).
+
+
+class ProtocolError(Exception):
+    """Нарушение протокола обмена сообщениями."""
+    pass
+
+
+class WireFormat(enum.Enum):
+    """Формат сериализации сообщений. Принимающая сторона определяет формат по первым байтам сообщения."""
+    BINARY = 'binary'  # Двоичный формат (encode_binary).
+    PICKLE = 'pickle'  # Формат предыдущих версий. Позволяет выполнить произвольный код, поэтому небезопасен для недоверенных узлов.
+
+
+BINARY_MAGIC: bytes = b'PB'  # Начало сообщения в двоичном формате (сообщения pickle начинаются с байта 0x80).
+BINARY_VERSION: int = 1
+
+
+class _Tag(enum.IntEnum):
+    """Тег значения в двоичном формате."""
+    NONE = 0
+    FALSE = 1
+    TRUE = 2
+    INT = 3  # Целое число в кодировке zigzag varint.
+    FLOAT = 4
+    STR = 5
+    BYTES = 6
+    LIST = 7
+    DICT = 8
+    CONTACTS = 9  # Список контактов, передаваемый по столбцам.
+    OBJECT = 10  # Объект протокола: номер типа и значения полей.
+    ENUM = 11
+
+
+class _Column(enum.IntEnum):
+    """Способ передачи столбца списка контактов."""
+    PLAIN = 0  # Таблица строк.
+    DICTIONARY = 1  # Таблица различных значений и индексы строк в ней.
+
+
+# Объекты протокола и их поля в порядке передачи. Номер типа — индекс в кортеже, новые типы добавляются в конец.
+_OBJECT_TYPES: tuple[tuple[type, tuple[str, ...]], ...] = (
+    (ClientRequest, ('command', 'data')),
+    (ServerResponse, ('command', 'flag', 'data')),
+    (Contact, ('name', 'surname', 'patronymic', 'number', 'note')),
+    (Filter, ('field', 'text')),
+    (UpdateRequest, ('filter', 'revision')),
+    (Query, ('filter', 'sort', 'descending', 'limit', 'cursor', 'count_only')),
+    (Page, ('revision', 'total', 'contacts', 'cursor')),
+    (Snapshot, ('revision', 'contacts')),
+    (Delta, ('since', 'revision', 'inserted', 'deleted')),
+    (BulkImport, ('format',)),
+    (ExportRequest, ('filter', 'format')),
+    (ImportConflict, ('row', 'number', 'reason')),
+    (ImportReport, ('imported', 'rejected', 'conflicts', 'revision')),
+    (Handshake, ('compression', 'threshold')),
+    (BatchOperation, ('action', 'contact', 'number', 'filter')),
+    (BatchRequest, ('operations', 'atomic')),
+    (BatchResult, ('results', 'committed', 'revision')),
+)
+_OBJECT_IDS: dict[type, int] = {cls: index for index, (cls, fields) in enumerate(_OBJECT_TYPES)}
+# Допустимые типы полей объектов протокола. Для списка — [типы элементов]; поля, которых здесь нет, не проверяются
+# (данные запроса и ответа зависят от команды и проверяются при её выполнении).
+_OPTIONAL_STR: tuple[type, ...] = (str, type(None))
+_FIELD_TYPES: dict[type, dict[str, tuple[type, ...] | list[type]]] = {
+    ClientRequest: {'command': (Commands,)},
+    ServerResponse: {'command': (Commands,), 'flag': (bool,)},
+    Contact: {field: _OPTIONAL_STR for field in ('name', 'surname', 'patronymic', 'number', 'note')},
+    Filter: {'field': _OPTIONAL_STR, 'text': _OPTIONAL_STR},
+    UpdateRequest: {'filter': (Filter, type(None)), 'revision': (int, type(None))},
+    Query: {'filter': (Filter, type(None)), 'sort': (str,), 'descending': (bool,), 'limit': (int,), 'cursor': _OPTIONAL_STR,
+            'count_only': (bool,)},
+    Page: {'revision': (int,), 'total': (int,), 'contacts': [Contact], 'cursor': _OPTIONAL_STR},
+    Snapshot: {'revision': (int,), 'contacts': [Contact]},
+    Delta: {'since': (int,), 'revision': (int,), 'inserted': [Contact], 'deleted': [Contact]},
+    BulkImport: {'format': (BulkFormat,)},
+    ExportRequest: {'filter': (Filter, type(None)), 'format': (BulkFormat,)},
+    ImportConflict: {'row': (int,), 'number': _OPTIONAL_STR, 'reason': (str,)},
+    ImportReport: {'imported': (int,), 'rejected': (int,), 'conflicts': [ImportConflict], 'revision': (int, type(None))},
+    Handshake: {'compression': [Compression], 'threshold': (int,)},
+    BatchOperation: {'action': (BatchAction,), 'contact': (Contact, type(None)), 'number': _OPTIONAL_STR,
+                     'filter': (Filter, type(None))},
+    BatchRequest: {'operations': [BatchOperation], 'atomic': (bool,)},
+    BatchResult: {'results': [int], 'committed': (bool,), 'revision': (int, type(None))},
+}
+_ENUM_TYPES: tuple[type[enum.Enum], ...] = (Commands, BulkFormat, Compression, BatchAction)
+_ENUM_IDS: dict[type, int] = {cls: index for index, cls in enumerate(_ENUM_TYPES)}
+_CONTACT_FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number', 'note')  # Порядок аргументов Contact.
+_ARRAY_TYPES: dict[int, str] = {1: 'B', 2: 'H', 4: 'I'}  # Ширина элемента массива [байт] → код типа array.
+_LITTLE_ENDIAN: bool = sys.byteorder == 'little'  # Массивы передаются в порядке little-endian.
+_DOUBLE = struct.Struct('<d')
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_array(out: bytearray, values: list[int]) -> None:
+    """Массив неотрицательных целых: ширина элемента и элементы фиксированной ширины."""
+    maximum: int = max(values, default=0)
+    width: int = 1 if maximum < 0x100 else 2 if maximum < 0x10000 else 4
+    items = array.array(_ARRAY_TYPES[width], values)
+    if not _LITTLE_ENDIAN:
+        items.byteswap()
+    out.append(width)
+    out += items
+
+
+def _write_strings(out: bytearray, values: list[str | None]) -> None:
+    """Таблица строк: число строк, признак наличия None, длины строк в символах и общий блок UTF-8.
+    При наличии None длины увеличены на 1, а 0 означает None."""
+    nullable: bool = any(value is None for value in values)
+    if nullable:
+        lengths: list[int] = [0 if value is None else len(value) + 1 for value in values]
+        blob: bytes = ''.join(value for value in values if value is not None).encode('utf-8')
+    else:
+        lengths: list[int] = list(map(len, values))
+        blob: bytes = ''.join(values).encode('utf-8')
+    _write_varint(out, len(values))
+    out.append(nullable)
+    _write_array(out, lengths)
+    _write_varint(out, len(blob))
+    out += blob
+
+
+def _write_column(out: bytearray, values: list[str | None]) -> None:
+    distinct: dict[str | None, None] = dict.fromkeys(values)
+    if len(distinct) * 2 <= len(values):  # Значения повторяются (фамилии, заметки), передаём словарь и индексы.
+        index: dict[str | None, int] = {value: position for position, value in enumerate(distinct)}
+        out.append(_Column.DICTIONARY)
+        _write_strings(out, list(distinct))
+        _write_array(out, list(map(index.__getitem__, values)))
+    else:
+        out.append(_Column.PLAIN)
+        _write_strings(out, values)
+
+
+def _write_value(out: bytearray, value) -> None:
+    kind: type = type(value)
+    if value is None:
+        out.append(_Tag.NONE)
+    elif kind is bool:
+        out.append(_Tag.TRUE if value else _Tag.FALSE)
+    elif kind is int:
+        out.append(_Tag.INT)
+        _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif kind is str:
+        data: bytes = value.encode('utf-8')
+        out.append(_Tag.STR)
+        _write_varint(out, len(data))
+        out += data
+    elif kind is list:
+        if value and all(type(item) is Contact for item in value):
+            out.append(_Tag.CONTACTS)
+            _write_varint(out, len(value))
+            for field in _CONTACT_FIELDS:
+                _write_column(out, list(map(operator.attrgetter(field), value)))
+        else:
+            out.append(_Tag.LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                _write_value(out, item)
+    elif kind in _OBJECT_IDS:
+        out.append(_Tag.OBJECT)
+        type_id: int = _OBJECT_IDS[kind]
+        _write_varint(out, type_id)
+        for field in _OBJECT_TYPES[type_id][1]:
+            _write_value(out, getattr(value, field))
+    elif kind in _ENUM_IDS:
+        out.append(_Tag.ENUM)
+        _write_varint(out, _ENUM_IDS[kind])
+        _write_value(out, value.value)
+    elif kind is bytes or kind is bytearray:
+        out.append(_Tag.BYTES)
+        _write_varint(out, len(value))
+        out += value
+    elif kind is float:
+        out.append(_Tag.FLOAT)
+        out += _DOUBLE.pack(value)
+    elif kind is dict:
+        out.append(_Tag.DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _write_value(out, key)
+            _write_value(out, item)
+    else:
+        raise TypeError('Тип {0} не поддерживается двоичным форматом.'.format(kind.__name__))
+
+
+def _has_type(value, expected: tuple[type, ...] | list[type]) -> bool:
+    if isinstance(expected, list):
+        return type(value) is list and all(isinstance(item, tuple(expected)) for item in value)
+    return isinstance(value, expected)
+
+
+class _BinaryReader:
+    """Чтение значений двоичного формата. Массивы длин и индексов читаются без копирования (memoryview.cast)."""
+    def __init__(self, data, position: int):
+        self.view = memoryview(data).cast('B')
+        self.position: int = position
+
+    def take(self, size: int) -> memoryview:
+        end: int = self.position + size
+        if end > len(self.view):
+            raise ProtocolError('Сообщение обрезано.')
+        part = self.view[self.position:end]
+        self.position = end
+        return part
+
+    def byte(self) -> int:
+        if self.position >= len(self.view):
+            raise ProtocolError('Сообщение обрезано.')
+        self.position += 1
+        return self.view[self.position - 1]
+
+    def varint(self) -> int:
+        value: int = 0
+        shift: int = 0
+        while True:
+            byte: int = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def array(self, count: int):
+        width: int = self.byte()
+        if width not in _ARRAY_TYPES:
+            raise ProtocolError('Недопустимая ширина элемента массива ({0}).'.format(width))
+        part: memoryview = self.take(width * count)
+        if _LITTLE_ENDIAN:
+            return part.cast(_ARRAY_TYPES[width])
+        items = array.array(_ARRAY_TYPES[width], part)
+        items.byteswap()
+        return items
+
+    def strings(self) -> list[str | None]:
+        count: int = self.varint()
+        nullable: int = self.byte()
+        lengths = self.array(count)
+        text: str = str(self.take(self.varint()), 'utf-8')
+        if nullable:
+            values: list[str | None] = []
+            offset: int = 0
+            for length in lengths:
+                if length:
+                    values.append(text[offset:offset + length - 1])
+                    offset += length - 1
+                else:
+                    values.append(None)
+        else:
+            offsets: list[int] = list(itertools.accumulate(lengths, initial=0))
+            offset: int = offsets[-1]
+            values: list[str | None] = [text[start:end] for start, end in itertools.pairwise(offsets)]
+        if offset != len(text):
+            raise ProtocolError('Длины строк не соответствуют данным.')
+        return values
+
+    def column(self, count: int) -> list[str | None]:
+        kind: int = self.byte()
+        if kind == _Column.DICTIONARY:
+            table: list[str | None] = self.strings()
+            values: list[str | None] = list(map(table.__getitem__, self.array(count)))
+        elif kind == _Column.PLAIN:
+            values: list[str | None] = self.strings()
+        else:
+            raise ProtocolError('Неизвестный способ передачи столбца ({0}).'.format(kind))
+        if len(values) != count:
+            raise ProtocolError('Длина столбца не соответствует числу контактов.')
+        return values
+
+    def value(self):
+        tag: int = self.byte()
+        if tag == _Tag.NONE:
+            return None
+        elif tag == _Tag.FALSE:
+            return False
+        elif tag == _Tag.TRUE:
+            return True
+        elif tag == _Tag.INT:
+            value: int = self.varint()
+            return -((value + 1) >> 1) if value & 1 else value >> 1
+        elif tag == _Tag.STR:
+            return str(self.take(self.varint()), 'utf-8')
+        elif tag == _Tag.CONTACTS:
+            count: int = self.varint()
+            columns: list[list[str | None]] = [self.column(count) for field in _CONTACT_FIELDS]
+            return list(map(Contact, *columns))
+        elif tag == _Tag.OBJECT:
+            cls, fields = _OBJECT_TYPES[self.varint()]
+            obj = cls.__new__(cls)
+            types: dict[str, tuple[type, ...] | list[type]] = _FIELD_TYPES[cls]
+            for field in fields:
+                value = self.value()
+                if field in types and not _has_type(value, types[field]):
+                    raise ValueError('недопустимый тип поля {0}.{1} ({2}).'.format(cls.__name__, field, type(value).__name__))
+                setattr(obj, field, value)
+            return obj
+        elif tag == _Tag.ENUM:
+            return _ENUM_TYPES[self.varint()](self.value())
+        elif tag == _Tag.LIST:
+            return [self.value() for index in range(self.varint())]
+        elif tag == _Tag.BYTES:
+            return bytes(self.take(self.varint()))
+        elif tag == _Tag.FLOAT:
+            return _DOUBLE.unpack(self.take(_DOUBLE.size))[0]
+        elif tag == _Tag.DICT:
+            result: dict = {}
+            for index in range(self.varint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        else:
+            raise ProtocolError('Неизвестный тег значения ({0}).'.format(tag))
+
+
+def encode_binary(obj) -> bytes:
+    """Сериализует объект в двоичном формате. Вызывает TypeError, если объект содержит значения неподдерживаемых типов.
+
+    Поддерживаются None, bool, int, float, str, bytes, list, dict, перечисления Commands и BulkFormat и объекты протокола
+    (_OBJECT_TYPES). Списки контактов передаются по столбцам, повторяющиеся значения столбца — через словарь."""
+    out = bytearray(BINARY_MAGIC)
+    out.append(BINARY_VERSION)
+    _write_value(out, obj)
+    return bytes(out)
+
+
+def decode_binary(data):
+    """Десериализует сообщение двоичного формата. Создаются только объекты протокола, поля которых имеют допустимые 
+    типы (_FIELD_TYPES), поэтому сообщения недоверенных узлов безопасны. При некорректных данных вызывает ProtocolError."""
+    if wire_format(data) != WireFormat.BINARY or len(data) <= len(BINARY_MAGIC):
+        raise ProtocolError('Сообщение не в двоичном формате.')
+    if data[len(BINARY_MAGIC)] != BINARY_VERSION:
+        raise ProtocolError('Неподдерживаемая версия двоичного формата ({0}).'.format(data[len(BINARY_MAGIC)]))
+    reader = _BinaryReader(data, len(BINARY_MAGIC) + 1)
+    try:
+        obj = reader.value()
+    except (IndexError, ValueError, TypeError, KeyError, struct.error, RecursionError) as error:
+        raise ProtocolError('Некорректное сообщение двоичного формата: {0}'.format(error))
+    if reader.position != len(reader.view):
+        raise ProtocolError('Лишние данные в конце сообщения.')
+    return obj
+
+
+def wire_format(data) -> WireFormat:
+    """Определяет формат сериализованного сообщения."""
+    return WireFormat.BINARY if bytes(data[:len(BINARY_MAGIC)]) == BINARY_MAGIC else WireFormat.PICKLE
+
+
+COMPRESSED_MAGIC: bytes = b'PZ'  # Начало сжатого сообщения; за ним следуют номер способа сжатия и сжатые данные.
+MAX_DECOMPRESSED_SIZE: int = 1024 * 1024 * 1024  # Предел размера распакованного сообщения [байт].
+
+
+TAGGED_MAGIC: bytes = b'PT'  # Начало сообщения с идентификатором запроса; за ним следуют varint id и само сообщение.
+
+
+def tag_message(data: bytes, id: int) -> bytes:
+    """Добавляет к сериализованному (и, возможно, сжатому) сообщению идентификатор запроса. Так сериализованный ответ
+    из кэша можно отправить в ответ на любой запрос."""
+    header = bytearray(TAGGED_MAGIC)
+    _write_varint(header, id)
+    return bytes(header) + data
+
+
+def is_tagged(data) -> bool:
+    return bytes(data[:len(TAGGED_MAGIC)]) == TAGGED_MAGIC
+
+
+def untag_message(data) -> tuple[int | None, bytes | memoryview]:
+    """Возвращает идентификатор запроса (None, если его нет) и сообщение без него."""
+    if not is_tagged(data):
+        return None, data
+    reader = _BinaryReader(data, len(TAGGED_MAGIC))
+    id: int = reader.varint()
+    return id, reader.view[reader.position:]
+
+
+def compress_message(data: bytes, compression: Compression) -> bytes:
+    """Сжимает сериализованное сообщение."""
+    if compression == Compression.ZLIB:
+        compressed: bytes = zlib.compress(data, 6)
+    elif compression == Compression.LZMA:
+        compressed: bytes = lzma.compress(data, preset=1)
+    else:
+        return data
+    return COMPRESSED_MAGIC + bytes((compression.value,)) + compressed
+
+
+def is_compressed(data) -> bool:
+    return bytes(data[:len(COMPRESSED_MAGIC)]) == COMPRESSED_MAGIC
+
+
+def decompress_message(data) -> bytes:
+    """Распаковывает сообщение, сжатое compress_message. Сообщения больше MAX_DECOMPRESSED_SIZE отклоняются."""
+    header: int = len(COMPRESSED_MAGIC) + 1
+    if len(data) < header:
+        raise ProtocolError('Сообщение обрезано.')
+    try:
+        compression = Compression(data[len(COMPRESSED_MAGIC)])
+    except ValueError:
+        raise ProtocolError('Неизвестный способ сжатия ({0}).'.format(data[len(COMPRESSED_MAGIC)]))
+    try:
+        if compression == Compression.ZLIB:
+            decompressor = zlib.decompressobj()
+            result: bytes = decompressor.decompress(memoryview(data)[header:], MAX_DECOMPRESSED_SIZE)
+            complete: bool = decompressor.eof and not decompressor.unconsumed_tail
+        elif compression == Compression.LZMA:
+            decompressor = lzma.LZMADecompressor()
+            result: bytes = decompressor.decompress(memoryview(data)[header:], MAX_DECOMPRESSED_SIZE)
+            complete: bool = decompressor.eof
+        else:
+            raise ProtocolError('Сжатое сообщение без способа сжатия.')
+    except (zlib.error, lzma.LZMAError) as error:
+        raise ProtocolError('Ошибка распаковки сообщения: {0}'.format(error))
+    if not complete:
+        raise ProtocolError('Сжатое сообщение обрезано или превышает допустимый размер.')
+    return result
+
+
+class FrameType(enum.IntEnum):
+    """Тип кадра.
+
+    Сообщение, не превышающее CHUNK_SIZE, передаётся одним кадром MESSAGE. Большое сообщение передаётся
+    последовательностью кадров CHUNK, завершающейся кадром LAST_CHUNK."""
+    MESSAGE = 1  # Сообщение целиком.
+    CHUNK = 2  # Фрагмент сообщения, за которым последуют другие фрагменты.
+    LAST_CHUNK = 3  # Последний фрагмент сообщения.
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytearray | None:
+    """Принимает ровно size байт. Возвращает None, если соединение закрыто до получения первого байта."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received: int = 0
+    while received < size:
+        count: int = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError('Соединение закрыто посреди кадра.')
+        received += count
+    return buffer
+
+
+def _parse_header(header) -> tuple[FrameType, int]:
+    """Разбирает и проверяет заголовок кадра."""
+    frame_type, length = FRAME_HEADER.unpack(header)
+    try:
+        frame_type = FrameType(frame_type)
+    except ValueError:
+        raise ProtocolError('Неизвестный тип кадра ({0}).'.format(frame_type))
+    if length > CHUNK_SIZE:
+        raise ProtocolError('Размер кадра ({0}) превышает допустимый ({1}).'.format(length, CHUNK_SIZE))
+    return frame_type, length
+
+
+def _recv_header(sock: socket.socket) -> tuple[FrameType, int] | None:
+    """Принимает заголовок кадра. Возвращает None, если соединение закрыто."""
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    return _parse_header(header)
+
+
+def _send_frame(sock: socket.socket, frame_type: FrameType, payload) -> None:
+    # Заголовок и данные отправляются одним вызовом, чтобы алгоритм Нейгла не задерживал полезную нагрузку.
+    sock.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+
+class FrameWriter(io.RawIOBase):
+    """Поток, разбивающий записываемые данные на кадры и отправляющий их в сокет.
+
+    Позволяет сериализовать объект сразу в сокет, не собирая всё сообщение в памяти."""
+    def __init__(self, sock: socket.socket):
+        super().__init__()
+        self.__socket: socket.socket = sock
+        self.__buffer = bytearray()
+        self.__chunked: bool = False  # Был ли уже отправлен хотя бы один фрагмент сообщения.
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.__buffer += data
+        # Строгое неравенство гарантирует, что для последнего кадра всегда останутся данные.
+        while len(self.__buffer) > CHUNK_SIZE:
+            _send_frame(self.__socket, FrameType.CHUNK, bytes(self.__buffer[:CHUNK_SIZE]))
+            del self.__buffer[:CHUNK_SIZE]
+            self.__chunked = True
+        return len(data)
+
+    def finish(self):
+        """Отправляет остаток сообщения."""
+        _send_frame(self.__socket, FrameType.LAST_CHUNK if self.__chunked else FrameType.MESSAGE, bytes(self.__buffer))
+        self.__buffer.clear()
+        self.__chunked = False
+
+
+class FrameReader(io.RawIOBase):
+    """Поток, читающий полезную нагрузку одного сообщения из последовательности кадров."""
+    def __init__(self, sock: socket.socket):
+        super().__init__()
+        self.__socket: socket.socket = sock
+        self.__remaining: int = 0  # Сколько байт текущего кадра ещё не прочитано.
+        self.__last: bool = False  # Является ли текущий кадр последним кадром сообщения.
+
+    def readable(self) -> bool:
+        return True
+
+    def start(self) -> bool:
+        """Принимает первый кадр сообщения. Возвращает False, если соединение закрыто."""
+        header = _recv_header(self.__socket)
+        if header is None:
+            return False
+        frame_type, self.__remaining = header
+        if frame_type == FrameType.LAST_CHUNK:
+            raise ProtocolError('Сообщение не может начинаться с последнего фрагмента.')
+        self.__last = frame_type == FrameType.MESSAGE
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.__remaining == 0:
+            if self.__last:
+                return 0  # Сообщение прочитано полностью.
+            header = _recv_header(self.__socket)
+            if header is None:
+                raise ProtocolError('Соединение закрыто посреди сообщения.')
+            frame_type, self.__remaining = header
+            if frame_type == FrameType.MESSAGE:
+                raise ProtocolError('Начало нового сообщения посреди фрагментированного сообщения.')
+            self.__last = frame_type == FrameType.LAST_CHUNK
+        with memoryview(buffer) as view:
+            count: int = self.__socket.recv_into(view[:min(len(view), self.__remaining)])
+        if count == 0:
+            raise ProtocolError('Соединение закрыто посреди кадра.')
+        self.__remaining -= count
+        return count
+
+    def drain(self):
+        """Пропускает непрочитанный остаток сообщения."""
+        buffer = bytearray(CHUNK_SIZE)
+        while self.readinto(buffer):
+            pass
+
+
+def _split_frames(data: bytes):
+    """Разбивает сериализованное сообщение на кадры (заголовок вместе с полезной нагрузкой)."""
+    with memoryview(data) as view:
+        if len(view) <= CHUNK_SIZE:
+            yield FRAME_HEADER.pack(FrameType.MESSAGE, len(view)) + view
+        else:
+            for offset in range(0, len(view), CHUNK_SIZE):
+                chunk = view[offset:offset + CHUNK_SIZE]
+                frame_type = FrameType.CHUNK if offset + CHUNK_SIZE < len(view) else FrameType.LAST_CHUNK
+                yield FRAME_HEADER.pack(frame_type, len(chunk)) + chunk
+
+
+def send_message(sock: socket.socket, data: bytes) -> None:
+    """Отправляет уже сериализованное сообщение."""
+    for frame in _split_frames(data):
+        sock.sendall(frame)
+
+
+def receive_message(sock: socket.socket) -> bytes | None:
+    """Принимает сообщение целиком. Возвращает None, если соединение закрыто."""
+    reader = FrameReader(sock)
+    if not reader.start():
+        return None
+    return reader.readall()
+
+
+def encode_object(obj, format: WireFormat = WireFormat.BINARY) -> bytes:
+    """Сериализует объект для отправки функцией send_message. Объекты, не поддерживаемые двоичным форматом,
+    сериализуются pickle."""
+    if format == WireFormat.BINARY:
+        try:
+            return encode_binary(obj)
+        except TypeError:
+            pass
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_object(data: bytes, allow_pickle: bool = True):
+    """Десериализует объект, принятый функцией receive_message. Если allow_pickle == False, сообщения pickle
+    отклоняются с ProtocolError. Сжатые сообщения (compress_message) предварительно распаковываются, идентификатор
+    запроса (tag_message) записывается в поле id запроса или ответа."""
+    id, data = untag_message(data)
+    if is_compressed(data):
+        data = decompress_message(data)
+    if wire_format(data) == WireFormat.BINARY:
+        obj = decode_binary(data)
+    elif not allow_pickle:
+        raise ProtocolError('Сообщения в формате pickle не принимаются.')
+    else:
+        obj = pickle.loads(data)
+    if isinstance(obj, (ClientRequest, ServerResponse)):
+        obj.id = id
+    return obj
+
+
+def send_object(sock: socket.socket, obj, format: WireFormat = WireFormat.BINARY) -> None:
+    """Сериализует объект и отправляет его в сокет. Сообщение pickle сериализуется потоково.
+    Идентификатор запроса или ответа (поле id) передаётся вместе с сообщением."""
+    id: int | None = getattr(obj, 'id', None) if isinstance(obj, (ClientRequest, ServerResponse)) else None
+    if id is not None:
+        send_message(sock, tag_message(encode_object(obj, format), id))
+        return
+    if format == WireFormat.BINARY:
+        try:
+            data: bytes = encode_binary(obj)
+        except TypeError:
+            pass
+        else:  # Если исключения не было.
+            send_message(sock, data)
+            return
+    writer = FrameWriter(sock)
+    pickle.dump(obj, writer, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.finish()
+
+
+def receive_object(sock: socket.socket, allow_pickle: bool = True):
+    """Принимает и десериализует объект. Возвращает None, если соединение закрыто."""
+    reader = FrameReader(sock)
+    if not reader.start():
+        return None
+    stream = io.BufferedReader(reader, CHUNK_SIZE)
+    head: bytes = stream.peek(len(BINARY_MAGIC))
+    if wire_format(head) != WireFormat.PICKLE or is_compressed(head) or is_tagged(head):
+        return decode_object(stream.read(), allow_pickle=allow_pickle)
+    if not allow_pickle:
+        raise ProtocolError('Сообщения в формате pickle не принимаются.')
+    obj = pickle.load(stream)
+    reader.drain()
+    if isinstance(obj, (ClientRequest, ServerResponse)):
+        obj.id = None
+    return obj
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes | None:
+    """Асинхронно принимает сообщение целиком. Возвращает None, если соединение закрыто."""
+    payload = bytearray()
+    first: bool = True  # Ожидается первый кадр сообщения.
+    while True:
+        try:
+            frame_type, length = _parse_header(await reader.readexactly(FRAME_HEADER.size))
+            if first and frame_type == FrameType.LAST_CHUNK:
+                raise ProtocolError('Сообщение не может начинаться с последнего фрагмента.')
+            if not first and frame_type == FrameType.MESSAGE:
+                raise ProtocolError('Начало нового сообщения посреди фрагментированного сообщения.')
+            payload += await reader.readexactly(length)
+        except asyncio.IncompleteReadError as error:
+            if first and not payload and not error.partial:
+                return None
+            raise ProtocolError('Соединение закрыто посреди сообщения.')
+        if frame_type != FrameType.CHUNK:
+            return bytes(payload)
+        first = False
+
+
+def write_message(writer: asyncio.StreamWriter, data: bytes) -> None:
+    """Помещает сериализованное сообщение в буфер отправки. Для ожидания отправки используйте writer.drain()."""
+    for frame in _split_frames(data):
+        writer.write(frame)
@@ -0,0 +1,271 @@
+import bisect
+import contextlib
+import http.server
+import math
+import threading
+import time
+from typing import Callable, Iterator
+from common import Commands
+
+# Верхние границы корзин гистограммы длительностей [с]: 0,1 мс, 0,2 мс, 0,4 мс, … около 13 с и бесконечность.
+LATENCY_BOUNDS: tuple[float, ...] = tuple(0.0001 * 2 ** index for index in range(18)) + (math.inf,)
+STAGES: tuple[str, ...] = ('storage', 'encode', 'send')  # Обращение к хранилищу, сериализация, отправка в сокет.
+
+
+class Histogram:
+    """Гистограмма длительностей с экспоненциальными границами корзин LATENCY_BOUNDS. Не потокобезопасна."""
+    def __init__(self):
+        self.counts: list[int] = [0] * len(LATENCY_BOUNDS)
+        self.count: int = 0
+        self.sum: float = 0.0  # [с]
+        self.max: float = 0.0  # [с]
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попадает (для последней корзины — максимум)."""
+        if not self.count:
+            return 0.0
+        rank: float = q * self.count
+        total: int = 0
+        for bound, count in zip(LATENCY_BOUNDS, self.counts):
+            total += count
+            if total >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def statistics(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                # Граница последней корзины (бесконечность) передаётся как None, чтобы словарь оставался допустимым JSON.
+                'buckets': [[None if bound == math.inf else bound, count] for bound, count in zip(LATENCY_BOUNDS, self.counts)]}
+
+
+class CommandMetrics:
+    """Показатели запросов одной команды."""
+    def __init__(self):
+        self.requests: int = 0
+        self.errors: int = 0  # Запросы, при обработке которых возникло исключение или не найден обработчик.
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+        self.latency = Histogram()  # От приёма запроса до отправки ответа.
+        self.stages: dict[str, float] = {stage: 0.0 for stage in STAGES}  # Суммарное время этапов [с].
+
+    def statistics(self) -> dict:
+        return {'requests': self.requests, 'errors': self.errors, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'latency': self.latency.statistics(), 'stages': dict(self.stages)}
+
+
+class RequestTiming:
+    """Измерения одного запроса. Этапы не вкладываются: время вложенного этапа относится к внешнему (например,
+    сериализация уведомлений, разосланных при добавлении контакта, — к обращению к хранилищу)."""
+    def __init__(self, command: Commands, bytes_in: int):
+        self.command: Commands = command
+        self.bytes_in: int = bytes_in
+        self.bytes_out: int = 0
+        self.error: bool = False
+        self.start: float = time.perf_counter()
+        self.stages: dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.__stage: str | None = None  # Выполняющийся этап.
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if self.__stage is not None:
+            yield
+            return
+        self.__stage = name
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+            self.__stage = None
+
+
+class ServerMetrics:
+    """Показатели работы сервера: по каждой команде — число запросов и ошибок, объём принятых и отправленных данных,
+    гистограмма длительности и время этапов обработки; число подключений и потоков.
+
+    Измерения запроса (RequestTiming) создаёт сервер при его приёме. Пока запрос выполняется, измерения привязаны
+    к потоку обработчика (bind), поэтому этапы отмечаются вызовом stage без передачи измерений через все вызовы."""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__commands: dict[Commands, CommandMetrics] = {command: CommandMetrics() for command in Commands}
+        self.started: float = time.time()
+        self.active_connections: int = 0
+        self.total_connections: int = 0
+        self.rejected_connections: int = 0  # Закрыты из-за превышения лимита подключений.
+        self.protocol_errors: int = 0  # Подключения, закрытые из-за некорректного сообщения клиента.
+        self.dropped_subscribers: int = 0  # Подключения, разорванные из-за переполнения очереди уведомлений.
+
+    def begin(self, command: Commands, bytes_in: int) -> RequestTiming:
+        return RequestTiming(command, bytes_in)
+
+    def finish(self, timing: RequestTiming):
+        """Учитывает завершённый запрос."""
+        latency: float = time.perf_counter() - timing.start
+        with self.__lock:
+            metrics: CommandMetrics = self.__commands[timing.command]
+            metrics.requests += 1
+            metrics.errors += timing.error
+            metrics.bytes_in += timing.bytes_in
+            metrics.bytes_out += timing.bytes_out
+            metrics.latency.observe(latency)
+            for stage, seconds in timing.stages.items():
+                metrics.stages[stage] += seconds
+
+    @contextlib.contextmanager
+    def bind(self, timing: RequestTiming | None) -> Iterator[None]:
+        """Привязывает измерения запроса к текущему потоку."""
+        previous: RequestTiming | None = getattr(self.__local, 'timing', None)
+        self.__local.timing = timing
+        try:
+            yield
+        finally:
+            self.__local.timing = previous
+
+    @property
+    def current(self) -> RequestTiming | None:
+        """Измерения запроса, выполняемого текущим потоком."""
+        return getattr(self.__local, 'timing', None)
+
+    def stage(self, name: str) -> contextlib.AbstractContextManager:
+        """Отмечает этап обработки запроса, выполняемого текущим потоком."""
+        timing: RequestTiming | None = self.current
+        return contextlib.nullcontext() if timing is None else timing.stage(name)
+
+    def received(self, size: int):
+        """Учитывает дополнительные данные, принятые в рамках текущего запроса (фрагменты массовой загрузки)."""
+        timing: RequestTiming | None = self.current
+        if timing is not None:
+            timing.bytes_in += size
+
+    def sent(self, size: int):
+        timing: RequestTiming | None = self.current
+        if timing is not None:
+            timing.bytes_out += size
+
+    def notified(self, size: int):
+        """Учитывает уведомление, отправленное подписчику."""
+        with self.__lock:
+            metrics: CommandMetrics = self.__commands[Commands.NOTIFY]
+            metrics.requests += 1
+            metrics.bytes_out += size
+
+    def connected(self):
+        with self.__lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def disconnected(self):
+        with self.__lock:
+            self.active_connections -= 1
+
+    def rejected(self):
+        with self.__lock:
+            self.rejected_connections += 1
+
+    def protocolError(self):
+        with self.__lock:
+            self.protocol_errors += 1
+
+    def droppedSubscriber(self):
+        with self.__lock:
+            self.dropped_subscribers += 1
+
+    def statistics(self) -> dict:
+        """Показатели в виде словаря (его можно передать клиенту в ответе STATS)."""
+        with self.__lock:
+            return {
+                'uptime': time.time() - self.started,
+                'threads': threading.active_count(),
+                'connections': {'active': self.active_connections, 'total': self.total_connections,
+                                'rejected': self.rejected_connections},
+                'protocol_errors': self.protocol_errors,
+                'dropped_subscribers': self.dropped_subscribers,
+                'commands': {command.name: metrics.statistics() for command, metrics in self.__commands.items()
+                             if metrics.requests},
+            }
+
+
+def _format_value(value: float | None) -> str:
+    return '+Inf' if value is None or value == math.inf else repr(value) if isinstance(value, float) else str(value)
+
+
+def render_text(statistics: dict) -> str:
+    """Представляет показатели (ответ STATS) в текстовом формате Prometheus."""
+    lines: list[str] = []
+
+    def __metric(name: str, kind: str, samples: list[tuple[dict[str, str], float]]):
+        lines.append('# TYPE phonebook_{0} {1}'.format(name, kind))
+        for labels, value in samples:
+            label_text: str = ','.join('{0}="{1}"'.format(key, label) for key, label in labels.items())
+            lines.append('phonebook_{0}{1} {2}'.format(name, '{' + label_text + '}' if label_text else '',
+                                                      _format_value(value)))
+
+    commands: dict[str, dict] = statistics.get('commands', {})
+    __metric('uptime_seconds', 'gauge', [({}, statistics['uptime'])])
+    __metric('threads', 'gauge', [({}, statistics['threads'])])
+    __metric('connections_active', 'gauge', [({}, statistics['connections']['active'])])
+    __metric('connections_total', 'counter', [({}, statistics['connections']['total'])])
+    __metric('connections_rejected_total', 'counter', [({}, statistics['connections']['rejected'])])
+    __metric('protocol_errors_total', 'counter', [({}, statistics['protocol_errors'])])
+    __metric('dropped_subscribers_total', 'counter', [({}, statistics.get('dropped_subscribers', 0))])
+    __metric('requests_total', 'counter', [({'command': name}, metrics['requests']) for name, metrics in commands.items()])
+    __metric('errors_total', 'counter', [({'command': name}, metrics['errors']) for name, metrics in commands.items()])
+    __metric('received_bytes_total', 'counter', [({'command': name}, metrics['bytes_in']) for name, metrics in commands.items()])
+    __metric('sent_bytes_total', 'counter', [({'command': name}, metrics['bytes_out']) for name, metrics in commands.items()])
+    __metric('stage_seconds_total', 'counter', [({'command': name, 'stage': stage}, seconds)
+                                                for name, metrics in commands.items()
+                                                for stage, seconds in metrics['stages'].items()])
+
+    lines.append('# TYPE phonebook_request_duration_seconds histogram')
+    for name, metrics in commands.items():
+        latency: dict = metrics['latency']
+        cumulative: int = 0
+        for bound, count in latency['buckets']:
+            cumulative += count
+            lines.append('phonebook_request_duration_seconds_bucket{{command="{0}",le="{1}"}} {2}'.format(
+                name, _format_value(bound), cumulative))
+        lines.append('phonebook_request_duration_seconds_sum{{command="{0}"}} {1!r}'.format(name, latency['sum']))
+        lines.append('phonebook_request_duration_seconds_count{{command="{0}"}} {1}'.format(name, latency['count']))
+
+    for section in ('cache', 'compression', 'group_commit'):
+        if section in statistics:
+            __metric(section, 'gauge', [({'name': key}, value) for key, value in statistics[section].items()])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsEndpoint(http.server.ThreadingHTTPServer):
+    """HTTP-сервер, отдающий показатели в текстовом формате по адресу /metrics. Слушает только localhost."""
+    PATH: str = '/metrics'
+
+    def __init__(self, port: int, statistics: Callable[[], dict]):
+        self.statistics: Callable[[], dict] = statistics
+        super().__init__(('127.0.0.1', port), _MetricsRequestHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: MetricsEndpoint
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != MetricsEndpoint.PATH:
+            self.send_error(404)
+            return
+        body: bytes = render_text(self.server.statistics()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        pass  # Запросы показателей не выводятся в консоль сервера.
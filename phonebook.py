@@ -0,0 +1,613 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import queue
+import socket
+import threading
+import time
+from typing import AsyncIterator, BinaryIO, Callable, Iterable, Iterator
+from common import (Contact, Filter, Commands, ClientRequest, ServerResponse, UpdateRequest, Query, Page, Snapshot, Delta,
+                    BulkFormat, BulkImport, ExportRequest, ImportReport, BatchOperation, BatchRequest, BatchResult,
+                    Compression, Handshake, ProtocolError, CHUNK_SIZE, PORT, send_object, receive_object, encode_object,
+                    decode_object, tag_message, read_message, write_message)
+
+
+class ClientError(Exception):
+    """Сервер не смог выполнить запрос."""
+    pass
+
+
+def _result(request: ClientRequest, response: ServerResponse):
+    """Возвращает данные ответа или вызывает ClientError, если сервер сообщил об ошибке."""
+    if not response.flag:
+        raise ClientError('Ошибка выполнения запроса ({0}) на сервере: {1}'.format(request.command, response.data))
+    return response.data
+
+
+def _is_final(response: ServerResponse) -> bool:
+    """Последний ли это ответ на запрос (на запрос выгрузки сервер отвечает несколькими сообщениями)."""
+    return response.command != Commands.EXPORT or not response.flag or response.data is None
+
+
+class PhonebookClient:
+    """Блокирующий клиент телефонной книги.
+
+    Клиент держит одно соединение с сервером, которое используется всеми его запросами. Методы можно вызывать из
+    нескольких потоков одновременно: каждому запросу присваивается идентификатор, поэтому запросы передаются по
+    соединению конвейером, а ответы распределяет по ожидающим потокам фоновый поток чтения. Соединение
+    устанавливается при первом запросе; при неудаче подключение повторяется attempts раз с удваивающейся паузой.
+    При разрыве соединения ожидающие ответа запросы завершаются ConnectionError, а следующий запрос подключается
+    заново (подписки при этом теряются, о разрыве сообщает on_disconnect). Обратные вызовы выполняются в потоке
+    чтения, поэтому не должны ожидать ответов на запросы этого клиента."""
+    TIMEOUT: float = 30  # Время ожидания подключения и ответа сервера [с].
+    ATTEMPTS: int = 5  # Число попыток подключения.
+    BACKOFF: float = 0.1  # Пауза перед второй попыткой подключения [с], каждая следующая вдвое длиннее.
+    MAX_BACKOFF: float = 5.0  # [с]
+    COMPRESSION: list[Compression] = [Compression.ZLIB, Compression.LZMA]  # Способы сжатия ответов в порядке предпочтения.
+
+    def __init__(self, host: str = 'localhost', port: int = PORT, timeout: float = TIMEOUT, attempts: int = ATTEMPTS,
+                 compression: list[Compression] | None = None, on_notify: Callable[[Delta], None] | None = None,
+                 on_disconnect: Callable[[], None] | None = None):
+        self.host: str = host
+        self.port: int = port
+        self.timeout: float = timeout
+        self.attempts: int = attempts
+        self.compression: list[Compression] = self.COMPRESSION if compression is None else compression
+        # Обратные вызовы выполняются в потоке чтения.
+        self.on_notify: Callable[[Delta], None] | None = on_notify
+        self.on_disconnect: Callable[[], None] | None = on_disconnect  # Вызывается при разрыве, но не при вызове close().
+        self.handshake: Handshake | None = None  # Параметры соединения, согласованные с сервером.
+        self.__send_lock = threading.Lock()  # Подключение и отправка запросов.
+        self.__lock = threading.Lock()  # Сокет и ожидающие ответа запросы.
+        self.__socket: socket.socket | None = None
+        # Ожидающие ответа запросы по идентификаторам: Future или очередь для запросов с несколькими ответами.
+        self.__pending: dict[int, concurrent.futures.Future | queue.Queue] = {}
+        self.__next_id: int = 1
+        self.__closed: bool = False
+
+    def __enter__(self) -> 'PhonebookClient':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self.__socket is not None
+
+    def connect(self):
+        """Подключается к серверу, если соединение ещё не установлено."""
+        with self.__send_lock:
+            self.__connect()
+
+    def __connect(self) -> socket.socket:
+        """Возвращает текущее соединение, при необходимости подключаясь к серверу. Вызывается под __send_lock."""
+        if self.__closed:
+            raise ConnectionError('Клиент закрыт.')
+        sock: socket.socket | None = self.__socket
+        if sock is not None:
+            return sock
+        delay: float = self.BACKOFF
+        for attempt in range(1, self.attempts + 1):
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                break
+            except OSError as error:
+                if attempt >= self.attempts:
+                    raise ConnectionError('Не удалось подключиться к {0}:{1}: {2}'.format(self.host, self.port, error)) from error
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_BACKOFF)
+        sock.settimeout(None)
+        with self.__lock:
+            if self.__closed:  # Клиент закрыт во время подключения.
+                sock.close()
+                raise ConnectionError('Клиент закрыт.')
+            self.__socket = sock
+        threading.Thread(target=self.__receiveLoop, args=(sock,), daemon=True).start()
+
+        self.handshake = None
+        if self.compression:
+            request = ClientRequest(command=Commands.HELLO, data=Handshake(compression=self.compression))
+            try:
+                self.handshake = _result(request, self.__wait(request, self.__send(sock, request)))
+            except Exception as error:
+                self.__drop(sock, error)
+                raise
+        return sock
+
+    def __send(self, sock: socket.socket, request: ClientRequest,
+               pending: concurrent.futures.Future | queue.Queue | None = None) -> concurrent.futures.Future | queue.Queue:
+        """Присваивает запросу идентификатор и отправляет его. Вызывается под __send_lock."""
+        if pending is None:
+            pending = concurrent.futures.Future()
+        with self.__lock:
+            request.id = self.__next_id
+            self.__next_id += 1
+            self.__pending[request.id] = pending
+        try:
+            send_object(sock, request)
+        except OSError as error:
+            self.__drop(sock, error)
+        return pending
+
+    def __receiveLoop(self, sock: socket.socket):
+        """Принимает сообщения сервера и передаёт ответы ожидающим их запросам. Выполняется в отдельном потоке."""
+        error: Exception | None = None
+        try:
+            while (response := receive_object(sock)) is not None:
+                if not isinstance(response, ServerResponse):
+                    raise ProtocolError('Некорректный тип сообщения от сервера ({0}).'.format(type(response)))
+                if response.command == Commands.NOTIFY:
+                    if self.on_notify is not None:
+                        self.on_notify(response.data)
+                    continue
+                with self.__lock:
+                    pending = self.__pending.get(response.id)
+                    if pending is not None and _is_final(response):
+                        del self.__pending[response.id]
+                if isinstance(pending, queue.Queue):
+                    pending.put(response)
+                elif pending is not None:
+                    pending.set_result(response)
+        except Exception as exception:
+            error = exception
+        self.__drop(sock, error)
+
+    def __drop(self, sock: socket.socket, error: Exception | None):
+        """Закрывает соединение sock, если оно ещё используется, и завершает ожидающие ответа запросы ошибкой."""
+        with self.__lock:
+            if self.__socket is not sock:
+                return
+            self.__socket = None
+            pending, self.__pending = self.__pending, {}
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Соединение уже разорвано.
+        sock.close()
+        exception = ConnectionError('Соединение с сервером разорвано{0}'.format(
+            '.' if error is None else ': {0}'.format(error)))
+        for waiter in pending.values():
+            if isinstance(waiter, queue.Queue):
+                waiter.put(exception)
+            else:
+                waiter.set_exception(exception)
+        if not self.__closed and self.on_disconnect is not None:
+            self.on_disconnect()
+
+    def __forget(self, request: ClientRequest):
+        """Перестаёт ожидать ответ на запрос."""
+        with self.__lock:
+            self.__pending.pop(request.id, None)
+
+    def __wait(self, request: ClientRequest, future: concurrent.futures.Future) -> ServerResponse:
+        """Ожидает ответ на запрос."""
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            self.__forget(request)
+            raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(request.command))
+
+    def submit(self, request: ClientRequest) -> concurrent.futures.Future:
+        """Отправляет запрос, не дожидаясь ответа. Возвращает Future, которому будет передан ответ сервера
+        (ServerResponse) или ConnectionError при разрыве соединения. Ответ не ограничен по времени ожидания."""
+        with self.__send_lock:
+            return self.__send(self.__connect(), request)
+
+    def call(self, request: ClientRequest) -> ServerResponse:
+        """Выполняет запрос и возвращает ответ сервера."""
+        return self.__wait(request, self.submit(request))
+
+    def request(self, request: ClientRequest):
+        """Выполняет запрос и возвращает данные ответа. Если сервер сообщил об ошибке, вызывает ClientError."""
+        return _result(request, self.call(request))
+
+    def addContact(self, contact: Contact) -> bool:
+        return self.call(ClientRequest(command=Commands.ADD, data=contact)).flag
+
+    def deleteContact(self, contact: Contact) -> bool:
+        """Удаляет контакт, совпадающий с contact по всем полям. Возвращает False, если такого контакта нет."""
+        return self.call(ClientRequest(command=Commands.DELETE, data=contact)).flag
+
+    def getContacts(self, filter: Filter | None = None) -> list[Contact]:
+        """Возвращает контакты, удовлетворяющие фильтру."""
+        return self.request(ClientRequest(command=Commands.UPDATE, data=filter))
+
+    def getChanges(self, filter: Filter | None = None, revision: int | None = None) -> Snapshot | Delta:
+        """Возвращает изменения после ревизии revision или, если ревизия не указана или устарела, снимок контактов."""
+        return self.request(ClientRequest(command=Commands.UPDATE, data=UpdateRequest(filter=filter, revision=revision)))
+
+    def getPage(self, query: Query) -> Page:
+        return self.request(ClientRequest(command=Commands.UPDATE, data=query))
+
+    def countContacts(self, filter: Filter | None = None) -> int:
+        return self.getPage(Query(filter=filter, count_only=True)).total
+
+    def getStatistics(self) -> dict:
+        """Возвращает показатели работы сервера (для текстового представления используйте metrics.render_text)."""
+        return self.request(ClientRequest(command=Commands.STATS))
+
+    def subscribe(self, filter: Filter | None = None, revision: int | None = None) -> Snapshot | Delta:
+        """Как getChanges, но дополнительно подписывается на уведомления об изменениях контактов, удовлетворяющих
+        фильтру (они передаются в on_notify). Новая подписка заменяет прежнюю."""
+        return self.request(ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest(filter=filter, revision=revision)))
+
+    def subscribePage(self, query: Query) -> Page:
+        """Возвращает первую страницу выборки и подписывается на уведомления об изменениях её контактов."""
+        return self.request(ClientRequest(command=Commands.SUBSCRIBE, data=query))
+
+    def __batch(self, command: Commands, contacts: Iterable[Contact]) -> list[bool]:
+        """Отправляет запросы конвейером и ожидает ответы на них."""
+        requests: list[tuple[ClientRequest, concurrent.futures.Future]] = []
+        with self.__send_lock:
+            for contact in contacts:
+                request = ClientRequest(command=command, data=contact)
+                requests.append((request, self.__send(self.__connect(), request)))
+        deadline: float = time.monotonic() + self.timeout
+        results: list[bool] = []
+        for request, future in requests:
+            try:
+                results.append(future.result(max(0.0, deadline - time.monotonic())).flag)
+            except concurrent.futures.TimeoutError:
+                for pending_request, pending_future in requests:
+                    self.__forget(pending_request)
+                raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(command))
+        return results
+
+    def addContacts(self, contacts: Iterable[Contact]) -> list[bool]:
+        """Добавляет контакты, не дожидаясь ответа на каждый запрос. Для больших объёмов используйте importFile."""
+        return self.__batch(Commands.ADD, contacts)
+
+    def deleteContacts(self, contacts: Iterable[Contact]) -> list[bool]:
+        """Удаляет контакты, не дожидаясь ответа на каждый запрос. Возвращает результаты в порядке contacts."""
+        return self.__batch(Commands.DELETE, contacts)
+
+    def applyBatch(self, operations: Iterable[BatchOperation], atomic: bool = True) -> BatchResult:
+        """Выполняет операции одним запросом и одной транзакцией (см. BatchRequest). Отменённый атомарный пакет 
+        возвращается с committed == False, для некорректного пакета вызывается ClientError."""
+        request = ClientRequest(command=Commands.BATCH, data=BatchRequest(operations=list(operations), atomic=atomic))
+        response: ServerResponse = self.call(request)
+        return response.data if isinstance(response.data, BatchResult) else _result(request, response)
+
+    def importFile(self, file: BinaryIO, format: BulkFormat) -> ImportReport:
+        """Загружает содержимое файла на сервер. Фрагменты файла должны следовать по соединению подряд, поэтому
+        другие запросы клиента на время загрузки откладываются."""
+        request = ClientRequest(command=Commands.BULK_IMPORT, data=BulkImport(format))
+        with self.__send_lock:
+            sock: socket.socket = self.__connect()
+            future: concurrent.futures.Future = self.__send(sock, request)
+            try:
+                while chunk := file.read(CHUNK_SIZE):
+                    send_object(sock, ClientRequest(command=Commands.BULK_IMPORT, data=chunk))
+                send_object(sock, ClientRequest(command=Commands.BULK_IMPORT, data=b''))
+            except OSError as error:
+                self.__drop(sock, error)
+        return _result(request, self.__wait(request, future))
+
+    def exportChunks(self, format: BulkFormat, filter: Filter | None = None) -> Iterator[bytes]:
+        """Выгружает контакты с сервера, возвращая содержимое файла фрагментами."""
+        request = ClientRequest(command=Commands.EXPORT, data=ExportRequest(filter=filter, format=format))
+        with self.__send_lock:
+            chunks: queue.Queue = self.__send(self.__connect(), request, queue.Queue())
+        try:
+            while True:
+                try:
+                    response: ServerResponse | Exception = chunks.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(request.command))
+                if isinstance(response, Exception):
+                    raise response
+                chunk: bytes | None = _result(request, response)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.__forget(request)
+
+    def exportFile(self, file: BinaryIO, format: BulkFormat, filter: Filter | None = None) -> None:
+        """Выгружает контакты с сервера в файл."""
+        for chunk in self.exportChunks(format, filter):
+            file.write(chunk)
+
+    def close(self):
+        """Закрывает соединение. Ожидающие ответа запросы завершаются ConnectionError."""
+        self.__closed = True
+        sock: socket.socket | None = self.__socket
+        if sock is not None:
+            self.__drop(sock, None)
+
+
+class PhonebookClientPool:
+    """Пул клиентов для многопоточных программ.
+
+    Поток получает клиента в монопольное пользование на время блока with, поэтому запросы разных потоков идут по
+    разным соединениям и не ожидают друг друга (изменяющие запросы одного соединения сервер выполняет по очереди).
+    Клиенты создаются по мере необходимости, но не более size; при исчерпании пула поток ожидает освобождения клиента.
+    Параметры options передаются конструктору PhonebookClient."""
+    SIZE: int = 8
+
+    def __init__(self, size: int = SIZE, **options):
+        self.__options: dict = options
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__idle: queue.LifoQueue[PhonebookClient] = queue.LifoQueue()  # Недавно использованный клиент вероятнее подключён.
+        self.__clients: list[PhonebookClient] = []
+        self.__lock = threading.Lock()
+
+    def __enter__(self) -> 'PhonebookClientPool':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextlib.contextmanager
+    def client(self) -> Iterator[PhonebookClient]:
+        """Выдаёт клиента на время блока with."""
+        self.__slots.acquire()
+        try:
+            try:
+                client: PhonebookClient = self.__idle.get_nowait()
+            except queue.Empty:
+                client = PhonebookClient(**self.__options)
+                with self.__lock:
+                    self.__clients.append(client)
+            try:
+                yield client
+            finally:
+                self.__idle.put(client)
+        finally:
+            self.__slots.release()
+
+    def close(self):
+        """Закрывает соединения всех клиентов пула."""
+        with self.__lock:
+            for client in self.__clients:
+                client.close()
+
+
+class AsyncPhonebookClient:
+    """Асинхронный (asyncio) клиент телефонной книги с теми же возможностями, что и PhonebookClient.
+
+    Запросы, выполняемые одновременно из разных задач, передаются по одному соединению конвейером. Обратные вызовы
+    on_notify и on_disconnect выполняются в цикле событий."""
+    TIMEOUT: float = PhonebookClient.TIMEOUT
+    ATTEMPTS: int = PhonebookClient.ATTEMPTS
+    BACKOFF: float = PhonebookClient.BACKOFF
+    MAX_BACKOFF: float = PhonebookClient.MAX_BACKOFF
+    COMPRESSION: list[Compression] = PhonebookClient.COMPRESSION
+
+    def __init__(self, host: str = 'localhost', port: int = PORT, timeout: float = TIMEOUT, attempts: int = ATTEMPTS,
+                 compression: list[Compression] | None = None, on_notify: Callable[[Delta], None] | None = None,
+                 on_disconnect: Callable[[], None] | None = None):
+        self.host: str = host
+        self.port: int = port
+        self.timeout: float = timeout
+        self.attempts: int = attempts
+        self.compression: list[Compression] = self.COMPRESSION if compression is None else compression
+        self.on_notify: Callable[[Delta], None] | None = on_notify
+        self.on_disconnect: Callable[[], None] | None = on_disconnect
+        self.handshake: Handshake | None = None
+        self.__send_lock: asyncio.Lock | None = None  # Создаётся в цикле событий, в котором используется клиент.
+        self.__writer: asyncio.StreamWriter | None = None
+        self.__pending: dict[int, asyncio.Future | asyncio.Queue] = {}
+        self.__next_id: int = 1
+        self.__closed: bool = False
+
+    async def __aenter__(self) -> 'AsyncPhonebookClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self.__writer is not None
+
+    @contextlib.asynccontextmanager
+    async def __locked(self) -> AsyncIterator[asyncio.StreamWriter]:
+        """Подключается к серверу при необходимости и монопольно предоставляет соединение для отправки."""
+        if self.__send_lock is None:
+            self.__send_lock = asyncio.Lock()
+        async with self.__send_lock:
+            yield await self.__connect()
+
+    async def connect(self):
+        """Подключается к серверу, если соединение ещё не установлено."""
+        async with self.__locked():
+            pass
+
+    async def __connect(self) -> asyncio.StreamWriter:
+        if self.__closed:
+            raise ConnectionError('Клиент закрыт.')
+        if self.__writer is not None:
+            return self.__writer
+        delay: float = self.BACKOFF
+        for attempt in range(1, self.attempts + 1):
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                break
+            except (OSError, asyncio.TimeoutError) as error:
+                if attempt >= self.attempts:
+                    raise ConnectionError('Не удалось подключиться к {0}:{1}: {2}'.format(self.host, self.port, error)) from error
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_BACKOFF)
+        self.__writer = writer
+        asyncio.get_running_loop().create_task(self.__receiveLoop(reader, writer))
+
+        self.handshake = None
+        if self.compression:
+            request = ClientRequest(command=Commands.HELLO, data=Handshake(compression=self.compression))
+            try:
+                self.handshake = _result(request, await self.__wait(request, await self.__send(writer, request)))
+            except Exception as error:
+                self.__drop(writer, error)
+                raise
+        return writer
+
+    async def __send(self, writer: asyncio.StreamWriter, request: ClientRequest,
+                     pending: asyncio.Future | asyncio.Queue | None = None) -> asyncio.Future | asyncio.Queue:
+        if pending is None:
+            pending = asyncio.get_running_loop().create_future()
+        request.id = self.__next_id
+        self.__next_id += 1
+        self.__pending[request.id] = pending
+        try:
+            write_message(writer, tag_message(encode_object(request), request.id))
+            await writer.drain()
+        except OSError as error:
+            self.__drop(writer, error)
+        return pending
+
+    async def __receiveLoop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        error: Exception | None = None
+        try:
+            while (data := await read_message(reader)) is not None:
+                response = decode_object(data)
+                if not isinstance(response, ServerResponse):
+                    raise ProtocolError('Некорректный тип сообщения от сервера ({0}).'.format(type(response)))
+                if response.command == Commands.NOTIFY:
+                    if self.on_notify is not None:
+                        self.on_notify(response.data)
+                    continue
+                pending = self.__pending.get(response.id)
+                if pending is not None and _is_final(response):
+                    del self.__pending[response.id]
+                if isinstance(pending, asyncio.Queue):
+                    pending.put_nowait(response)
+                elif pending is not None and not pending.done():
+                    pending.set_result(response)
+        except Exception as exception:
+            error = exception
+        self.__drop(writer, error)
+
+    def __drop(self, writer: asyncio.StreamWriter, error: Exception | None):
+        if self.__writer is not writer:
+            return
+        self.__writer = None
+        pending, self.__pending = self.__pending, {}
+        writer.close()
+        exception = ConnectionError('Соединение с сервером разорвано{0}'.format(
+            '.' if error is None else ': {0}'.format(error)))
+        for waiter in pending.values():
+            if isinstance(waiter, asyncio.Queue):
+                waiter.put_nowait(exception)
+            elif not waiter.done():
+                waiter.set_exception(exception)
+        if not self.__closed and self.on_disconnect is not None:
+            self.on_disconnect()
+
+    async def __wait(self, request: ClientRequest, future: asyncio.Future) -> ServerResponse:
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.__pending.pop(request.id, None)
+            raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(request.command))
+
+    async def submit(self, request: ClientRequest) -> asyncio.Future:
+        """Отправляет запрос, не дожидаясь ответа. Возвращает Future, которому будет передан ответ сервера."""
+        async with self.__locked() as writer:
+            return await self.__send(writer, request)
+
+    async def call(self, request: ClientRequest) -> ServerResponse:
+        """Выполняет запрос и возвращает ответ сервера."""
+        return await self.__wait(request, await self.submit(request))
+
+    async def request(self, request: ClientRequest):
+        """Выполняет запрос и возвращает данные ответа. Если сервер сообщил об ошибке, вызывает ClientError."""
+        return _result(request, await self.call(request))
+
+    async def addContact(self, contact: Contact) -> bool:
+        return (await self.call(ClientRequest(command=Commands.ADD, data=contact))).flag
+
+    async def deleteContact(self, contact: Contact) -> bool:
+        return (await self.call(ClientRequest(command=Commands.DELETE, data=contact))).flag
+
+    async def getContacts(self, filter: Filter | None = None) -> list[Contact]:
+        return await self.request(ClientRequest(command=Commands.UPDATE, data=filter))
+
+    async def getChanges(self, filter: Filter | None = None, revision: int | None = None) -> Snapshot | Delta:
+        return await self.request(ClientRequest(command=Commands.UPDATE, data=UpdateRequest(filter=filter, revision=revision)))
+
+    async def getPage(self, query: Query) -> Page:
+        return await self.request(ClientRequest(command=Commands.UPDATE, data=query))
+
+    async def countContacts(self, filter: Filter | None = None) -> int:
+        return (await self.getPage(Query(filter=filter, count_only=True))).total
+
+    async def getStatistics(self) -> dict:
+        return await self.request(ClientRequest(command=Commands.STATS))
+
+    async def subscribe(self, filter: Filter | None = None, revision: int | None = None) -> Snapshot | Delta:
+        return await self.request(ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest(filter=filter, revision=revision)))
+
+    async def subscribePage(self, query: Query) -> Page:
+        return await self.request(ClientRequest(command=Commands.SUBSCRIBE, data=query))
+
+    async def __batch(self, command: Commands, contacts: Iterable[Contact]) -> list[bool]:
+        futures: list[asyncio.Future] = []
+        async with self.__locked() as writer:
+            for contact in contacts:
+                futures.append(await self.__send(writer, ClientRequest(command=command, data=contact)))
+        try:
+            responses: list[ServerResponse] = await asyncio.wait_for(asyncio.gather(*futures), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(command))
+        return [response.flag for response in responses]
+
+    async def addContacts(self, contacts: Iterable[Contact]) -> list[bool]:
+        return await self.__batch(Commands.ADD, contacts)
+
+    async def deleteContacts(self, contacts: Iterable[Contact]) -> list[bool]:
+        return await self.__batch(Commands.DELETE, contacts)
+
+    async def applyBatch(self, operations: Iterable[BatchOperation], atomic: bool = True) -> BatchResult:
+        request = ClientRequest(command=Commands.BATCH, data=BatchRequest(operations=list(operations), atomic=atomic))
+        response: ServerResponse = await self.call(request)
+        return response.data if isinstance(response.data, BatchResult) else _result(request, response)
+
+    async def importFile(self, file: BinaryIO, format: BulkFormat) -> ImportReport:
+        """Загружает содержимое файла на сервер (файл читается синхронно)."""
+        request = ClientRequest(command=Commands.BULK_IMPORT, data=BulkImport(format))
+        async with self.__locked() as writer:
+            future: asyncio.Future = await self.__send(writer, request)
+            try:
+                while chunk := file.read(CHUNK_SIZE):
+                    write_message(writer, encode_object(ClientRequest(command=Commands.BULK_IMPORT, data=chunk)))
+                    await writer.drain()
+                write_message(writer, encode_object(ClientRequest(command=Commands.BULK_IMPORT, data=b'')))
+                await writer.drain()
+            except OSError as error:
+                self.__drop(writer, error)
+        return _result(request, await self.__wait(request, future))
+
+    async def exportChunks(self, format: BulkFormat, filter: Filter | None = None) -> AsyncIterator[bytes]:
+        request = ClientRequest(command=Commands.EXPORT, data=ExportRequest(filter=filter, format=format))
+        async with self.__locked() as writer:
+            chunks: asyncio.Queue = await self.__send(writer, request, asyncio.Queue())
+        try:
+            while True:
+                try:
+                    response: ServerResponse | Exception = await asyncio.wait_for(chunks.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError('Сервер не ответил на запрос ({0}).'.format(request.command))
+                if isinstance(response, Exception):
+                    raise response
+                chunk: bytes | None = _result(request, response)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.__pending.pop(request.id, None)
+
+    async def exportFile(self, file: BinaryIO, format: BulkFormat, filter: Filter | None = None) -> None:
+        async for chunk in self.exportChunks(format, filter):
+            file.write(chunk)
+
+    async def close(self):
+        self.__closed = True
+        writer: asyncio.StreamWriter | None = self.__writer
+        if writer is not None:
+            self.__drop(writer, None)
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
@@ -0,0 +1,153 @@
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from typing import TextIO
+from common import Contact, Filter
+
+
+class QueryTimer:
+    """Секундомер операции хранилища: время этапов (lap) и общее время."""
+    def __init__(self):
+        self.start: float = time.perf_counter()
+        self.__last: float = self.start
+        self.laps: dict[str, float] = {}  # Этап → длительность [с].
+
+    def lap(self, name: str):
+        """Завершает этап name, начавшийся в конце предыдущего этапа."""
+        now: float = time.perf_counter()
+        self.laps[name] = self.laps.get(name, 0.0) + now - self.__last
+        self.__last = now
+
+    @property
+    def total(self) -> float:
+        return self.__last - self.start
+
+
+class SlowQueryLog:
+    """Журнал медленных операций хранилища в формате JSON Lines.
+
+    Записываются операции, выполнявшиеся дольше threshold секунд: время, операция, фильтр или номер контакта, число
+    строк, длительности этапов и план запроса (для SQLite — вывод EXPLAIN QUERY PLAN). Порог можно менять во время
+    работы сервера."""
+    THRESHOLD: float = 0.1  # [с]
+    LOG_NAME: str = 'slow.log'
+
+    def __init__(self, log_name: str = LOG_NAME, threshold: float = THRESHOLD):
+        self.log_name: str = log_name
+        self.threshold: float = threshold
+        self.records: int = 0  # Сколько операций записано.
+        self.__lock = threading.Lock()
+        self.__file: TextIO = open(log_name, 'a', encoding='utf-8')
+
+    def isSlow(self, timer: QueryTimer) -> bool:
+        return timer.total >= self.threshold
+
+    def write(self, operation: str, timer: QueryTimer, rows: int, filter: Filter | None = None,
+              contact: Contact | None = None, plan: list[str] | None = None, batch: int | None = None):
+        record: dict = {
+            'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'operation': operation,
+            'ms': round(timer.total * 1000, 3),
+            'rows': rows,
+            'batch': batch,  # Число изменений, зафиксированных вместе (групповая фиксация).
+            'filter': None if filter is None else {'field': filter.field, 'text': filter.text},
+            'number': None if contact is None else contact.number,
+            'timings_ms': {name: round(seconds * 1000, 3) for name, seconds in timer.laps.items()},
+            'plan': plan,
+        }
+        line: str = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.__lock:
+            if self.__file.closed:  # Журнал отключён, пока выполнялась операция.
+                return
+            self.__file.write(line)
+            self.__file.flush()
+            self.records += 1
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+class SamplingProfiler:
+    """Статистический профилировщик всех потоков процесса.
+
+    В отличие от cProfile, который учитывает только включивший его поток, профилировщик с периодом INTERVAL снимает
+    стеки всех потоков (sys._current_frames) и подсчитывает, сколько раз встретилась каждая цепочка вызовов. Поэтому
+    его можно включить на работающем сервере: накладные расходы не зависят от числа вызовов функций.
+
+    Результат записывается в формате «свёрнутых стеков» (поток;функция;…;функция число), который понимают
+    flamegraph.pl и speedscope."""
+    INTERVAL: float = 0.005  # [с]
+    TOP: int = 20  # Сколько функций выводится в сводке.
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval: float = interval
+        self.__thread: threading.Thread | None = None
+        self.__stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self, seconds: float, path: str):
+        """Запускает профилирование на seconds секунд в фоновом потоке. По окончании записывает стеки в файл path
+        и выводит сводку."""
+        if self.running:
+            raise RuntimeError('Профилирование уже выполняется.')
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, args=(seconds, path), name='profiler', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Досрочно завершает профилирование (результаты записываются)."""
+        self.__stop.set()
+
+    @staticmethod
+    def __describe(code) -> str:
+        return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def __run(self, seconds: float, path: str):
+        stacks: collections.Counter[tuple[str, ...]] = collections.Counter()
+        own: int = threading.get_ident()
+        names: dict[int, str] = {}
+        samples: int = 0
+        deadline: float = time.monotonic() + seconds
+        while not self.__stop.wait(self.interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack: list[str] = []
+                while frame is not None:
+                    stack.append(self.__describe(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write('{0} {1}\n'.format(';'.join(stack), count))
+        print(self.summary(stacks, samples, path))
+
+    def summary(self, stacks: collections.Counter, samples: int, path: str) -> str:
+        """Сводка: функции, чаще всего находившиеся на вершине стека, и функции с наибольшим включительным временем."""
+        own_counts: collections.Counter[str] = collections.Counter()
+        inclusive: collections.Counter[str] = collections.Counter()
+        for stack, count in stacks.items():
+            if len(stack) > 1:
+                own_counts[stack[-1]] += count
+            for function in set(stack[1:]):
+                inclusive[function] += count
+        total: int = sum(own_counts.values()) or 1
+        lines: list[str] = ['Профилирование завершено: {0} снимков, стеки записаны в {1}.'.format(samples, path),
+                            'Собственное время (доля снимков потоков):']
+        lines.extend('  {0:6.2%}  {1}'.format(count / total, function) for function, count in own_counts.most_common(self.TOP))
+        lines.append('Включительное время:')
+        lines.extend('  {0:6.2%}  {1}'.format(count / total, function) for function, count in inclusive.most_common(self.TOP))
+        return '\n'.join(lines)
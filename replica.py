@@ -0,0 +1,88 @@
+import sqlite3
+from common import Contact, Snapshot, Delta
+
+
+class Replica:
+    """Локальная копия телефонной книги клиента в базе данных SQLite.
+
+    Копия хранит все контакты вместе с ревизией сервера, которой они соответствуют. При запуске клиент сразу
+    показывает контакты копии, а у сервера запрашивает только изменения, произошедшие после её ревизии. Пока
+    соединения нет, поиск выполняется по копии.
+
+    Копия обновляется только данными всей телефонной книги (снимком без фильтра или изменениями всех контактов),
+    поэтому всегда совпадает с телефонной книгой сервера на момент своей ревизии. Контакты копии также хранятся
+    в памяти (contacts), а база данных читается только при открытии. Копия принадлежит серверу host: копия другого
+    сервера при открытии не загружается и заменяется при первой синхронизации."""
+    DATABASE_NAME: str = 'replica.db'
+    TABLE: str = 'Contacts'
+    META_TABLE: str = 'Meta'
+
+    def __init__(self, host: str, database_name: str = DATABASE_NAME):
+        self.host: str = host
+        self.database_name: str = database_name
+        self.revision: int | None = None  # Ревизия сервера, которой соответствует копия (None — копии нет).
+        self.contacts: list[Contact] = []
+        self.__connection: sqlite3.Connection = sqlite3.connect(database_name)
+        try:
+            self.__connection.execute('PRAGMA journal_mode = WAL;')
+            self.__connection.execute('''
+            CREATE TABLE IF NOT EXISTS {0} (
+            name TEXT NOT NULL,
+            surname TEXT NOT NULL,
+            patronymic TEXT NOT NULL,
+            number TEXT NOT NULL,
+            note TEXT,
+            PRIMARY KEY (number)
+            )
+            '''.format(self.TABLE))
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS {0} (key TEXT PRIMARY KEY, value TEXT);'.format(self.META_TABLE))
+            self.__connection.commit()
+            self.__load()
+        except sqlite3.Error:
+            self.__connection.close()
+            raise
+
+    def __load(self):
+        meta: dict[str, str] = dict(self.__connection.execute('SELECT key, value FROM {0};'.format(self.META_TABLE)))
+        if meta.get('host') != self.host or 'revision' not in meta:
+            return
+        self.contacts = [Contact(*row) for row in self.__connection.execute(
+            'SELECT name, surname, patronymic, number, note FROM {0};'.format(self.TABLE))]
+        self.revision = int(meta['revision'])
+
+    def __setRevision(self, revision: int):
+        self.__connection.executemany('INSERT OR REPLACE INTO {0} (key, value) VALUES (?, ?);'.format(self.META_TABLE),
+                                      (('host', self.host), ('revision', str(revision))))
+
+    def close(self):
+        self.__connection.close()
+
+    def replace(self, snapshot: Snapshot) -> list[Contact]:
+        """Заменяет содержимое копии снимком всей телефонной книги и возвращает контакты копии."""
+        with self.__connection:  # Транзакция: при ошибке копия остаётся прежней.
+            self.__connection.execute('DELETE FROM {0};'.format(self.TABLE))
+            self.__connection.executemany('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(self.TABLE),
+                                          ((pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note) for pbr in snapshot.contacts))
+            self.__setRevision(snapshot.revision)
+        self.contacts = snapshot.contacts
+        self.revision = snapshot.revision
+        return self.contacts
+
+    def apply(self, delta: Delta) -> list[Contact]:
+        """Применяет изменения всей телефонной книги и возвращает контакты копии. Изменения должны начинаться не позже
+        ревизии копии, иначе — ValueError."""
+        if self.revision is None or delta.since > self.revision:
+            raise ValueError('Изменения начинаются после ревизии локальной копии.')
+        if delta.revision <= self.revision:
+            return self.contacts  # Изменения уже учтены.
+        with self.__connection:
+            if delta.modified:
+                self.__connection.executemany('DELETE FROM {0} WHERE number = ?;'.format(self.TABLE),
+                                              ((pbr.number,) for pbr in delta.deleted + delta.inserted))
+                self.__connection.executemany('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(self.TABLE),
+                                              ((pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note) for pbr in delta.inserted))
+            self.__setRevision(delta.revision)
+        if delta.modified:
+            self.contacts = delta.apply(self.contacts)
+        self.revision = delta.revision
+        return self.contacts
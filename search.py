@@ -0,0 +1,97 @@
+import bisect
+import itertools
+import operator
+from collections import OrderedDict
+from common import Contact, Filter
+
+
+class FieldIndex:
+    """Значения одного поля списка контактов, склеенные в одну строку через SEPARATOR.
+
+    Подстрока ищется методом str.find сразу по всей строке, поэтому неподходящие контакты не перебираются в Python,
+    а номер контакта по позиции совпадения находится двоичным поиском по началам значений."""
+    SEPARATOR: str = '\0'
+
+    def __init__(self, contacts: list[Contact], field: str):
+        values: list[str] = ['' if value is None else value for value in map(operator.attrgetter(field), contacts)]
+        self.__starts: list[int] = list(itertools.accumulate((len(value) + 1 for value in values[:-1]), initial=0))
+        self.__text: str = self.SEPARATOR.join(values)
+
+    def find(self, text: str) -> list[int]:
+        """Возвращает по возрастанию номера контактов, значение поля которых содержит непустую подстроку text
+        (без SEPARATOR)."""
+        rows: list[int] = []
+        position: int = self.__text.find(text)
+        while position >= 0:
+            row: int = bisect.bisect_right(self.__starts, position) - 1
+            rows.append(row)
+            if row + 1 >= len(self.__starts):
+                break
+            position = self.__text.find(text, self.__starts[row + 1])  # Следующее совпадение — в следующих контактах.
+        return rows
+
+
+class SearchCache:
+    """Результаты недавних поисков по контактам одной ревизии.
+
+    Данные (reset) — все контакты, удовлетворяющие фильтру filter. Если текст фильтра поиска содержит текст фильтра
+    по тому же полю, результат которого уже известен, искомые контакты — подмножество этого результата. Поэтому
+    поиск, уточняющий фильтр данных или один из SIZE последних поисков (например, при наборе текста), выполняется
+    по наименьшему такому результату без обращения к серверу. Для каждого результата строятся индексы FieldIndex
+    полей, по которым в нём искали.
+
+    Поиск учитывает регистр, как и на сервере (Filter.match). Новые данные (другая ревизия) заменяют все результаты."""
+    SIZE: int = 16
+
+    def __init__(self, size: int = SIZE):
+        self.size: int = size
+        self.filter: Filter | None = None  # Фильтр, которому удовлетворяют данные.
+        self.contacts: list[Contact] = []
+        self.hits: int = 0  # Сколько поисков выполнено по сохранённым результатам.
+        self.misses: int = 0  # Сколько поисков не уточняли известных результатов.
+        self.__results: OrderedDict[Filter | None, tuple[list[Contact], dict[str, FieldIndex]]] = OrderedDict()
+        self.reset(None, [])
+
+    def reset(self, filter: Filter | None, contacts: list[Contact]):
+        """Заменяет данные: contacts — все контакты, удовлетворяющие фильтру filter."""
+        self.filter = Filter.normalize(filter)
+        self.contacts = contacts
+        self.__results.clear()
+        self.__results[self.filter] = (contacts, {})
+
+    @staticmethod
+    def narrows(filter: Filter | None, known: Filter | None) -> bool:
+        """Входят ли контакты, удовлетворяющие filter, в контакты, удовлетворяющие known."""
+        return known is None or (filter is not None and filter.field == known.field and known.text in filter.text)
+
+    def covers(self, filter: Filter | None) -> bool:
+        """Можно ли найти контакты, удовлетворяющие фильтру, в данных."""
+        return self.narrows(Filter.normalize(filter), self.filter)
+
+    def search(self, filter: Filter | None) -> list[Contact] | None:
+        """Возвращает контакты, удовлетворяющие фильтру, или None, если фильтр не уточняет фильтр данных."""
+        filter = Filter.normalize(filter)
+        if filter in self.__results:
+            self.__results.move_to_end(filter)
+            self.hits += 1
+            return self.__results[filter][0]
+        known: list[tuple[list[Contact], dict[str, FieldIndex]]] = [
+            result for known_filter, result in self.__results.items() if self.narrows(filter, known_filter)]
+        if not known:
+            self.misses += 1
+            return None
+        self.hits += 1
+        contacts, indexes = min(known, key=lambda result: len(result[0]))
+        if not filter.text or FieldIndex.SEPARATOR in filter.text:
+            found: list[Contact] = [contact for contact in contacts if filter.match(contact)]
+        else:
+            index: FieldIndex | None = indexes.get(filter.field)
+            if index is None:
+                index = indexes[filter.field] = FieldIndex(contacts, filter.field)
+            found: list[Contact] = [contacts[row] for row in index.find(filter.text)]
+
+        self.__results[filter] = (found, {})
+        while len(self.__results) > self.size + 1:  # Результат для фильтра данных не вытесняется.
+            oldest: Filter | None = next(known_filter for known_filter in self.__results if known_filter != self.filter)
+            del self.__results[oldest]
+        return found
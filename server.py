@@ -1,180 +1,1044 @@
-import pickle
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
 import socket
-import sqlite3
 import threading
-from common import Contact, HOST, PORT, ClientRequest, Commands, ServerResponse, Filter
-
-
-class DatabaseConnection:
-    DATABASE_NAME: str = 'phonebook.db'
-    TABLE: str = 'Phonebook'
-
-    @classmethod
-    def createDatabase(cls):
-        """Создаёт базу данных."""
-        connection = sqlite3.connect(cls.DATABASE_NAME)  # Создаем подключение к базе данных.
-        cursor = connection.cursor()
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS {0} (
-        name TEXT NOT NULL,
-        surname TEXT NOT NULL,
-        patronymic TEXT NOT NULL,
-        number TEXT NOT NULL,
-        note TEXT,
-        PRIMARY KEY (number)
-        )
-        '''.format(cls.TABLE))
-
-        connection.commit()
-        connection.close()
-
-    @classmethod
-    def insert(cls, pbr: Contact):
-        connection = sqlite3.connect(cls.DATABASE_NAME)  # Создаем подключение к базе данных.
-        cursor = connection.cursor()
+import time
+from collections import deque
+from typing import Callable, Iterator
+import bulk
+from cache import ResponseCache
+from metrics import ServerMetrics, RequestTiming, MetricsEndpoint, render_text
+from profiling import SlowQueryLog, SamplingProfiler
+from common import (Contact, HOST, PORT, ClientRequest, Commands, ServerResponse, Filter, UpdateRequest, Query, Delta, BulkFormat,
+                    BulkImport, ExportRequest, ImportReport, BatchRequest, BatchResult, WireFormat, Compression, Handshake,
+                    receive_message, send_message, read_message, write_message, encode_object, decode_object, wire_format,
+                    compress_message, decompress_message, is_compressed, tag_message, untag_message)
+from storage import Storage, DatabaseConnection, MemoryStorage
 
+
+class ClientConnection:
+    """Подключение клиента.
+
+    Отправка сообщений защищена блокировкой, так как уведомления об изменениях отправляются из потоков других клиентов. 
+    Уведомления рассылаются под Storage.write_lock, поэтому не отправляются сразу, а ставятся в очередь 
+    (sendLater), которую отправляет отдельный поток подключения: клиент, не принимающий сообщений, не задерживает 
+    изменения."""
+    MAX_PENDING: int = 16 * 1024 * 1024  # Наибольший объём неотправленных уведомлений [байт].
+
+    def __init__(self, client_socket: socket.socket, client_address):
+        self.socket: socket.socket = client_socket
+        self.address = client_address
+        self.format: WireFormat = WireFormat.BINARY  # Формат сообщений клиента, в нём же отправляются ответы.
+        self.compression: Compression = Compression.NONE  # Согласованный способ сжатия ответов.
+        self.threshold: int = 0  # Ответы длиннее порога сжимаются [байт].
+        self.__send_lock = threading.Lock()
+        self.__outbox = threading.Condition()  # Защищает очередь уведомлений.
+        self.__pending: deque[bytes] = deque()
+        self.__pending_size: int = 0
+        self.__sender: threading.Thread | None = None
+        self.__closed: bool = False
+
+    def sendEncoded(self, payload: bytes, wait: bool = False) -> bool:
+        """Отправляет уже сериализованное сообщение. Отправка всегда выполняется синхронно, поэтому wait не важен."""
+        with self.__send_lock:
+            try:
+                send_message(self.socket, payload)  # Отправляем данные клиенту.
+            except Exception as error:
+                return False
+            else:  # Если исключения не было.
+                return True
+
+    def sendLater(self, payload: bytes) -> bool:
+        """Ставит сообщение в очередь отправки. Возвращает False, если объём очереди превысил бы MAX_PENDING: клиент 
+        не успевает принимать сообщения."""
+        with self.__outbox:
+            if self.__closed:
+                return True
+            if self.__pending_size + len(payload) > self.MAX_PENDING:
+                return False
+            self.__pending.append(payload)
+            self.__pending_size += len(payload)
+            if self.__sender is None:
+                self.__sender = threading.Thread(target=self.__sendPending, name='notify', daemon=True)
+                self.__sender.start()
+            self.__outbox.notify()
+        return True
+
+    def __sendPending(self):
+        while True:
+            with self.__outbox:
+                while not self.__pending and not self.__closed:
+                    self.__outbox.wait()
+                if self.__closed:
+                    return
+                payload: bytes = self.__pending.popleft()
+                self.__pending_size -= len(payload)
+            with self.__send_lock:
+                try:
+                    send_message(self.socket, payload)
+                except Exception as error:
+                    pass
+
+    def abort(self):
+        """Разрывает подключение (клиент, переподключившись, запросит пропущенные изменения)."""
         try:
-            cursor.execute('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(cls.TABLE),
-                           (pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
-        except Exception as error:
-            ...
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        """Останавливает отправку уведомлений. Вызывается, когда клиент отключился."""
+        with self.__outbox:
+            self.__closed = True
+            self.__pending.clear()
+            self.__outbox.notify()
 
-        connection.commit()
-        connection.close()
+    def receive(self) -> bytes | None:
+        """Принимает следующее сообщение клиента. Используется обработчиком потоковых команд."""
+        return receive_message(self.socket)
 
-    @classmethod
-    def delete(cls, pbr: Contact) -> bool:
-        connection = sqlite3.connect(cls.DATABASE_NAME)  # Создаем подключение к базе данных.
-        cursor = connection.cursor()
 
-        cursor.execute('DELETE FROM {0} WHERE name = ? AND surname = ? AND patronymic = ? AND number = ? AND note = ?;'.format(cls.TABLE),
-                       (pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
+class AsyncClientConnection:
+    """Подключение клиента в асинхронном режиме.
 
-        connection.commit()
-        connection.close()
+    Сообщения сериализуются в вызывающем потоке (обработчике запроса или потоке, рассылающем уведомления), а запись 
+    в сокет выполняется в цикле событий."""
+    MAX_PENDING: int = ClientConnection.MAX_PENDING  # Наибольший объём неотправленных данных при постановке уведомления [байт].
 
-        rowcount: int = cursor.rowcount
-        assert rowcount == 0 or rowcount == 1
-        if cursor.rowcount == 1:
+    def __init__(self, loop: asyncio.AbstractEventLoop, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.address = writer.get_extra_info('peername')
+        self.format: WireFormat = WireFormat.BINARY  # Формат сообщений клиента, в нём же отправляются ответы.
+        self.compression: Compression = Compression.NONE  # Согласованный способ сжатия ответов.
+        self.threshold: int = 0  # Ответы длиннее порога сжимаются [байт].
+
+    def sendEncoded(self, payload: bytes, wait: bool = False) -> bool:
+        """Отправляет уже сериализованное сообщение. Если wait == True, дожидается, пока буфер отправки освободится: 
+        так потоковая передача не накапливает в памяти данные, которые клиент не успевает принимать."""
+        if self.writer.is_closing():
+            return False
+        try:
+            if wait:
+                asyncio.run_coroutine_threadsafe(self.__write(payload), self.loop).result()
+            else:
+                self.loop.call_soon_threadsafe(write_message, self.writer, payload)
+        except (RuntimeError, ConnectionError) as error:  # Цикл событий уже закрыт или клиент отключился.
+            return False
+        else:  # Если исключения не было.
             return True
-        elif cursor.rowcount == 0:
+
+    async def __write(self, payload: bytes):
+        write_message(self.writer, payload)
+        await self.writer.drain()
+
+    def receive(self) -> bytes | None:
+        """Принимает следующее сообщение клиента. Вызывается из потока обработчика, пока цикл событий ждёт его ответа."""
+        return asyncio.run_coroutine_threadsafe(read_message(self.reader), self.loop).result()
+
+    def sendLater(self, payload: bytes) -> bool:
+        """Отправляет сообщение, не дожидаясь записи. Возвращает False, если в буфере отправки уже больше MAX_PENDING 
+        байт: клиент не успевает принимать сообщения."""
+        if self.writer.transport.get_write_buffer_size() > self.MAX_PENDING:
             return False
+        self.sendEncoded(payload)
+        return True
 
-    @classmethod
-    def getPhones(cls) -> list[Contact]:
-        phone_list: list[Contact] = []
-        connection = sqlite3.connect(cls.DATABASE_NAME)  # Создаем подключение к базе данных.
-        cursor = connection.cursor()
-
-        cursor.execute('SELECT * FROM {0};'.format(cls.TABLE))
-        for phone in cursor.fetchall():
-            pr = Contact(name=phone[0],
-                         surname=phone[1],
-                         patronymic=phone[2],
-                         number=phone[3],
-                         note=phone[4])
-            phone_list.append(pr)
-
-        connection.close()
-        return phone_list
-
-    @classmethod
-    def getFilteredPhones(cls, filter: Filter | None) -> list[Contact]:
-        phone_list: list[Contact] = []
-        connection = sqlite3.connect(cls.DATABASE_NAME)  # Создаем подключение к базе данных.
-        cursor = connection.cursor()
-
-        if filter is None:
-            request: str = 'SELECT * FROM {0};'.format(cls.TABLE)
-            cursor.execute(request)
-        elif filter.field is None or filter.text is None:
-            request: str = 'SELECT * FROM {0};'.format(cls.TABLE)
-            cursor.execute(request)
-        else:
-            request: str = 'SELECT * FROM {0} WHERE {1} GLOB \'*{2}*\';'.format(cls.TABLE, filter.field, filter.text)
-            cursor.execute(request)
+    def abort(self):
+        """Разрывает подключение (клиент, переподключившись, запросит пропущенные изменения)."""
+        try:
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        except RuntimeError:  # Цикл событий уже закрыт.
+            pass
 
-        for phone in cursor.fetchall():
-            pr = Contact(name=phone[0],
-                         surname=phone[1],
-                         patronymic=phone[2],
-                         number=phone[3],
-                         note=phone[4])
-            phone_list.append(pr)
 
-        connection.close()
-        return phone_list
+class Subscription:
+    """Подписка клиента на изменения удовлетворяющих фильтру контактов."""
+    def __init__(self, filter: Filter | None, revision: int):
+        self.filter: Filter | None = filter
+        self.revision: int = revision  # Ревизия, до которой клиент уже получил все интересующие его изменения.
 
 
-if __name__ == '__main__':
-    stop_event = threading.Event()
+class Subscriptions:
+    """Подписки клиентов на изменения телефонной книги.
+
+    Каждое уведомление содержит Delta от ревизии предыдущего уведомления (или подписки) данного клиента. Изменения, 
+    не удовлетворяющие фильтру подписки, клиенту не отправляются, но сдвигают ревизию подписки, поэтому клиент может 
+    применять уведомления без дополнительных запросов.
+
+    Уведомления ставятся в очередь отправки подключения (sendLater). Подключение клиента, не успевающего принимать 
+    уведомления, разрывается, а его подписка удаляется."""
+    def __init__(self, storage: Storage,
+                 encode: Callable[[ClientConnection | AsyncClientConnection, ServerResponse], bytes],
+                 metrics: ServerMetrics):
+        self.storage: Storage = storage
+        self.encode: Callable[[ClientConnection | AsyncClientConnection, ServerResponse], bytes] = encode
+        self.metrics: ServerMetrics = metrics
+        self.__subscriptions: dict[ClientConnection | AsyncClientConnection, Subscription] = {}
+        storage.addListener(self.notify)
+
+    def subscribe(self, connection: ClientConnection | AsyncClientConnection, filter: Filter | None):
+        """Подписывает клиента на изменения (или меняет фильтр существующей подписки)."""
+        with self.storage.write_lock:
+            self.__subscriptions[connection] = Subscription(filter=filter, revision=self.storage.getRevision())
+
+    def unsubscribe(self, connection: ClientConnection | AsyncClientConnection):
+        with self.storage.write_lock:
+            self.__subscriptions.pop(connection, None)
+
+    def notify(self, operation: Commands, contacts: list[Contact], revision: int):
+        """Рассылает уведомление об изменении подписанным клиентам. Вызывается под Storage.write_lock.
+
+        Если изменения неизвестны (Commands.UPDATE), клиенты получают пустую Delta, начинающуюся с новой ревизии, 
+        и запрашивают пропущенные изменения сами."""
+        lagging: list[ClientConnection | AsyncClientConnection] = []  # Клиенты, не успевающие принимать уведомления.
+        for connection, subscription in self.__subscriptions.items():
+            if operation == Commands.UPDATE:
+                delta: Delta | None = Delta(since=revision, revision=revision, inserted=[], deleted=[])
+            else:
+                if subscription.filter is None:
+                    matched: list[Contact] = contacts
+                else:
+                    matched: list[Contact] = [pbr for pbr in contacts if subscription.filter.match(pbr)]
+                delta: Delta | None = None if not matched else Delta(
+                    since=subscription.revision, revision=revision,
+                    inserted=matched if operation == Commands.ADD else [],
+                    deleted=matched if operation == Commands.DELETE else [])
+            if delta is not None:
+                payload: bytes = self.encode(connection, ServerResponse(command=Commands.NOTIFY, flag=True, data=delta))
+                if connection.sendLater(payload):
+                    self.metrics.notified(len(payload))
+                else:
+                    lagging.append(connection)
+            subscription.revision = revision
+        for connection in lagging:
+            del self.__subscriptions[connection]
+            connection.abort()
+            self.metrics.droppedSubscriber()
 
-    def work_with_client(client_socket: socket, client_address):
-        def send(data) -> bool:
-            dump = pickle.dumps(data)  # Сериализация.
+
+class CompressionStatistics:
+    """Статистика сжатия ответов."""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.messages: int = 0  # Сколько ответов сжато.
+        self.original_size: int = 0  # Размер ответов до сжатия [байт].
+        self.compressed_size: int = 0  # Размер ответов после сжатия [байт].
+        self.seconds: float = 0.0  # Время, затраченное на сжатие [с].
+
+    def add(self, original_size: int, compressed_size: int, seconds: float):
+        with self.__lock:
+            self.messages += 1
+            self.original_size += original_size
+            self.compressed_size += compressed_size
+            self.seconds += seconds
+
+    @property
+    def ratio(self) -> float:
+        """Коэффициент сжатия (во сколько раз уменьшился объём ответов)."""
+        return self.original_size / self.compressed_size if self.compressed_size else 1.0
+
+    def __str__(self):
+        return 'Сжато ответов: {0}. Объём: {1} → {2} байт (коэффициент сжатия {3:.1f}). Время сжатия: {4:.3f} с.'.format(
+            self.messages, self.original_size, self.compressed_size, self.ratio, self.seconds)
+
+
+class RequestHandler:
+    """Обработчик запросов клиентов, общий для всех режимов работы сервера.
+
+    Полные выборки (Snapshot и список контактов) сериализуются один раз и хранятся в кэше до следующего изменения 
+    телефонной книги, поэтому одинаковые запросы множества клиентов не требуют обращения к хранилищу.
+
+    Ответ сериализуется в формате запроса клиента (WireFormat). Сообщения pickle позволяют клиенту выполнить на 
+    сервере произвольный код, поэтому принимаются, только если allow_pickle == True (для клиентов предыдущих версий).
+
+    Клиент, выполнивший согласование (Commands.HELLO), получает ответы длиннее порога сжатыми. Порог — наибольший из 
+    предложенного клиентом и compression_threshold, поэтому подтверждения ADD и DELETE не сжимаются.
+
+    Время обращений к хранилищу и сериализации учитывается в показателях (metrics) запроса, переданного в respond."""
+    COMPRESSION: tuple[Compression, ...] = (Compression.ZLIB, Compression.LZMA)  # Поддерживаемые способы сжатия.
+    # Запросы, которые не изменяют ни данных, ни состояния подключения. Такие запросы с идентификатором выполняются
+    # параллельно с соседними, остальные — после завершения всех предыдущих запросов клиента.
+    CONCURRENT: frozenset[Commands] = frozenset({Commands.UPDATE, Commands.STATS})
+
+    def __init__(self, storage: Storage, cache_size: int = ResponseCache.MAX_SIZE, allow_pickle: bool = False,
+                 compression_threshold: int = Handshake.THRESHOLD):
+        self.storage: Storage = storage
+        self.allow_pickle: bool = allow_pickle
+        self.compression_threshold: int = compression_threshold
+        self.compression_statistics = CompressionStatistics()
+        self.metrics = ServerMetrics()
+        self.cache = ResponseCache(max_size=cache_size)
+        storage.addListener(self.cache.invalidate)  # Кэш очищается раньше, чем клиенты получат уведомления.
+        self.subscriptions = Subscriptions(storage, self.encode, self.metrics)
+
+    def statistics(self) -> dict:
+        """Показатели сервера вместе со статистикой кэша ответов и сжатия (ответ на Commands.STATS)."""
+        statistics: dict = self.metrics.statistics()
+        statistics['cache'] = self.cache.statistics()
+        statistics['compression'] = {'messages': self.compression_statistics.messages,
+                                     'original_size': self.compression_statistics.original_size,
+                                     'compressed_size': self.compression_statistics.compressed_size,
+                                     'seconds': self.compression_statistics.seconds}
+        statistics['group_commit'] = self.storage.groupStatistics()
+        return statistics
+
+    def decode(self, connection: ClientConnection | AsyncClientConnection, data: bytes):
+        """Десериализует сообщение клиента и запоминает его формат для ответов."""
+        id, data = untag_message(data)
+        if is_compressed(data):
+            data = decompress_message(data)
+        request = decode_object(data, allow_pickle=self.allow_pickle)
+        if isinstance(request, ClientRequest):
+            request.id = id
+        connection.format = wire_format(data)
+        return request
+
+    def encode(self, connection: ClientConnection | AsyncClientConnection, response: ServerResponse) -> bytes:
+        """Сериализует ответ в формате клиента. Ответ длиннее согласованного порога сжимается, если это уменьшает его."""
+        with self.metrics.stage('encode'):
+            data: bytes = encode_object(response, connection.format)
+            if connection.compression != Compression.NONE and len(data) > connection.threshold:
+                start: float = time.perf_counter()
+                compressed: bytes = compress_message(data, connection.compression)
+                self.compression_statistics.add(len(data), len(compressed), time.perf_counter() - start)
+                if len(compressed) < len(data):
+                    return compressed
+            return data
+
+    def isConcurrent(self, request: ClientRequest) -> bool:
+        """Можно ли выполнять запрос параллельно с другими запросами клиента."""
+        return request.id is not None and request.command in self.CONCURRENT
+
+    def respond(self, connection: ClientConnection | AsyncClientConnection, request: ClientRequest,
+                timing: RequestTiming | None = None) -> bytes | None:
+        """Выполняет запрос клиента и возвращает сериализованный ответ с идентификатором запроса. Этапы обработки
+        учитываются в timing; исключение и отсутствие ответа отмечаются в нём как ошибка.
+
+        Если при выполнении запроса возникло исключение, клиент получает ответ с флагом False и описанием ошибки: 
+        ответ на каждый запрос отправляется одинаково в обоих серверах, а подключение не закрывается."""
+        with self.metrics.bind(timing):
             try:
-                client_socket.sendall(dump)  # Отправляем данные клиенту.
+                response: bytes | None = self.process(connection, request)
             except Exception as error:
-                return False
-            else:  # Если исключения не было.
-                return True
+                if timing is not None:
+                    timing.error = True
+                response: bytes | None = self.encode(connection, ServerResponse(
+                    command=request.command, flag=False, data='Ошибка выполнения запроса: {0}'.format(error)))
+                return self.__tag(response, request)
+        if response is None and timing is not None:
+            timing.error = True
+        return self.__tag(response, request)
 
-        with client_socket:
-            while not stop_event.is_set():
+    @staticmethod
+    def __tag(response: bytes | None, request: ClientRequest) -> bytes | None:
+        return response if response is None or request.id is None else tag_message(response, request.id)
+
+    def process(self, connection: ClientConnection | AsyncClientConnection, request: ClientRequest) -> bytes | None:
+        """Выполняет запрос клиента и возвращает сериализованный ответ."""
+        match request.command:
+            case Commands.ADD | Commands.DELETE:
+                return self.__mutate(connection, request.command, request.data)
+            case Commands.UPDATE:
+                return self.__update(connection, request.command, request.data)
+            case Commands.SUBSCRIBE:
+                update: UpdateRequest = request.data
                 try:
-                    data = client_socket.recv(1024)  # Принимаем команды от клиента.
-                except Exception as error:
+                    filter: Filter | None = self.storage.checkFilter(update.filter)
+                except ValueError as error:
+                    return self.encode(connection, ServerResponse(command=request.command, flag=False, data=str(error)))
+                '''Подписка оформляется до чтения данных, поэтому изменения, зафиксированные во время чтения, 
+                не будут потеряны: клиент получит их в уведомлениях.'''
+                self.subscriptions.subscribe(connection, filter)
+                return self.__update(connection, request.command, update)
+            case Commands.BULK_IMPORT:
+                return self.__bulkImport(connection, request.data)
+            case Commands.EXPORT:
+                return self.__export(connection, request)
+            case Commands.HELLO:
+                return self.__handshake(connection, request.data)
+            case Commands.STATS:
+                return self.encode(connection, ServerResponse(command=Commands.STATS, flag=True, data=self.statistics()))
+            case Commands.BATCH:
+                return self.__applyBatch(connection, request.data)
+        return None
+
+    def __mutate(self, connection: ClientConnection | AsyncClientConnection, command: Commands, contact: Contact) -> bytes:
+        """Добавляет или удаляет контакт. Для некорректного контакта вместо результата передаётся описание ошибки."""
+        try:
+            with self.metrics.stage('storage'):
+                if command == Commands.ADD:
+                    flag: bool = self.storage.insert(contact)
+                else:
+                    flag: bool = self.storage.delete(contact)
+        except ValueError as error:
+            return self.encode(connection, ServerResponse(command=command, flag=False, data=str(error)))
+        return self.encode(connection, ServerResponse(command=command, flag=flag))
+
+    def __applyBatch(self, connection: ClientConnection | AsyncClientConnection, batch: BatchRequest) -> bytes:
+        """Выполняет пакет изменений. Флаг ответа сообщает, зафиксирован ли пакет; для некорректного пакета 
+        вместо BatchResult передаётся описание ошибки."""
+        try:
+            with self.metrics.stage('storage'):
+                result: BatchResult = self.storage.applyBatch(batch)
+        except ValueError as error:
+            return self.encode(connection, ServerResponse(command=Commands.BATCH, flag=False, data=str(error)))
+        return self.encode(connection, ServerResponse(command=Commands.BATCH, flag=result.committed, data=result))
+
+    def __handshake(self, connection: ClientConnection | AsyncClientConnection, handshake: Handshake) -> bytes:
+        """Выбирает первый из предложенных клиентом способов сжатия, который поддерживает сервер."""
+        compression: Compression = next((compression for compression in handshake.compression
+                                         if compression in self.COMPRESSION), Compression.NONE)
+        threshold: int = max(handshake.threshold, self.compression_threshold)
+        response: bytes = self.encode(connection, ServerResponse(command=Commands.HELLO, flag=True,
+                                                                 data=Handshake(compression=[compression], threshold=threshold)))
+        connection.compression = compression
+        connection.threshold = threshold
+        return response
+
+    def __receiveChunks(self, connection: ClientConnection | AsyncClientConnection) -> Iterator[bytes]:
+        """Принимает фрагменты загружаемых данных до завершающего пустого фрагмента (или отключения клиента).
+
+        Другие запросы во время загрузки не выполняются: на них сразу отправляется ответ с ошибкой, а загрузка 
+        прерывается. Оставшиеся фрагменты принимаются (чтобы не принять их за новые запросы), но не передаются, после 
+        чего возникает ValueError."""
+        stray: list[str] = []  # Команды запросов, полученных во время загрузки.
+        while True:
+            data: bytes | None = connection.receive()
+            request = None if data is None else self.decode(connection, data)
+            if request is None:
+                break  # Клиент отключился.
+            if isinstance(request, ClientRequest) and request.command == Commands.BULK_IMPORT and isinstance(request.data, bytes):
+                if not request.data:
                     break
-                else:  # Если исключения не было.
-                    if data == b'':
-                        break  # Клиент отключился.
-                    else:
-                        request: ClientRequest = pickle.loads(data)
-                        if isinstance(request, ClientRequest):
-                            match request.command:
-                                case Commands.ADD:
-                                    contact: Contact = request.data
-                                    DatabaseConnection.insert(contact)
-                                    response = ServerResponse(command=Commands.ADD, flag=True)
-                                    send(response)
-                                case Commands.DELETE:
-                                    contact: Contact = request.data
-                                    delete_flag: bool = DatabaseConnection.delete(contact)
-                                    response = ServerResponse(command=Commands.DELETE, flag=delete_flag)
-                                    send(response)
-                                case Commands.UPDATE:
-                                    filter: Filter | None = request.data
-                                    phonebook: list[Contact] = DatabaseConnection.getFilteredPhones(filter)
-                                    response = ServerResponse(command=Commands.UPDATE, flag=True, data=phonebook)
-                                    send(response)
-
-    def server_loop():
-        while not stop_event.is_set():
+                self.metrics.received(len(data))
+                if not stray:
+                    yield request.data
+                continue
+            if isinstance(request, ClientRequest):
+                stray.append(request.command.name)
+                connection.sendEncoded(self.__tag(self.encode(connection, ServerResponse(
+                    command=request.command, flag=False, data='Запрос получен во время массовой загрузки и не выполнен.')), request))
+            else:
+                stray.append(type(request).__name__)
+        if stray:
+            raise ValueError('Загрузка прервана: во время загрузки получены другие запросы ({0}).'.format(', '.join(stray)))
+
+    def __bulkImport(self, connection: ClientConnection | AsyncClientConnection, bulk_import: BulkImport) -> bytes:
+        chunks: Iterator[bytes] = self.__receiveChunks(connection)
+        report = ImportReport()
+        try:
+            with bulk.open_chunks(chunks) as file, self.metrics.stage('storage'):
+                self.storage.insertMany(bulk.read_contacts(file, bulk_import.format, report), report)
+        except (ValueError, UnicodeDecodeError) as error:
+            try:
+                for chunk in chunks:  # Оставшиеся фрагменты пропускаются, чтобы не принять их за новые запросы.
+                    pass
+            except ValueError:  # Загрузка прервана другим запросом, а ответ уже содержит первую ошибку.
+                pass
+            return self.encode(connection, ServerResponse(command=Commands.BULK_IMPORT, flag=False, data=str(error)))
+        return self.encode(connection, ServerResponse(command=Commands.BULK_IMPORT, flag=True, data=report))
+
+    def __export(self, connection: ClientConnection | AsyncClientConnection, request: ClientRequest) -> bytes | None:
+        export: ExportRequest = request.data
+        try:
+            for chunk in bulk.encode_contacts(self.storage.iterContacts(self.storage.checkFilter(export.filter)), export.format):
+                response: bytes = self.__tag(self.encode(connection, ServerResponse(command=Commands.EXPORT, flag=True, data=chunk)),
+                                             request)
+                with self.metrics.stage('send'):
+                    if not connection.sendEncoded(response, wait=True):
+                        return None  # Клиент отключился.
+                self.metrics.sent(len(response))
+        except ValueError as error:
+            return self.encode(connection, ServerResponse(command=Commands.EXPORT, flag=False, data=str(error)))
+        return self.encode(connection, ServerResponse(command=Commands.EXPORT, flag=True, data=None))
+
+    def __timed(self, function: Callable, *args):
+        """Вызывает метод хранилища, учитывая время его выполнения."""
+        with self.metrics.stage('storage'):
+            return function(*args)
+
+    @staticmethod
+    def __wire(connection: ClientConnection | AsyncClientConnection) -> tuple:
+        """Параметры сериализации ответов клиенту (часть ключа кэша)."""
+        return connection.format, connection.compression, connection.threshold
+
+    def __update(self, connection: ClientConnection | AsyncClientConnection, command: Commands,
+                 data: UpdateRequest | Query | Filter | None) -> bytes:
+        """Выполняет выборку. Для некорректного запроса вместо данных передаётся описание ошибки."""
+        try:
+            return self.__select(connection, command, data)
+        except ValueError as error:  # Недопустимое поле, некорректный фильтр или курсор.
+            return self.encode(connection, ServerResponse(command=command, flag=False, data=str(error)))
+
+    def __select(self, connection: ClientConnection | AsyncClientConnection, command: Commands,
+                 data: UpdateRequest | Query | Filter | None) -> bytes:
+        if isinstance(data, Query):
+            self.storage.checkFilter(data.filter)  # До обращения к кэшу: ключ кэша строится по фильтру.
+            return self.cache.get((command, Query, data) + self.__wire(connection),
+                                  lambda: self.encode(connection, ServerResponse(command=command, flag=True, data=self.__timed(self.storage.getPage, data))))
+        elif isinstance(data, UpdateRequest):
+            if data.revision is not None:
+                delta: Delta | None = self.__timed(self.storage.getChanges, data.revision, data.filter)
+                if delta is not None:
+                    return self.encode(connection, ServerResponse(command=command, flag=True, data=delta))
+            filter: Filter | None = self.storage.checkFilter(data.filter)
+            return self.cache.get((command, UpdateRequest, filter) + self.__wire(connection),
+                                  lambda: self.encode(connection, ServerResponse(command=command, flag=True, data=self.__timed(self.storage.getSnapshot, filter))))
+        else:
+            filter: Filter | None = self.storage.checkFilter(data)
+            return self.cache.get((command, Filter, filter) + self.__wire(connection),
+                                  lambda: self.encode(connection, ServerResponse(command=command, flag=True, data=self.__timed(self.storage.getFilteredPhones, filter))))
+
+
+class ThreadedServer:
+    """Сервер, обслуживающий каждого клиента в отдельном потоке.
+
+    Каждое подключение занимает поток операционной системы (со своим стеком) и конкурирует за GIL, поэтому число 
+    одновременных подключений ограничено MAX_CONNECTIONS. Подключения сверх лимита сразу закрываются.
+
+    Запросы, которые можно выполнять параллельно (RequestHandler.isConcurrent), передаются общему пулу из WORKERS 
+    потоков, а поток клиента тем временем принимает следующие запросы. У клиента выполняется не более PIPELINE_DEPTH 
+    таких запросов одновременно."""
+    MAX_CONNECTIONS: int = 200
+    WORKERS: int = 8
+    PIPELINE_DEPTH: int = 64
+    SHUTDOWN_POLL: float = 0.05  # Как часто при остановке проверяется, остались ли подключения [с].
+
+    def __init__(self, listener: socket.socket, handler: RequestHandler, stop_event: threading.Event,
+                 max_connections: int = MAX_CONNECTIONS, workers: int = WORKERS):
+        self.listener: socket.socket = listener
+        self.handler: RequestHandler = handler
+        self.stop_event: threading.Event = stop_event
+        self.__slots = threading.BoundedSemaphore(max_connections)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline')
+        self.__lock = threading.Lock()  # Защищает множество сокетов клиентов.
+        self.__sockets: set[socket.socket] = set()
+
+    def __respond(self, connection: ClientConnection, request: ClientRequest, timing: RequestTiming):
+        try:
+            response: bytes | None = self.handler.respond(connection, request, timing)
+            if response is not None:
+                with timing.stage('send'):
+                    connection.sendEncoded(response)
+                timing.bytes_out += len(response)
+        finally:
+            self.handler.metrics.finish(timing)
+
+    def work_with_client(self, client_socket: socket.socket, client_address):
+        connection = ClientConnection(client_socket, client_address)
+        running: set[concurrent.futures.Future] = set()  # Выполняющиеся параллельно запросы клиента.
+        self.handler.metrics.connected()
+        with self.__lock:
+            self.__sockets.add(client_socket)
+
+        with client_socket:
             try:
-                client_socket, client_address = listener.accept()  # Начинаем принимать соединения.
+                while not self.stop_event.is_set():
+                    try:
+                        data: bytes | None = receive_message(client_socket)  # Принимаем команды от клиента.
+                        request = None if data is None else self.handler.decode(connection, data)
+                    except Exception as error:
+                        self.handler.metrics.protocolError()
+                        break
+                    else:  # Если исключения не было.
+                        if request is None:
+                            break  # Клиент отключился.
+                        elif isinstance(request, ClientRequest):
+                            timing: RequestTiming = self.handler.metrics.begin(request.command, len(data))
+                            if self.handler.isConcurrent(request):
+                                if len(running) >= self.PIPELINE_DEPTH:
+                                    running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED).not_done
+                                running.add(self.__executor.submit(self.__respond, connection, request, timing))
+                            else:  # Запрос выполняется после всех предыдущих.
+                                concurrent.futures.wait(running)
+                                running.clear()
+                                self.__respond(connection, request, timing)
+            finally:
+                concurrent.futures.wait(running)
+                self.handler.subscriptions.unsubscribe(connection)
+                connection.close()
+                with self.__lock:
+                    self.__sockets.discard(client_socket)
+                self.handler.metrics.disconnected()
+                self.__slots.release()
+
+    def shutdown(self):
+        """Прекращает приём подключений и завершает подключения клиентов после ответа на выполняющиеся запросы. 
+        server_loop возвращается, когда все клиенты отключены."""
+        self.stop_event.set()
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)  # Прерывает ожидание accept в server_loop.
+        except OSError:
+            pass
+        with self.__lock:
+            for client_socket in self.__sockets:
+                try:
+                    client_socket.shutdown(socket.SHUT_RD)  # Приём следующего запроса вернёт «клиент отключился».
+                except OSError:
+                    pass
+
+    def server_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                client_socket, client_address = self.listener.accept()  # Начинаем принимать соединения.
             except Exception as error:
-                if not stop_event.is_set():
+                if self.stop_event.is_set():
                     break
                 else:
                     raise error
             else:
-                client_thread = threading.Thread(target=work_with_client, args=(client_socket, client_address))
-                client_thread.start()
+                if self.__slots.acquire(blocking=False):
+                    client_thread = threading.Thread(target=self.work_with_client, args=(client_socket, client_address))
+                    client_thread.start()
+                else:  # Превышен лимит одновременных подключений.
+                    self.handler.metrics.rejected()
+                    client_socket.close()
+        while self.__sockets:  # Клиенты отключаются после ответа на выполняющиеся запросы.
+            time.sleep(self.SHUTDOWN_POLL)
+
+
+class AsyncServer:
+    """Сервер, обслуживающий всех клиентов в одном цикле событий asyncio.
+
+    Подключение не занимает отдельного потока, поэтому лимит MAX_CONNECTIONS определяется в основном числом 
+    доступных процессу файловых дескрипторов. Обращения к базе данных и сериализация ответов выполняются 
+    в ограниченном пуле из DATABASE_WORKERS потоков. Подключения сверх лимита сразу закрываются.
 
-    DatabaseConnection.createDatabase()  # Создаём базу данных.
+    Запросы, которые можно выполнять параллельно (RequestHandler.isConcurrent), не задерживают приём следующих 
+    запросов клиента; их ответы отправляются по готовности. У клиента выполняется не более PIPELINE_DEPTH таких 
+    запросов одновременно."""
+    MAX_CONNECTIONS: int = 10000
+    DATABASE_WORKERS: int = 8
+    PIPELINE_DEPTH: int = 64
+    SHUTDOWN_POLL: float = 0.05  # Как часто при остановке проверяется, остались ли подключения [с].
+
+    def __init__(self, listener: socket.socket, handler: RequestHandler, max_connections: int = MAX_CONNECTIONS,
+                 database_workers: int = DATABASE_WORKERS):
+        self.listener: socket.socket = listener
+        self.handler: RequestHandler = handler
+        self.max_connections: int = max_connections
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=database_workers, thread_name_prefix='database')
+        self.__connections: int = 0  # Число активных подключений.
+        self.__clients: dict[asyncio.StreamReader, asyncio.StreamWriter] = {}
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__server: asyncio.Server | None = None
+        self.__stopping: bool = False
+
+    async def work_with_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.__stopping:  # Подключение принято до остановки сервера, но ещё не обслуживалось.
+            writer.close()
+            return
+        if self.__connections >= self.max_connections:  # Превышен лимит одновременных подключений.
+            self.handler.metrics.rejected()
+            writer.close()
+            return
+
+        self.__connections += 1
+        self.handler.metrics.connected()
+        loop = asyncio.get_running_loop()
+        connection = AsyncClientConnection(loop, reader, writer)
+        running: set[asyncio.Task] = set()  # Выполняющиеся параллельно запросы клиента.
+        self.__clients[reader] = writer
+        try:
+            while True:
+                try:
+                    data: bytes | None = await read_message(reader)  # Принимаем команды от клиента.
+                    request = None if data is None else self.handler.decode(connection, data)
+                except Exception as error:
+                    self.handler.metrics.protocolError()
+                    break
+                if request is None:
+                    break  # Клиент отключился.
+                if isinstance(request, ClientRequest):
+                    timing: RequestTiming = self.handler.metrics.begin(request.command, len(data))
+                    if self.handler.isConcurrent(request):
+                        if len(running) >= self.PIPELINE_DEPTH:
+                            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                        running.add(asyncio.create_task(self.__respond(connection, request, timing)))
+                    else:  # Запрос выполняется после всех предыдущих.
+                        if running:
+                            await asyncio.wait(running)
+                            running.clear()
+                        await self.__respond(connection, request, timing)
+        except Exception as error:
+            pass
+        finally:
+            if running:
+                await asyncio.wait(running)
+            del self.__clients[reader]
+            self.__connections -= 1
+            self.handler.metrics.disconnected()
+            await loop.run_in_executor(self.__executor, self.handler.subscriptions.unsubscribe, connection)
+            writer.close()
+
+    async def __respond(self, connection: AsyncClientConnection, request: ClientRequest, timing: RequestTiming):
+        try:
+            response: bytes | None = await connection.loop.run_in_executor(self.__executor, self.handler.respond,
+                                                                            connection, request, timing)
+            if response is not None:
+                with timing.stage('send'):
+                    write_message(connection.writer, response)
+                    await connection.writer.drain()
+                timing.bytes_out += len(response)
+        except Exception as error:  # Клиент отключился: соединение закрывается.
+            connection.writer.close()
+        finally:
+            self.handler.metrics.finish(timing)
+
+    async def serve(self):
+        self.__server = await asyncio.start_server(self.work_with_client, sock=self.listener)
+        self.__loop = asyncio.get_running_loop()
+        async with self.__server:
+            try:
+                await self.__server.serve_forever()
+            except asyncio.CancelledError:
+                if not self.__stopping:
+                    raise
+        while self.__connections:  # Клиенты отключаются после ответа на выполняющиеся запросы.
+            await asyncio.sleep(self.SHUTDOWN_POLL)
+
+    def shutdown(self):
+        """Прекращает приём подключений и завершает подключения клиентов после ответа на выполняющиеся запросы. 
+        Вызывается из другого потока; server_loop возвращается, когда все клиенты отключены."""
+        if self.__loop is not None:
+            try:
+                self.__loop.call_soon_threadsafe(self.__shutdown)
+            except RuntimeError:  # Цикл событий уже завершён.
+                pass
 
-    with socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM) as listener:
-        host: str = ''  # Строка, представляющая либо имя хоста в нотации домена Интернета, либо IPv4-адрес.
-        address: tuple[str, int] = (HOST, PORT)
+    def __shutdown(self):
+        self.__stopping = True
+        self.__server.close()
+        for reader, writer in self.__clients.items():
+            writer.transport.pause_reading()
+            reader.feed_eof()  # Приём следующего запроса вернёт «клиент отключился».
 
-        listener.bind(address)  # Связываем сокет с портом, где он будет ожидать сообщения.
-        listener.listen(10)  # Указываем сколько может сокет принимать соединений.
-        print('\nСервер запущен. Хост: {0}'.format(socket.gethostname()))
+    def server_loop(self):
+        asyncio.run(self.serve())
 
-        threading.Thread(target=server_loop, daemon=True).start()
 
-        while not stop_event.is_set():
-            command = input('Для выхода введите "stop"\n')
-            if command.lower() == 'stop':
-                stop_event.set()
+def open_storage(args: argparse.Namespace, shared: bool = False) -> Storage:
+    """Открывает хранилище, заданное параметрами командной строки. Если shared == True, с базой данных SQLite 
+    одновременно работают другие процессы."""
+    if args.storage == 'memory':
+        storage: Storage = MemoryStorage(snapshot_name=args.snapshot, log_name=args.log, fsync=args.fsync)
+    else:
+        storage: Storage = DatabaseConnection(database_name=args.database, pool_size=args.pool_size,
+                                              pragmas=dict(pragma.split('=', 1) for pragma in args.pragma), shared=shared)
+    storage.createDatabase()  # Создаём базу данных.
+    storage.group_size = args.group_size
+    storage.group_delay = args.group_delay / 1000
+    if args.slow_threshold is not None:
+        storage.slow_log = SlowQueryLog(args.slow_log, threshold=args.slow_threshold / 1000)
+    return storage
+
+
+def create_listener(reuse_port: bool = False) -> socket.socket:
+    """Создаёт сокет, принимающий подключения клиентов. Если reuse_port == True, тот же порт могут слушать сокеты 
+    других процессов (SO_REUSEPORT), и ядро распределяет между ними входящие подключения."""
+    listener = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+    try:
+        if os.name == 'posix':  # Порт можно занять сразу после остановки сервера, закрывшего подключения клиентов.
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((HOST, PORT))  # Связываем сокет с портом, где он будет ожидать сообщения.
+        listener.listen(socket.SOMAXCONN)  # Очередь ожидающих подключений максимальной длины.
+    except OSError:
+        listener.close()
+        raise
+    return listener
+
+
+def create_server(args: argparse.Namespace, listener: socket.socket, handler: RequestHandler,
+                  stop_event: threading.Event) -> ThreadedServer | AsyncServer:
+    if args.mode == 'asyncio':
+        return AsyncServer(listener, handler, max_connections=args.max_connections or AsyncServer.MAX_CONNECTIONS)
+    return ThreadedServer(listener, handler, stop_event,
+                          max_connections=args.max_connections or ThreadedServer.MAX_CONNECTIONS)
+
+
+def run_worker(args: argparse.Namespace, index: int):
+    """Процесс-обработчик режима --workers: принимает подключения на общем с другими процессами порту и работает 
+    с общей базой данных. По SIGTERM перестаёт принимать подключения, отвечает на выполняющиеся запросы и завершается, 
+    когда отключатся все клиенты. Завершается и вместе с супервизором."""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C в консоли обрабатывает супервизор.
+    supervisor: int = os.getppid()
+
+    storage: Storage = open_storage(args, shared=True)
+    handler = RequestHandler(storage, cache_size=args.cache_size * 1024 * 1024, allow_pickle=args.allow_pickle,
+                             compression_threshold=args.compression_threshold)
+    with create_listener(reuse_port=True) as listener:
+        server: ThreadedServer | AsyncServer = create_server(args, listener, handler, threading.Event())
+        server_thread = threading.Thread(target=server.server_loop, daemon=True)
+        server_thread.start()
+        if args.metrics_port is not None:
+            MetricsEndpoint(args.metrics_port + index, handler.statistics).start()
+        while not stop_event.wait(Supervisor.CHECK_INTERVAL):
+            if os.getppid() != supervisor:
+                break  # Супервизор завершён, не остановив процесс.
+        server.shutdown()
+        server_thread.join()  # Сервер завершает работу, когда отключены все клиенты.
+    storage.close()
+    if storage.slow_log is not None:
+        storage.slow_log.close()
+
+
+class Supervisor:
+    """Управляющий процесс многопроцессного режима (--workers).
+
+    Один процесс сервера ограничен одним ядром процессора: разбор запросов и сериализация ответов выполняются 
+    под GIL. Супервизор запускает workers процессов-обработчиков (run_worker), каждый со своими потоками, кэшем ответов 
+    и подписками. Все они слушают один порт (SO_REUSEPORT), а ядро распределяет подключения между ними. Данные 
+    хранятся в общей базе данных SQLite (DatabaseConnection.shared): изменения процессов фиксируются по очереди, 
+    а уведомления об изменениях, сделанных другими процессами, обработчик получает из журнала изменений.
+
+    Процесс-обработчик, завершившийся без команды, перезапускается (не чаще чем раз в RESTART_DELAY секунд). 
+    При остановке процессы получают SIGTERM и завершают обслуживание клиентов; не завершившиеся за SHUTDOWN_TIMEOUT 
+    секунд останавливаются принудительно."""
+    CHECK_INTERVAL: float = 0.5  # [с]
+    RESTART_DELAY: float = 1.0  # [с]
+    SHUTDOWN_TIMEOUT: float = 10.0  # [с]
+
+    def __init__(self, args: argparse.Namespace, workers: int):
+        self.args: argparse.Namespace = args
+        self.workers: int = workers
+        self.restarts: int = 0
+        # Процессы запускаются заново, а не копией супервизора, поэтому не наследуют его потоков и подключений.
+        self.__context = multiprocessing.get_context('spawn')
+        self.__processes: list[multiprocessing.Process] = []
+        self.__started: list[float] = []  # Время запуска процессов (time.monotonic).
+        self.__lock = threading.Lock()  # Перезапуск процесса не должен совпасть с остановкой.
+        self.__stopping = threading.Event()
+        self.__monitor = threading.Thread(target=self.__watch, name='supervisor', daemon=True)
+
+    def __start(self, index: int) -> multiprocessing.Process:
+        process = self.__context.Process(target=run_worker, args=(self.args, index), name='worker-{0}'.format(index))
+        process.start()
+        self.__started[index] = time.monotonic()
+        self.__processes[index] = process
+        return process
+
+    def start(self):
+        self.__processes = [None] * self.workers
+        self.__started = [0.0] * self.workers
+        for index in range(self.workers):
+            self.__start(index)
+        self.__monitor.start()
+
+    def __watch(self):
+        """Перезапускает завершившиеся процессы-обработчики."""
+        while not self.__stopping.is_set():
+            sentinels: dict[int, int] = {process.sentinel: index for index, process in enumerate(self.__processes)}
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=self.CHECK_INTERVAL):
+                index: int = sentinels[sentinel]
+                process: multiprocessing.Process = self.__processes[index]
+                process.join()
+                delay: float = self.RESTART_DELAY - (time.monotonic() - self.__started[index])
+                if self.__stopping.wait(max(delay, 0.0)):
+                    return
+                with self.__lock:
+                    if self.__stopping.is_set():
+                        return
+                    restarted: multiprocessing.Process = self.__start(index)
+                    self.restarts += 1
+                print('Процесс-обработчик {0} (pid {1}) завершился с кодом {2}, запущен заново (pid {3}).'.format(
+                    index, process.pid, process.exitcode, restarted.pid))
+
+    def stop(self):
+        """Останавливает процессы-обработчики."""
+        with self.__lock:
+            self.__stopping.set()
+        for process in self.__processes:
+            if process.is_alive():
+                process.terminate()  # SIGTERM: процесс завершит обслуживание клиентов.
+        deadline: float = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        for process in self.__processes:
+            process.join(max(deadline - time.monotonic(), 0.0))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        if self.__monitor.is_alive():
+            self.__monitor.join()
+
+    def __str__(self):
+        now: float = time.monotonic()
+        lines: list[str] = ['Процесс-обработчик {0}: pid {1}, {2}.'.format(
+            index, process.pid, 'работает {0:.0f} с'.format(now - started) if process.is_alive()
+            else 'завершился с кодом {0}'.format(process.exitcode))
+            for index, (process, started) in enumerate(zip(self.__processes, self.__started))]
+        lines.append('Перезапусков: {0}.'.format(self.restarts))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сервер телефонной книги.')
+    parser.add_argument('--mode', choices=('threads', 'asyncio'), default='threads',
+                        help='threads — поток на каждого клиента (до {0} подключений), asyncio — цикл событий '
+                             '(до {1} подключений).'.format(ThreadedServer.MAX_CONNECTIONS, AsyncServer.MAX_CONNECTIONS))
+    parser.add_argument('--max-connections', type=int, default=None, help='Лимит одновременных подключений.')
+    parser.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite',
+                        help='sqlite — база данных SQLite, memory — данные в оперативной памяти с журналом операций и снимками.')
+    parser.add_argument('--database', default=DatabaseConnection.DATABASE_NAME, help='Файл базы данных SQLite.')
+    parser.add_argument('--pool-size', type=int, default=DatabaseConnection.POOL_SIZE,
+                        help='Число простаивающих подключений к базе данных, хранящихся в пуле.')
+    parser.add_argument('--pragma', action='append', default=[], metavar='NAME=VALUE',
+                        help='Параметр SQLite для каждого подключения (например, synchronous=FULL). Можно указать несколько раз.')
+    parser.add_argument('--cache-size', type=int, default=ResponseCache.MAX_SIZE // (1024 * 1024),
+                        help='Лимит памяти кэша ответов [МиБ]. 0 отключает хранение ответов.')
+    parser.add_argument('--snapshot', default=MemoryStorage.SNAPSHOT_NAME, help='Файл снимка хранилища memory.')
+    parser.add_argument('--log', default=MemoryStorage.LOG_NAME, help='Файл журнала операций хранилища memory.')
+    parser.add_argument('--fsync', action='store_true', help='Выполнять fsync журнала хранилища memory после каждой операции.')
+    parser.add_argument('--import', dest='import_file', default=None, metavar='FILE',
+                        help='Загрузить контакты из файла CSV или JSON Lines в хранилище и завершить работу, не запуская сервер.')
+    parser.add_argument('--export', dest='export_file', default=None, metavar='FILE',
+                        help='Выгрузить контакты из хранилища в файл CSV или JSON Lines и завершить работу, не запуская сервер.')
+    parser.add_argument('--format', choices=[format.value for format in BulkFormat], default=None,
+                        help='Формат файла загрузки и выгрузки (по умолчанию определяется по расширению).')
+    parser.add_argument('--compression-threshold', type=int, default=Handshake.THRESHOLD,
+                        help='Минимальный размер ответа, который сжимается для клиентов, согласовавших сжатие [байт].')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Порт localhost, на котором показатели сервера отдаются в текстовом формате по адресу /metrics.')
+    parser.add_argument('--slow-threshold', type=float, default=None, metavar='MS',
+                        help='Записывать в журнал медленных операций выборки и изменения хранилища дольше MS миллисекунд.')
+    parser.add_argument('--slow-log', default=SlowQueryLog.LOG_NAME, help='Файл журнала медленных операций (JSON Lines).')
+    parser.add_argument('--group-size', type=int, default=Storage.GROUP_SIZE,
+                        help='Наибольшее число добавлений и удалений, фиксируемых одной транзакцией.')
+    parser.add_argument('--group-delay', type=float, default=Storage.GROUP_DELAY * 1000, metavar='MS',
+                        help='Сколько ждать присоединения изменений других клиентов к группе перед её фиксацией [мс].')
+    parser.add_argument('--allow-pickle', action='store_true',
+                        help='Принимать сообщения в формате pickle от клиентов предыдущих версий. Небезопасно: такой '
+                             'клиент может выполнить на сервере произвольный код.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Число процессов-обработчиков, слушающих общий порт (SO_REUSEPORT) и работающих с общей '
+                             'базой данных SQLite. Порт показателей каждого процесса — --metrics-port плюс его номер.')
+    args = parser.parse_args()
+    if args.workers > 1 and args.storage != 'sqlite':
+        parser.error('Несколько процессов-обработчиков могут работать только с хранилищем sqlite.')
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('Несколько процессов-обработчиков требуют поддержки SO_REUSEPORT.')
+
+    stop_event = threading.Event()
+
+    storage: Storage = open_storage(args)
+
+    if args.import_file is not None or args.export_file is not None:
+        if args.import_file is not None:
+            import_format: BulkFormat = BulkFormat(args.format) if args.format else bulk.guess_format(args.import_file)
+            report: ImportReport = bulk.import_file(storage, args.import_file, import_format)
+            for conflict in report.conflicts:
+                print(conflict)
+            print(report)
+        if args.export_file is not None:
+            export_format: BulkFormat = BulkFormat(args.format) if args.format else bulk.guess_format(args.export_file)
+            bulk.export_file(storage, args.export_file, export_format)
+        storage.close()
+        raise SystemExit
+
+    if args.workers > 1:
+        storage.close()  # База данных создана, дальше с ней работают процессы-обработчики.
+        if storage.slow_log is not None:
+            storage.slow_log.close()
+        create_listener(reuse_port=True).close()  # Порт занят другой программой — сообщаем сразу, а не при каждом перезапуске.
+        supervisor = Supervisor(args, args.workers)
+        supervisor.start()
+        print('\nСервер запущен ({0}, {1}, процессов-обработчиков: {2}). Хост: {3}'.format(
+            args.mode, args.storage, args.workers, socket.gethostname()))
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # Остановка по SIGTERM, как по Ctrl+C.
+        try:
+            while True:
+                try:
+                    command = input('Для выхода введите "stop", для состояния процессов-обработчиков — "workers"\n')
+                except EOFError:  # Консоли нет (например, сервер запущен службой): работаем до SIGTERM.
+                    threading.Event().wait()
+                keyword: str = command.strip().lower()
+                if keyword == 'stop':
+                    break
+                elif keyword == 'workers':
+                    print(supervisor)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            supervisor.stop()
+        raise SystemExit
+
+    handler = RequestHandler(storage, cache_size=args.cache_size * 1024 * 1024, allow_pickle=args.allow_pickle,
+                             compression_threshold=args.compression_threshold)
+
+    with create_listener() as listener:
+        server: ThreadedServer | AsyncServer = create_server(args, listener, handler, stop_event)
+        print('\nСервер запущен ({0}, {1}). Хост: {2}'.format(args.mode, args.storage, socket.gethostname()))
+
+        server_thread = threading.Thread(target=server.server_loop, daemon=True)
+        server_thread.start()
+        if args.metrics_port is not None:
+            MetricsEndpoint(args.metrics_port, handler.statistics).start()
+            print('Показатели: http://127.0.0.1:{0}{1}'.format(args.metrics_port, MetricsEndpoint.PATH))
+
+        profiler = SamplingProfiler()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # Остановка по SIGTERM, как по Ctrl+C.
+        try:
+            while not stop_event.is_set():
+                try:
+                    command = input('Для выхода введите "stop", для вывода статистики сжатия — "stats", показателей — "metrics", '
+                                    'для профилирования — "profile СЕКУНДЫ [ФАЙЛ]", для порога журнала медленных операций — '
+                                    '"slow МС" или "slow off"\n')
+                except EOFError:  # Консоли нет (например, сервер запущен службой): работаем до SIGTERM.
+                    threading.Event().wait()
+                words: list[str] = command.split()
+                keyword: str = words[0].lower() if words else ''
+                if keyword == 'stop':
+                    stop_event.set()
+                elif keyword == 'stats':
+                    print(handler.compression_statistics)
+                elif keyword == 'metrics':
+                    print(render_text(handler.statistics()))
+                elif keyword == 'profile':
+                    if len(words) > 1 and words[1].lower() == 'stop':
+                        profiler.stop()
+                        continue
+                    try:
+                        seconds: float = float(words[1]) if len(words) > 1 else 10.0
+                        path: str = words[2] if len(words) > 2 else 'profile-{0}.txt'.format(time.strftime('%Y%m%d-%H%M%S'))
+                        profiler.start(seconds, path)
+                    except (ValueError, RuntimeError) as error:
+                        print(error)
+                    else:  # Если исключения не было.
+                        print('Профилирование на {0:g} с (досрочно завершить — "profile stop").'.format(seconds))
+                elif keyword == 'slow':
+                    if len(words) > 1 and words[1].lower() == 'off':
+                        if storage.slow_log is not None:
+                            storage.slow_log.close()
+                        storage.slow_log = None
+                        print('Журнал медленных операций отключён.')
+                    elif len(words) > 1:
+                        try:
+                            threshold: float = float(words[1]) / 1000
+                        except ValueError as error:
+                            print(error)
+                            continue
+                        if storage.slow_log is None:
+                            storage.slow_log = SlowQueryLog(args.slow_log, threshold=threshold)
+                        storage.slow_log.threshold = threshold
+                        print('Операции дольше {0:g} мс записываются в {1}.'.format(threshold * 1000, storage.slow_log.log_name))
+                    else:
+                        print('Журнал медленных операций {0}.'.format(
+                            'отключён' if storage.slow_log is None else 'ведётся в {0} (порог {1:g} мс, записей: {2})'.format(
+                                storage.slow_log.log_name, storage.slow_log.threshold * 1000, storage.slow_log.records)))
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+        server_thread.join()  # Сервер завершает работу, когда отключены все клиенты.
+
+    storage.close()
+    if storage.slow_log is not None:
+        storage.slow_log.close()
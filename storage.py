@@ -0,0 +1,1294 @@
+import abc
+import bisect
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, Iterator
+from common import (Contact, Commands, Filter, UpdateRequest, Query, Page, Snapshot, Delta, ImportReport, BatchAction,
+                    BatchOperation, BatchRequest, BatchResult)
+from profiling import QueryTimer, SlowQueryLog
+try:
+    import fcntl
+except ImportError:  # Windows: общая база данных нескольких процессов (DatabaseConnection.shared) недоступна.
+    fcntl = None
+
+
+class Mutation:
+    """Добавление или удаление контакта, ожидающее групповой фиксации."""
+    def __init__(self, operation: Commands, contact: Contact):
+        self.operation: Commands = operation
+        self.contact: Contact = contact
+        self.done: bool = False
+        self.result: bool = False  # Добавлен (удалён) ли контакт.
+        self.error: BaseException | None = None
+
+
+class ProcessLock:
+    """Реентерабельная блокировка, общая для потоков всех процессов, работающих с одной базой данных: внутри процесса 
+    потоки ждут друг друга на RLock, а процессы — на блокировке файла path (flock).
+
+    При каждом захвате блокировки процессом (но не при повторном захвате тем же потоком) вызывается on_acquire. Пока 
+    блокировка захвачена, другие процессы не могут ничего зафиксировать, поэтому on_acquire успевает узнать обо всех 
+    изменениях, зафиксированных ими раньше."""
+    def __init__(self, path: str, on_acquire: Callable[[], None]):
+        if fcntl is None:
+            raise RuntimeError('Блокировка файлов (fcntl) недоступна в этой операционной системе.')
+        self.path: str = path
+        self.__on_acquire: Callable[[], None] = on_acquire
+        self.__lock = threading.RLock()
+        self.__depth: int = 0  # Сколько раз блокировка захвачена владеющим потоком.
+        self.__file = open(path, 'a')
+
+    def __enter__(self):
+        self.__lock.acquire()
+        if self.__depth == 0:
+            try:
+                fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.__lock.release()
+                raise
+        self.__depth += 1
+        if self.__depth == 1:
+            try:
+                self.__on_acquire()
+            except BaseException:
+                self.__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__depth -= 1
+        if self.__depth == 0:
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+        self.__lock.release()
+
+
+class Storage(abc.ABC):
+    """Хранилище телефонной книги.
+
+    Изменения выполняются под блокировкой write_lock. Слушатели вызываются после фиксации изменения под той же 
+    блокировкой, поэтому получают уведомления строго в порядке возрастания ревизий.
+
+    Добавления и удаления, запрошенные одновременно из разных потоков, фиксируются группами (_commitBatch): пока 
+    фиксируется одна группа, новые изменения накапливаются в очереди, и следующий ожидающий поток фиксирует их все 
+    одной транзакцией (не более group_size изменений). Каждый поток получает результат своего изменения только после 
+    фиксации его группы, поэтому надёжность не снижается, а затраты на фиксацию делятся между всеми изменениями 
+    группы. Если задана задержка group_delay, поток, начинающий фиксацию, ждёт столько, чтобы к группе 
+    присоединились другие изменения.
+
+    Если задан журнал медленных операций (slow_log), выборки и изменения дольше его порога записываются в него."""
+    FIELDS: tuple[str, ...] = ('name', 'surname', 'patronymic', 'number', 'note')
+    CHANGELOG_SIZE: int = 10000  # Сколько последних изменений хранится для выдачи клиентам в виде Delta.
+    GROUP_SIZE: int = 1000  # Наибольшее число изменений, фиксируемых одной транзакцией.
+    GROUP_DELAY: float = 0.0  # Сколько ждать присоединения изменений к группе перед её фиксацией [с].
+    BULK_CHUNK: int = 10000  # Сколько контактов массовой загрузки добавляется в одной транзакции.
+    MAX_PAGE_SIZE: int = 10000  # Ограничение размера страницы, запрашиваемой клиентом.
+
+    def __init__(self):
+        self.write_lock = threading.RLock()
+        self.slow_log: SlowQueryLog | None = None
+        self.group_size: int = self.GROUP_SIZE
+        self.group_delay: float = self.GROUP_DELAY
+        self.__listeners: list[Callable[[Commands, list[Contact], int], None]] = []
+        self.__group = threading.Condition()  # Защищает очередь изменений и признак выполняющейся фиксации.
+        self.__queue: deque[Mutation] = deque()
+        self.__committing: bool = False
+        self.__groups: int = 0  # Сколько групп зафиксировано.
+        self.__grouped: int = 0  # Сколько изменений в них вошло.
+        self.__largest: int = 0  # Размер наибольшей группы.
+
+    def addListener(self, listener: Callable[[Commands, list[Contact], int], None]):
+        """Добавляет слушателя, вызываемого после фиксации каждого изменения (операция, контакты, новая ревизия).
+
+        Одна фиксация может содержать несколько однотипных операций (при массовой загрузке), каждая из которых 
+        увеличивает ревизию на единицу. Передаётся ревизия после последней из них. Операция Commands.UPDATE с пустым 
+        списком контактов означает, что изменения до ревизии неизвестны (см. DatabaseConnection.shared)."""
+        self.__listeners.append(listener)
+
+    def _notify(self, operation: Commands, contacts: list[Contact], revision: int):
+        for listener in self.__listeners:
+            listener(operation, contacts, revision)
+
+    def _logSlow(self, operation: str, timer: QueryTimer, rows: int, filter: Filter | None = None,
+                 contact: Contact | None = None, plan: Callable[[], list[str] | None] | None = None,
+                 batch: int | None = None):
+        """Записывает операцию в журнал медленных операций, если она выполнялась дольше порога. План запроса 
+        вычисляется только для записываемых операций."""
+        slow_log: SlowQueryLog | None = self.slow_log
+        if slow_log is not None and slow_log.isSlow(timer):
+            slow_log.write(operation, timer, rows, filter=filter, contact=contact, plan=None if plan is None else plan(),
+                           batch=batch)
+
+    @abc.abstractmethod
+    def createDatabase(self):
+        """Создаёт хранилище или загружает существующее."""
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        """Освобождает ресурсы хранилища."""
+        pass
+
+    def insert(self, pbr: Contact) -> bool:
+        """Добавляет контакт. Возвращает False, если контакт с таким номером уже существует. Для некорректного 
+        контакта — ValueError."""
+        return self.__mutate(Mutation(Commands.ADD, self.__checkContact(pbr, 'Добавление')))
+
+    def delete(self, pbr: Contact) -> bool:
+        """Удаляет контакт, совпадающий с pbr по всем полям. Возвращает False, если такого контакта нет. Для 
+        некорректного контакта — ValueError."""
+        return self.__mutate(Mutation(Commands.DELETE, self.__checkContact(pbr, 'Удаление')))
+
+    def __mutate(self, mutation: Mutation) -> bool:
+        """Ставит изменение в очередь и ждёт его фиксации. Если никто не фиксирует изменения, фиксирует группу сам."""
+        with self.__group:
+            self.__queue.append(mutation)
+            while not mutation.done:
+                if self.__committing:
+                    self.__group.wait()
+                    continue
+                self.__committing = True
+                self.__group.release()
+                try:
+                    if self.group_delay > 0 and len(self.__queue) < self.group_size:
+                        time.sleep(self.group_delay)
+                    self.__commitGroup()
+                finally:
+                    self.__group.acquire()
+                    self.__committing = False
+                    self.__group.notify_all()
+        if mutation.error is not None:
+            raise mutation.error
+        return mutation.result
+
+    def __commitGroup(self):
+        """Фиксирует изменения из начала очереди одной транзакцией и рассылает уведомления о них. Ошибка отдельного 
+        изменения передаётся только ему, ошибка фиксации — всем изменениям группы."""
+        with self.__group:
+            batch: list[Mutation] = [self.__queue.popleft() for _ in range(min(len(self.__queue), self.group_size))]
+        timer = QueryTimer()
+        try:
+            with self.write_lock:
+                timer.lap('lock')
+                results, revision = self._commitBatch([(mutation.operation, mutation.contact) for mutation in batch], timer)
+                applied: list[Mutation] = [mutation for mutation, result in zip(batch, results) if result is True]
+                self._notifyChanges([(mutation.operation, mutation.contact) for mutation in applied], revision)
+                timer.lap('notify')
+        except Exception as error:
+            for mutation in batch:
+                mutation.error = error
+                mutation.done = True
+            return
+        for mutation, result in zip(batch, results):
+            if isinstance(result, Exception):
+                mutation.error = result
+            else:
+                mutation.result = result
+            mutation.done = True
+        with self.__group:
+            self.__groups += 1
+            self.__grouped += len(batch)
+            self.__largest = max(self.__largest, len(batch))
+        if len(batch) == 1:
+            operation: str = 'insert' if batch[0].operation == Commands.ADD else 'delete'
+            self._logSlow(operation, timer, len(applied), contact=batch[0].contact,
+                          plan=lambda: self._explainMutation(batch[0].operation, batch[0].contact))
+        else:
+            self._logSlow('batch', timer, len(applied), batch=len(batch))
+
+    def _notifyChanges(self, changes: list[tuple[Commands, Contact]], revision: int):
+        """Рассылает уведомления об изменениях, ревизии которых идут подряд и заканчиваются revision: по одному 
+        уведомлению на каждую последовательность однотипных изменений."""
+        first: int = revision - len(changes) + 1
+        for operation, group in itertools.groupby(enumerate(changes), key=lambda item: item[1][0]):
+            group = list(group)
+            self._notify(operation, [change[1] for index, change in group], first + group[-1][0])
+
+    def groupStatistics(self) -> dict:
+        """Статистика групповой фиксации: число групп, изменений в них и размер наибольшей группы."""
+        with self.__group:
+            return {'groups': self.__groups, 'mutations': self.__grouped, 'largest': self.__largest}
+
+    @abc.abstractmethod
+    def _commitBatch(self, mutations: list[tuple[Commands, Contact]], timer: QueryTimer) -> tuple[list[bool | Exception], int]:
+        """Применяет добавления и удаления по порядку и фиксирует их одной транзакцией. Добавление контакта с уже 
+        существующим номером и удаление отсутствующего контакта не выполняются. Возвращает результаты изменений 
+        и ревизию после последнего выполненного. Изменение, которое невозможно выполнить из-за его данных, тоже 
+        не выполняется, а вместо результата возвращается исключение; остальные изменения группы фиксируются. 
+        Вызывается под write_lock."""
+        pass
+
+    def _explainMutation(self, operation: Commands, pbr: Contact) -> list[str] | None:
+        """План выполнения изменения для журнала медленных операций."""
+        return None
+
+    @abc.abstractmethod
+    def _insertChunk(self, contacts: list[Contact]) -> tuple[list[Contact], int]:
+        """Добавляет в одной транзакции контакты, номеров которых ещё нет в телефонной книге (номера в contacts 
+        не повторяются). Возвращает добавленные контакты и новую ревизию. Вызывается под write_lock."""
+        pass
+
+    def insertMany(self, rows: Iterable[tuple[int, Contact]], report: ImportReport) -> ImportReport:
+        """Добавляет контакты (вместе с номерами строк загружаемых данных) порциями по BULK_CHUNK. Строки, номер 
+        которых уже есть в телефонной книге, заносятся в отчёт.
+
+        Каждая порция фиксируется отдельно, поэтому запросы других клиентов выполняются между порциями, а память 
+        расходуется только на одну порцию."""
+        rows = iter(rows)
+        while True:
+            chunk: dict[str, tuple[int, Contact]] = {}
+            for row, contact in rows:
+                if contact.number in chunk:
+                    report.reject(row, contact.number, 'Контакт с таким номером уже существует.')
+                else:
+                    chunk[contact.number] = (row, contact)
+                    if len(chunk) >= self.BULK_CHUNK:
+                        break
+            if not chunk:
+                return report
+
+            with self.write_lock:
+                inserted, revision = self._insertChunk([contact for row, contact in chunk.values()])
+                if inserted:
+                    self._notify(Commands.ADD, inserted, revision)
+            report.imported += len(inserted)
+            report.revision = revision
+            if len(inserted) < len(chunk):
+                for contact in inserted:
+                    del chunk[contact.number]
+                for row, contact in chunk.values():
+                    report.reject(row, contact.number, 'Контакт с таким номером уже существует.')
+
+    @abc.abstractmethod
+    def _getContacts(self, numbers: list[str]) -> dict[str, Contact]:
+        """Возвращает существующие контакты с номерами numbers (номер → контакт)."""
+        pass
+
+    @abc.abstractmethod
+    def _commitChanges(self, changes: list[tuple[Commands, Contact]], timer: QueryTimer) -> int:
+        """Применяет заранее проверенные изменения одной транзакцией и возвращает новую ревизию. Удаление выполняется 
+        по номеру контакта. Вызывается под write_lock."""
+        pass
+
+    @staticmethod
+    def __checkContact(contact, operation: str) -> Contact:
+        """Проверяет контакт, полученный от клиента. operation — название операции для сообщения об ошибке."""
+        if not isinstance(contact, Contact):
+            raise ValueError('{0}: не задан контакт.'.format(operation))
+        for field in ('name', 'surname', 'patronymic', 'number'):
+            if not isinstance(getattr(contact, field, None), str):
+                raise ValueError('{0}: не заполнено поле {1}.'.format(operation, field))
+        if getattr(contact, 'note', None) is not None and not isinstance(contact.note, str):
+            raise ValueError('{0}: поле note должно быть строкой.'.format(operation))
+        if not contact.number:
+            raise ValueError('{0}: пустой номер телефона.'.format(operation))
+        return contact
+
+    def __checkBatch(self, batch: BatchRequest) -> list[BatchOperation]:
+        """Проверяет пакет, полученный от клиента. Для некорректного пакета — ValueError."""
+        if not isinstance(batch, BatchRequest) or not isinstance(batch.operations, list):
+            raise ValueError('Некорректный пакет изменений.')
+        if len(batch.operations) > BatchRequest.MAX_OPERATIONS:
+            raise ValueError('Пакет содержит больше {0} операций.'.format(BatchRequest.MAX_OPERATIONS))
+        for index, operation in enumerate(batch.operations, start=1):
+            if not isinstance(operation, BatchOperation) or not isinstance(operation.action, BatchAction):
+                raise ValueError('Операция {0}: неизвестная операция.'.format(index))
+            if operation.action in (BatchAction.INSERT, BatchAction.UPSERT):
+                self.__checkContact(operation.contact, 'Операция {0}'.format(index))
+            elif operation.action == BatchAction.DELETE:
+                if not isinstance(operation.number, str) or not operation.number:
+                    raise ValueError('Операция {0}: не задан номер телефона.'.format(index))
+            else:
+                # Удаление без фильтра очистило бы всю телефонную книгу, поэтому фильтр обязателен.
+                filter: Filter | None = operation.filter if isinstance(operation.filter, Filter) else None
+                if Filter.normalize(filter) is None or not isinstance(filter.text, str):
+                    raise ValueError('Операция {0}: не задан фильтр.'.format(index))
+                if filter.field not in self.FIELDS:
+                    raise ValueError('Операция {0}: недопустимое поле фильтра ({1}).'.format(index, filter.field))
+        return batch.operations
+
+    def applyBatch(self, batch: BatchRequest) -> BatchResult:
+        """Выполняет пакет изменений: операции применяются по порядку к состоянию, полученному после предыдущих 
+        операций, и фиксируются одной транзакцией. Замена контакта записывается в журнал изменений как удаление 
+        прежнего контакта и добавление нового. Для некорректного пакета — ValueError."""
+        operations: list[BatchOperation] = self.__checkBatch(batch)
+        timer = QueryTimer()
+        with self.write_lock:
+            timer.lap('lock')
+            # Состояние затронутых номеров с учётом выполненных операций пакета (None — контакта нет).
+            current: dict[str, Contact | None] = dict.fromkeys(
+                operation.number if operation.action == BatchAction.DELETE else operation.contact.number
+                for operation in operations if operation.action != BatchAction.DELETE_MATCHING)
+            current.update(self._getContacts(list(current)))
+            changes: list[tuple[Commands, Contact]] = []
+            results: list[int] = []
+            for operation in operations:
+                if operation.action == BatchAction.DELETE_MATCHING:
+                    matched: list[Contact] = [pbr for pbr in self.getSnapshot(operation.filter).contacts if pbr.number not in current]
+                    matched.extend(pbr for pbr in current.values() if pbr is not None and operation.filter.match(pbr))
+                    for pbr in matched:
+                        changes.append((Commands.DELETE, pbr))
+                        current[pbr.number] = None
+                    results.append(len(matched))
+                    continue
+                number: str = operation.number if operation.action == BatchAction.DELETE else operation.contact.number
+                existing: Contact | None = current[number]
+                if operation.action == BatchAction.INSERT and existing is not None:
+                    results.append(0)
+                elif operation.action == BatchAction.DELETE:
+                    if existing is not None:
+                        changes.append((Commands.DELETE, existing))
+                        current[number] = None
+                    results.append(int(existing is not None))
+                else:
+                    if existing is not None and existing == operation.contact:
+                        results.append(1)  # Контакт уже совпадает с новым, изменять нечего.
+                        continue
+                    if existing is not None:
+                        changes.append((Commands.DELETE, existing))
+                    changes.append((Commands.ADD, operation.contact))
+                    current[number] = operation.contact
+                    results.append(1)
+            timer.lap('check')
+
+            committed: bool = not batch.atomic or all(results)
+            if committed and changes:
+                revision: int = self._commitChanges(changes, timer)
+                self._notifyChanges(changes, revision)
+                timer.lap('notify')
+            else:
+                revision: int = self.getRevision()
+        self._logSlow('batch', timer, len(changes) if committed else 0, batch=len(operations))
+        return BatchResult(results=results, committed=committed, revision=revision)
+
+    @classmethod
+    def checkFilter(cls, filter) -> Filter | None:
+        """Проверяет фильтр, полученный от клиента, и возвращает его (None для фильтра, не накладывающего 
+        ограничений). Для некорректного фильтра — ValueError."""
+        if filter is not None and not isinstance(filter, Filter):
+            raise ValueError('Некорректный фильтр.')
+        filter = Filter.normalize(filter)
+        if filter is not None:
+            if filter.field not in cls.FIELDS:
+                raise ValueError('Недопустимое поле фильтра ({0}).'.format(filter.field))
+            if not isinstance(filter.text, str):
+                raise ValueError('Текст фильтра должен быть строкой.')
+        return filter
+
+    @abc.abstractmethod
+    def iterContacts(self, filter: Filter | None) -> Iterator[Contact]:
+        """Перебирает удовлетворяющие фильтру контакты, не собирая их в список."""
+        pass
+
+    @abc.abstractmethod
+    def getRevision(self) -> int:
+        """Возвращает текущую ревизию телефонной книги."""
+        pass
+
+    @abc.abstractmethod
+    def getFilteredPhones(self, filter: Filter | None) -> list[Contact]:
+        """Возвращает контакты, удовлетворяющие фильтру."""
+        pass
+
+    @abc.abstractmethod
+    def getSnapshot(self, filter: Filter | None) -> Snapshot:
+        """Возвращает удовлетворяющие фильтру контакты вместе с ревизией, которой они соответствуют."""
+        pass
+
+    @abc.abstractmethod
+    def getChanges(self, since: int, filter: Filter | None) -> Delta | None:
+        """Возвращает удовлетворяющие фильтру изменения, произошедшие после ревизии since.
+        Возвращает None, если журнал изменений уже не содержит нужных записей. Для некорректного фильтра — ValueError."""
+        pass
+
+    @abc.abstractmethod
+    def _getPage(self, filter: Filter | None, sort: str, descending: bool, after: tuple[str, str] | None,
+                 limit: int) -> tuple[int, int, list[Contact]]:
+        """Возвращает ревизию, общее число удовлетворяющих фильтру контактов и не более limit первых из них в порядке 
+        (sort, number), следующих за ключом after. Все три значения должны соответствовать одной ревизии."""
+        pass
+
+    def getPage(self, query: Query) -> Page:
+        """Возвращает страницу контактов. Для неизвестного поля сортировки или некорректного курсора — ValueError."""
+        if query.sort not in Query.SORT_FIELDS:
+            raise ValueError('Недопустимое поле сортировки ({0}).'.format(query.sort))
+        after: tuple[str, str] | None = query.decodeCursor()
+        limit: int = max(1, min(query.limit, self.MAX_PAGE_SIZE))
+        # Лишний контакт показывает, есть ли следующая страница.
+        revision, total, contacts = self._getPage(self.checkFilter(query.filter), query.sort, query.descending, after,
+                                                  0 if query.count_only else limit + 1)
+        cursor: str | None = None
+        if len(contacts) > limit:
+            del contacts[limit:]
+            cursor = query.encodeCursor(contacts[-1])
+        return Page(revision=revision, total=total, contacts=contacts, cursor=cursor)
+
+    def getUpdate(self, update: UpdateRequest) -> Snapshot | Delta:
+        """Возвращает изменения после известной клиенту ревизии, а если это невозможно — все контакты."""
+        data: Snapshot | Delta | None = None
+        if update.revision is not None:
+            data = self.getChanges(update.revision, update.filter)
+        if data is None:
+            data = self.getSnapshot(update.filter)
+        return data
+
+    @staticmethod
+    def _collapseChanges(since: int, revision: int, changes: Iterable[tuple[Commands, Contact]], filter: Filter | None) -> Delta:
+        """Сворачивает упорядоченную по ревизиям последовательность изменений в Delta. Контакт, добавленный 
+        и удалённый после since, клиенту передавать не нужно."""
+        inserted: dict[str, Contact] = {}
+        deleted: dict[str, Contact] = {}
+        for operation, contact in changes:
+            if filter is not None and not filter.match(contact):
+                continue
+            if operation == Commands.ADD:
+                inserted[contact.number] = contact
+            elif contact.number in inserted:
+                del inserted[contact.number]
+            else:
+                deleted[contact.number] = contact
+        return Delta(since=since, revision=revision, inserted=list(inserted.values()), deleted=list(deleted.values()))
+
+
+class DatabaseConnection(Storage):
+    """Хранилище на основе базы данных SQLite.
+
+    Если shared == True, с базой данных одновременно работают несколько процессов (процессы-обработчики сервера). 
+    Тогда write_lock — ProcessLock: изменения всех процессов фиксируются по очереди, и, захватив блокировку, процесс 
+    сначала уведомляет слушателей об изменениях других процессов, прочитав их из журнала изменений. Поэтому слушатели 
+    по-прежнему получают все изменения в порядке ревизий. Изменения других процессов, пока процесс ничего не изменяет, 
+    читаются из журнала фоновым потоком каждые FOLLOW_INTERVAL секунд. Если журнал уже не содержит части изменений, 
+    слушатели получают Commands.UPDATE."""
+    DATABASE_NAME: str = 'phonebook.db'
+    TABLE: str = 'Phonebook'
+    CHANGELOG_TABLE: str = 'Changelog'
+    SEARCH_TABLE: str = 'PhonebookSearch'
+    TRIGRAM_LENGTH: int = 3  # Подстроки короче триграммы не могут быть найдены по индексу.
+
+    '''Параметры, устанавливаемые для каждого нового подключения к базе данных. В режиме WAL читатели не блокируются 
+    писателем, а synchronous = NORMAL сохраняет целостность базы данных, выполняя fsync только при контрольных точках.'''
+    PRAGMAS: dict[str, str | int] = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,  # [байт]
+        'cache_size': -64 * 1024,  # Отрицательное значение задаёт размер в КиБ.
+        'temp_store': 'MEMORY',
+    }
+    POOL_SIZE: int = 16  # Сколько простаивающих подключений хранится в пуле.
+    CACHED_STATEMENTS: int = 256  # Размер кэша подготовленных выражений каждого подключения.
+    FETCH_SIZE: int = 1000  # Сколько строк читается из курсора за один раз при переборе контактов.
+    COUNTS_SIZE: int = 1024  # Для скольких фильтров хранится число контактов в пределах одной ревизии.
+    FOLLOW_INTERVAL: float = 0.02  # Как часто проверяются изменения других процессов (shared) [с].
+
+    def __init__(self, database_name: str = DATABASE_NAME, pragmas: dict[str, str | int] | None = None, pool_size: int = POOL_SIZE,
+                 shared: bool = False):
+        super().__init__()
+        self.database_name: str = database_name
+        self.shared: bool = shared
+        self.__notified: int = 0  # Ревизия, о которой уже уведомлены слушатели (для shared).
+        self.__closed = threading.Event()
+        if shared:
+            self.write_lock = ProcessLock(database_name + '.lock', self.__follow)
+        self.pragmas: dict[str, str | int] = {**self.PRAGMAS, **(pragmas or {})}
+        self.__pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        '''Число контактов для фильтров, подсчитанное при последней прочитанной ревизии. Подсчёт требует просмотра
+        всего индекса, а при листании страниц фильтр не меняется. Пара заменяется целиком, поэтому блокировка не нужна.'''
+        self.__counts: tuple[int, dict[Filter | None, int]] = (-1, {})
+
+    def close(self):
+        """Закрывает простаивающие подключения из пула."""
+        self.__closed.set()
+        while True:
+            try:
+                self.__pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __connect(self) -> sqlite3.Connection:
+        '''Подключение передаётся между потоками через пул, но в каждый момент времени используется только одним 
+        потоком, поэтому проверка потока отключена.'''
+        connection = sqlite3.connect(self.database_name, check_same_thread=False, cached_statements=self.CACHED_STATEMENTS)
+        for name, value in self.pragmas.items():
+            connection.execute('PRAGMA {0} = {1};'.format(name, value))
+        return connection
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдаёт подключение из пула (или создаёт новое) и возвращает его в пул после использования."""
+        try:
+            connection: sqlite3.Connection = self.__pool.get_nowait()
+        except queue.Empty:
+            connection: sqlite3.Connection = self.__connect()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()  # Незафиксированные изменения (или транзакция чтения) не должны попасть в пул.
+            try:
+                self.__pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+    def createDatabase(self):
+        """Создаёт базу данных. Для shared запускает поток, читающий изменения других процессов."""
+        with self.connection() as connection:
+            self.__createTables(connection.cursor())
+            connection.commit()
+            self.__notified = self.__getRevision(connection.cursor())
+        if self.shared:
+            threading.Thread(target=self.__followLoop, name='changelog', daemon=True).start()
+
+    def _notify(self, operation: Commands, contacts: list[Contact], revision: int):
+        self.__notified = revision
+        super()._notify(operation, contacts, revision)
+
+    def __follow(self):
+        """Уведомляет слушателей об изменениях, зафиксированных другими процессами после последнего уведомления. 
+        Вызывается при захвате write_lock процессом, поэтому новых изменений во время чтения журнала нет."""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            revision: int = self.__getRevision(cursor)
+            if revision <= self.__notified:
+                return
+            cursor.execute('''SELECT revision, operation, name, surname, patronymic, number, note FROM {0} 
+            WHERE revision > ? ORDER BY revision;'''.format(self.CHANGELOG_TABLE), (self.__notified,))
+            rows: list = cursor.fetchall()
+        if len(rows) != revision - self.__notified:  # Часть изменений уже удалена из журнала.
+            self._notify(Commands.UPDATE, [], revision)
+        else:
+            self._notifyChanges([(Commands(row[1]), self.__toContact(row[2:])) for row in rows], revision)
+
+    def __followLoop(self):
+        while not self.__closed.wait(self.FOLLOW_INTERVAL):
+            try:
+                if self.getRevision() > self.__notified:
+                    with self.write_lock:  # Изменения читает __follow при захвате блокировки.
+                        pass
+            except sqlite3.Error as error:
+                print('Ошибка чтения изменений других процессов: {0}'.format(error))
+
+    def __createTables(self, cursor: sqlite3.Cursor):
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS {0} (
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        patronymic TEXT NOT NULL,
+        number TEXT NOT NULL,
+        note TEXT,
+        PRIMARY KEY (number)
+        )
+        '''.format(self.TABLE))
+
+        '''Журнал изменений. Номер записи в журнале является ревизией телефонной книги, AUTOINCREMENT гарантирует, 
+        что ревизии не будут повторно использованы после очистки старых записей.'''
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS {0} (
+        revision INTEGER PRIMARY KEY AUTOINCREMENT,
+        operation INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        patronymic TEXT NOT NULL,
+        number TEXT NOT NULL,
+        note TEXT
+        )
+        '''.format(self.CHANGELOG_TABLE))
+
+        for field in Query.SORT_FIELDS:  # Индексы для постраничной выдачи в порядке (field, number).
+            if field != 'number':  # Для номера используется индекс первичного ключа.
+                cursor.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1}, number);'.format(self.TABLE, field))
+
+        self.__createSearchIndex(cursor)
+
+    def __createSearchIndex(self, cursor: sqlite3.Cursor):
+        """Создаёт триграммный полнотекстовый индекс для поиска подстрок и триггеры, поддерживающие его актуальность.
+
+        Индекс хранит только триграммы и ссылается на строки таблицы по rowid, поэтому таблицу нельзя перестраивать 
+        командой VACUUM без последующего вызова rebuildSearchIndex."""
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = ?;', (self.SEARCH_TABLE,))
+        exists: bool = cursor.fetchone() is not None
+
+        fields: str = ', '.join(self.FIELDS)
+        new_fields: str = ', '.join('new.{0}'.format(field) for field in self.FIELDS)
+        old_fields: str = ', '.join('old.{0}'.format(field) for field in self.FIELDS)
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5(
+        {1},
+        content = '{2}',
+        content_rowid = 'rowid',
+        tokenize = 'trigram case_sensitive 1'
+        )
+        '''.format(self.SEARCH_TABLE, fields, self.TABLE))
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON {0} BEGIN
+        INSERT INTO {1} (rowid, {2}) VALUES (new.rowid, {3});
+        END
+        '''.format(self.TABLE, self.SEARCH_TABLE, fields, new_fields))
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON {0} BEGIN
+        INSERT INTO {1} ({1}, rowid, {2}) VALUES ('delete', old.rowid, {3});
+        END
+        '''.format(self.TABLE, self.SEARCH_TABLE, fields, old_fields))
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE ON {0} BEGIN
+        INSERT INTO {1} ({1}, rowid, {2}) VALUES ('delete', old.rowid, {3});
+        INSERT INTO {1} (rowid, {2}) VALUES (new.rowid, {4});
+        END
+        '''.format(self.TABLE, self.SEARCH_TABLE, fields, old_fields, new_fields))
+
+        if not exists:  # Индекс добавлен в существующую базу данных — заполняем его.
+            self.__rebuildSearchIndex(cursor)
+
+    def __rebuildSearchIndex(self, cursor: sqlite3.Cursor):
+        cursor.execute('INSERT INTO {0} ({0}) VALUES (\'rebuild\');'.format(self.SEARCH_TABLE))
+
+    def rebuildSearchIndex(self):
+        """Перестраивает поисковый индекс по содержимому таблицы."""
+        with self.write_lock, self.connection() as connection:
+            self.__rebuildSearchIndex(connection.cursor())
+            connection.commit()
+
+    @staticmethod
+    def __toContact(row) -> Contact:
+        return Contact(name=row[0],
+                       surname=row[1],
+                       patronymic=row[2],
+                       number=row[3],
+                       note=row[4])
+
+    def __logChanges(self, cursor: sqlite3.Cursor, operation: Commands, contacts: list[Contact]) -> int:
+        """Записывает однотипные изменения в журнал, удаляет из него устаревшие записи и возвращает новую ревизию."""
+        cursor.executemany('INSERT INTO {0} (operation, name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?, ?);'.format(self.CHANGELOG_TABLE),
+                           ((operation.value, pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note) for pbr in contacts))
+        return self.__trimChangelog(cursor, self.__getRevision(cursor))
+
+    def __trimChangelog(self, cursor: sqlite3.Cursor, revision: int) -> int:
+        cursor.execute('DELETE FROM {0} WHERE revision <= ?;'.format(self.CHANGELOG_TABLE),
+                       (revision - self.CHANGELOG_SIZE,))
+        return revision
+
+    def __getRevision(self, cursor: sqlite3.Cursor) -> int:
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?;', (self.CHANGELOG_TABLE,))
+        row = cursor.fetchone()
+        return 0 if row is None else row[0]
+
+    @staticmethod
+    def __explain(cursor: sqlite3.Cursor, sql: str, parameters: tuple) -> list[str]:
+        """Возвращает план выполнения запроса (EXPLAIN QUERY PLAN), вложенные шаги смещены отступами."""
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN {0}'.format(sql), parameters)
+        except sqlite3.Error as error:
+            return ['Ошибка получения плана: {0}'.format(error)]
+        levels: dict[int, int] = {0: -1}  # Идентификатор шага → глубина вложенности.
+        plan: list[str] = []
+        for id, parent, unused, detail in cursor.fetchall():
+            levels[id] = levels.get(parent, -1) + 1
+            plan.append('  ' * levels[id] + detail)
+        return plan
+
+    def __mutationQuery(self, operation: Commands, pbr: Contact) -> tuple[str, tuple]:
+        """Запрос, добавляющий контакт или удаляющий контакт, совпадающий с pbr по всем полям."""
+        if operation == Commands.ADD:
+            return ('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(self.TABLE),
+                    (pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
+        return ('DELETE FROM {0} WHERE name = ? AND surname = ? AND patronymic = ? AND number = ? AND note = ?;'.format(self.TABLE),
+                (pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
+
+    def _commitBatch(self, mutations: list[tuple[Commands, Contact]], timer: QueryTimer) -> tuple[list[bool | Exception], int]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            results: list[bool | Exception] = []
+            for operation, pbr in mutations:
+                try:
+                    cursor.execute(*self.__mutationQuery(operation, pbr))
+                except sqlite3.IntegrityError:  # Номер уже существует (или не заполнено обязательное поле).
+                    results.append(False)
+                    continue
+                except (sqlite3.InterfaceError, sqlite3.ProgrammingError, UnicodeEncodeError) as error:
+                    # Значения контакта не удалось передать в запрос; остальные изменения группы выполняются.
+                    results.append(ValueError('Некорректный контакт: {0}'.format(error)))
+                    continue
+                if cursor.rowcount != 1:  # Удаляемого контакта нет.
+                    results.append(False)
+                    continue
+                cursor.execute('INSERT INTO {0} (operation, name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?, ?);'.format(self.CHANGELOG_TABLE),
+                               (operation.value, pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
+                results.append(True)
+            revision: int = self.__getRevision(cursor)
+            if True in results:
+                self.__trimChangelog(cursor, revision)
+            timer.lap('query')
+            connection.commit()
+            timer.lap('commit')
+            return results, revision
+
+    def _explainMutation(self, operation: Commands, pbr: Contact) -> list[str]:
+        with self.connection() as connection:
+            return self.__explain(connection.cursor(), *self.__mutationQuery(operation, pbr))
+
+    def _getContacts(self, numbers: list[str]) -> dict[str, Contact]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SELECT * FROM {0} WHERE number IN (SELECT value FROM json_each(?));'.format(self.TABLE),
+                           (json.dumps(numbers),))
+            return {row[3]: self.__toContact(row) for row in cursor.fetchall()}
+
+    def _commitChanges(self, changes: list[tuple[Commands, Contact]], timer: QueryTimer) -> int:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            for operation, pbr in changes:
+                if operation == Commands.ADD:
+                    cursor.execute(*self.__mutationQuery(operation, pbr))
+                else:  # По первичному ключу, поэтому удаляются и контакты с пустой заметкой.
+                    cursor.execute('DELETE FROM {0} WHERE number = ?;'.format(self.TABLE), (pbr.number,))
+            cursor.executemany('INSERT INTO {0} (operation, name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?, ?);'.format(self.CHANGELOG_TABLE),
+                               ((operation.value, pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note) for operation, pbr in changes))
+            revision: int = self.__trimChangelog(cursor, self.__getRevision(cursor))
+            timer.lap('query')
+            connection.commit()
+            timer.lap('commit')
+            return revision
+
+    def _insertChunk(self, contacts: list[Contact]) -> tuple[list[Contact], int]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            # Существующие номера выбираются одним запросом: список номеров передаётся как массив JSON.
+            cursor.execute('SELECT number FROM {0} WHERE number IN (SELECT value FROM json_each(?));'.format(self.TABLE),
+                           (json.dumps([pbr.number for pbr in contacts]),))
+            existing: set[str] = {row[0] for row in cursor.fetchall()}
+            inserted: list[Contact] = [pbr for pbr in contacts if pbr.number not in existing]
+            if inserted:
+                cursor.executemany('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(self.TABLE),
+                                   ((pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note) for pbr in inserted))
+                revision: int = self.__logChanges(cursor, Commands.ADD, inserted)
+                connection.commit()
+            else:
+                revision: int = self.__getRevision(cursor)
+            return inserted, revision
+
+    def getRevision(self) -> int:
+        """Возвращает текущую ревизию телефонной книги."""
+        with self.connection() as connection:
+            return self.__getRevision(connection.cursor())
+
+    def getPhones(self) -> list[Contact]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SELECT * FROM {0};'.format(self.TABLE))
+            return [self.__toContact(phone) for phone in cursor.fetchall()]
+
+    def __filterCondition(self, filter: Filter | None) -> tuple[str, tuple]:
+        """Возвращает условие WHERE (и его параметры) для контактов, поле filter.field которых содержит подстроку 
+        filter.text (с учётом регистра).
+
+        Подстроки не короче триграммы ищутся по полнотекстовому индексу, более короткие — перебором. Текст поиска 
+        всегда передаётся параметром запроса, поэтому кавычки и символы шаблонов в нём не имеют особого значения."""
+        filter = self.checkFilter(filter)
+        if filter is None:
+            return '1', ()
+        elif len(filter.text) >= self.TRIGRAM_LENGTH:
+            # Фраза в кавычках (кавычки внутри удваиваются) с фильтром по столбцу.
+            return ('rowid IN (SELECT rowid FROM {0} WHERE {0} MATCH ?)'.format(self.SEARCH_TABLE),
+                    ('{0} : "{1}"'.format(filter.field, filter.text.replace('"', '""')),))
+        else:
+            return 'instr({0}, ?) > 0'.format(filter.field), (filter.text,)
+
+    def __filteredQuery(self, filter: Filter | None) -> tuple[str, tuple]:
+        condition, parameters = self.__filterCondition(filter)
+        return 'SELECT * FROM {0} WHERE {1};'.format(self.TABLE, condition), parameters
+
+    def __executeFiltered(self, cursor: sqlite3.Cursor, filter: Filter | None):
+        cursor.execute(*self.__filteredQuery(filter))
+
+    def __selectFiltered(self, cursor: sqlite3.Cursor, filter: Filter | None, timer: QueryTimer | None = None) -> list[Contact]:
+        self.__executeFiltered(cursor, filter)
+        rows: list = cursor.fetchall()
+        if timer is not None:
+            timer.lap('query')
+        contacts: list[Contact] = [self.__toContact(phone) for phone in rows]
+        if timer is not None:
+            timer.lap('convert')
+        return contacts
+
+    def iterContacts(self, filter: Filter | None) -> Iterator[Contact]:
+        """Перебирает контакты по мере чтения курсора. Один запрос SELECT видит согласованное состояние базы данных, 
+        при этом в режиме WAL он не блокирует изменения."""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            self.__executeFiltered(cursor, filter)
+            while rows := cursor.fetchmany(self.FETCH_SIZE):
+                for row in rows:
+                    yield self.__toContact(row)
+
+    def getFilteredPhones(self, filter: Filter | None) -> list[Contact]:
+        timer = QueryTimer()
+        with self.connection() as connection:
+            timer.lap('connection')
+            cursor = connection.cursor()
+            phone_list: list[Contact] = self.__selectFiltered(cursor, filter, timer)
+            self._logSlow('getFilteredPhones', timer, len(phone_list), filter=filter,
+                          plan=lambda: self.__explain(cursor, *self.__filteredQuery(filter)))
+        return phone_list
+
+    def getSnapshot(self, filter: Filter | None) -> Snapshot:
+        """Возвращает удовлетворяющие фильтру контакты вместе с ревизией, которой они соответствуют."""
+        timer = QueryTimer()
+        with self.connection() as connection:
+            timer.lap('connection')
+            cursor = connection.cursor()
+            cursor.execute('BEGIN;')  # Ревизия и контакты должны быть прочитаны в одной транзакции.
+            revision: int = self.__getRevision(cursor)
+            phone_list: list[Contact] = self.__selectFiltered(cursor, filter, timer)
+            self._logSlow('getSnapshot', timer, len(phone_list), filter=filter,
+                          plan=lambda: self.__explain(cursor, *self.__filteredQuery(filter)))
+        return Snapshot(revision=revision, contacts=phone_list)
+
+    def _getPage(self, filter: Filter | None, sort: str, descending: bool, after: tuple[str, str] | None,
+                 limit: int) -> tuple[int, int, list[Contact]]:
+        """Страница читается по индексу (sort, number) начиная с ключа after, поэтому не требует OFFSET."""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('BEGIN;')  # Ревизия, число контактов и страница должны быть прочитаны в одной транзакции.
+            revision: int = self.__getRevision(cursor)
+            condition, parameters = self.__filterCondition(filter)
+            counts_revision, counts = self.__counts
+            if counts_revision != revision or len(counts) >= self.COUNTS_SIZE:
+                counts = {}
+                self.__counts = (revision, counts)
+            total: int | None = counts.get(filter)
+            if total is None:
+                cursor.execute('SELECT COUNT(*) FROM {0} WHERE {1};'.format(self.TABLE, condition), parameters)
+                total = counts[filter] = cursor.fetchone()[0]
+            if limit == 0:
+                return revision, total, []
+
+            direction: str = 'DESC' if descending else 'ASC'
+            if sort == 'number':
+                order: str = 'number {0}'.format(direction)
+            else:
+                order: str = '{0} {1}, number {1}'.format(sort, direction)
+            if after is not None:
+                if sort == 'number':
+                    condition += ' AND number {0} ?'.format('<' if descending else '>')
+                    parameters += (after[1],)
+                else:
+                    condition += ' AND ({0}, number) {1} (?, ?)'.format(sort, '<' if descending else '>')
+                    parameters += after
+            cursor.execute('SELECT * FROM {0} WHERE {1} ORDER BY {2} LIMIT ?;'.format(self.TABLE, condition, order),
+                           parameters + (limit,))
+            return revision, total, [self.__toContact(phone) for phone in cursor.fetchall()]
+
+    def getChanges(self, since: int, filter: Filter | None) -> Delta | None:
+        """Возвращает удовлетворяющие фильтру изменения, произошедшие после ревизии since.
+        Возвращает None, если журнал изменений уже не содержит нужных записей."""
+        filter = self.checkFilter(filter)
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('BEGIN;')
+            revision: int = self.__getRevision(cursor)
+            if since > revision:
+                delta: Delta | None = None  # Клиент знает о ревизии, которой нет (например, база данных была пересоздана).
+            elif since == revision:
+                delta: Delta | None = Delta(since=since, revision=revision, inserted=[], deleted=[])
+            else:
+                cursor.execute('SELECT MIN(revision) FROM {0};'.format(self.CHANGELOG_TABLE))
+                first_revision: int | None = cursor.fetchone()[0]
+                if first_revision is None or first_revision > since + 1:
+                    delta: Delta | None = None  # Часть изменений уже удалена из журнала.
+                else:
+                    cursor.execute('''SELECT operation, name, surname, patronymic, number, note FROM {0} 
+                    WHERE revision > ? AND revision <= ? ORDER BY revision;'''.format(self.CHANGELOG_TABLE), (since, revision))
+                    changes = ((Commands(row[0]), self.__toContact(row[1:])) for row in cursor.fetchall())
+                    delta: Delta | None = self._collapseChanges(since, revision, changes, filter)
+        return delta
+
+
+class MemoryStorage(Storage):
+    """Хранилище, держащее телефонную книгу в оперативной памяти.
+
+    Контакты хранятся по столбцам: i-е элементы списков в __columns относятся к одному контакту, позиции удалённых 
+    контактов используются повторно. Повторяющиеся значения (фамилии, имена, заметки) хранятся в одном экземпляре. 
+    Для каждого поля поддерживается индекс «значение → позиции контактов» и отсортированный список различных значений, 
+    поэтому поиск подстроки перебирает различные значения поля, а не все контакты, а постраничная выдача в порядке 
+    поля начинается с нужного значения без перебора предыдущих.
+
+    Каждая операция дописывается в журнал LOG_NAME. Когда журнал содержит не меньше SNAPSHOT_INTERVAL операций и не 
+    меньше операций, чем контактов в телефонной книге, записывается снимок SNAPSHOT_NAME, после чего журнал очищается. 
+    Так затраты на запись снимков в пересчёте на одну операцию не растут с размером телефонной книги. При запуске 
+    загружается снимок и применяются операции из журнала."""
+    SNAPSHOT_NAME: str = 'phonebook.snapshot'
+    LOG_NAME: str = 'phonebook.log'
+    SNAPSHOT_INTERVAL: int = 10000  # Через сколько операций записывается новый снимок.
+
+    def __init__(self, snapshot_name: str = SNAPSHOT_NAME, log_name: str = LOG_NAME, fsync: bool = False,
+                 snapshot_interval: int = SNAPSHOT_INTERVAL):
+        super().__init__()
+        self.snapshot_name: str = snapshot_name
+        self.log_name: str = log_name
+        self.fsync: bool = fsync  # Выполнять ли fsync журнала после каждой операции.
+        self.snapshot_interval: int = snapshot_interval
+
+        '''Блокировка данных. Изменения дополнительно выполняются под write_lock, но чтение не должно ждать, пока 
+        разошлются уведомления об изменении, поэтому данные защищены отдельной блокировкой.'''
+        self.__lock = threading.RLock()
+        self.__columns: dict[str, list[str | None]] = {field: [] for field in self.FIELDS}
+        self.__slots: dict[str, int] = {}  # Номер телефона → позиция контакта в столбцах.
+        self.__free: list[int] = []  # Позиции удалённых контактов.
+        self.__index: dict[str, dict[str, int | set[int]]] = {field: {} for field in self.FIELDS}
+        self.__sorted: dict[str, list[str]] = {field: [] for field in self.FIELDS}
+        self.__revision: int = 0
+        self.__changelog: deque[tuple[int, Commands, Contact]] = deque(maxlen=self.CHANGELOG_SIZE)
+        self.__log = None  # Файл журнала, открытый на дозапись.
+        self.__operations: int = 0  # Число операций в журнале после последнего снимка.
+
+    def __indexAdd(self, field: str, value: str | None, slot: int, sort: bool = True):
+        if value is None:
+            return
+        index: dict[str, int | set[int]] = self.__index[field]
+        slots: int | set[int] | None = index.get(value)
+        if slots is None:  # Большинство значений встречается один раз, для них множество не создаётся.
+            index[value] = slot
+            if sort:
+                bisect.insort(self.__sorted[field], value)
+        elif isinstance(slots, set):
+            slots.add(slot)
+        else:
+            index[value] = {slots, slot}
+
+    def __indexRemove(self, field: str, value: str | None, slot: int, sort: bool = True):
+        if value is None:
+            return
+        index: dict[str, int | set[int]] = self.__index[field]
+        slots: int | set[int] = index[value]
+        if isinstance(slots, set):
+            slots.discard(slot)
+            if len(slots) == 1:
+                index[value] = slots.pop()
+        else:
+            del index[value]
+            if sort:
+                values: list[str] = self.__sorted[field]
+                del values[bisect.bisect_left(values, value)]
+
+    def __place(self, pbr: Contact, sort: bool = True):
+        """Добавляет контакт в столбцы и индексы. Если sort == False, списки различных значений не обновляются."""
+        values: tuple[str | None, ...] = tuple(None if value is None else sys.intern(value)
+                                               for value in (pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note))
+        if self.__free:
+            slot: int = self.__free.pop()
+            for field, value in zip(self.FIELDS, values):
+                self.__columns[field][slot] = value
+        else:
+            slot: int = len(self.__columns['number'])
+            for field, value in zip(self.FIELDS, values):
+                self.__columns[field].append(value)
+        self.__slots[pbr.number] = slot
+        for field, value in zip(self.FIELDS, values):
+            self.__indexAdd(field, value, slot, sort)
+
+    def __placeMany(self, contacts: list[Contact]):
+        """Добавляет контакты, обновляя списки различных значений один раз, а не при каждой вставке."""
+        new_values: dict[str, set[str]] = {field: set() for field in self.FIELDS}
+        for pbr in contacts:
+            for field, values in new_values.items():
+                value: str | None = getattr(pbr, field)
+                if value is not None and value not in self.__index[field]:
+                    values.add(value)
+        for pbr in contacts:
+            self.__place(pbr, sort=False)
+        for field, values in new_values.items():
+            if values:
+                # Список состоит из двух отсортированных частей, которые sort объединяет за линейное время.
+                self.__sorted[field].extend(sorted(values))
+                self.__sorted[field].sort()
+
+    def __sortValues(self):
+        """Перестраивает списки различных значений после изменений с sort == False."""
+        for field in self.FIELDS:
+            self.__sorted[field] = sorted(self.__index[field])
+
+    def __remove(self, slot: int, sort: bool = True):
+        """Удаляет контакт из столбцов и индексов."""
+        del self.__slots[self.__columns['number'][slot]]
+        for field in self.FIELDS:
+            column: list[str | None] = self.__columns[field]
+            self.__indexRemove(field, column[slot], slot, sort)
+            column[slot] = None
+        self.__free.append(slot)
+
+    def __contact(self, slot: int) -> Contact:
+        columns: dict[str, list[str | None]] = self.__columns
+        return Contact(name=columns['name'][slot],
+                       surname=columns['surname'][slot],
+                       patronymic=columns['patronymic'][slot],
+                       number=columns['number'][slot],
+                       note=columns['note'][slot])
+
+    def __apply(self, operation: Commands, pbr: Contact, revision: int, sort: bool = True):
+        """Применяет операцию к данным. Вызывается под блокировкой данных."""
+        if operation == Commands.ADD:
+            self.__place(pbr, sort)
+        else:
+            self.__remove(self.__slots[pbr.number], sort)
+        self.__revision = revision
+        self.__changelog.append((revision, operation, pbr))
+
+    def __matchSlots(self, filter: Filter | None) -> list[int]:
+        """Возвращает позиции контактов, поле filter.field которых содержит подстроку filter.text (с учётом регистра)."""
+        filter = self.checkFilter(filter)
+        if filter is None:
+            return list(self.__slots.values())
+
+        text: str = filter.text
+        index: dict[str, int | set[int]] = self.__index[filter.field]
+        result: list[int] = []
+        for value in self.__sorted[filter.field]:
+            if text in value:
+                slots: int | set[int] = index[value]
+                if isinstance(slots, set):
+                    result.extend(slots)
+                else:
+                    result.append(slots)
+        result.sort()  # Порядок добавления контактов (с точностью до повторно использованных позиций).
+        return result
+
+    def __orderedSlots(self, sort: str, descending: bool, after: tuple[str, str] | None) -> Iterator[int]:
+        """Перебирает позиции контактов в порядке (sort, number), начиная после ключа after. Вызывается под блокировкой 
+        данных."""
+        values: list[str] = self.__sorted[sort]
+        index: dict[str, int | set[int]] = self.__index[sort]
+        numbers: list[str | None] = self.__columns['number']
+        if after is None:
+            positions = range(len(values) - 1, -1, -1) if descending else range(len(values))
+        elif descending:
+            positions = range(bisect.bisect_right(values, after[0]) - 1, -1, -1)
+        else:
+            positions = range(bisect.bisect_left(values, after[0]), len(values))
+        for position in positions:
+            value: str = values[position]
+            slots: int | set[int] = index[value]
+            ordered = sorted(slots, key=numbers.__getitem__, reverse=descending) if isinstance(slots, set) else (slots,)
+            for slot in ordered:
+                if after is not None and value == after[0]:
+                    number: str = numbers[slot]
+                    if number >= after[1] if descending else number <= after[1]:
+                        continue
+                yield slot
+
+    def createDatabase(self):
+        with self.write_lock, self.__lock:
+            self.__loadSnapshot()
+            self.__replayLog()
+            self.__sortValues()  # Однократная сортировка быстрее вставки каждого значения.
+            self.__log = open(self.log_name, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.write_lock:
+            if self.__log is not None:
+                self.__log.close()
+                self.__log = None
+
+    def __loadSnapshot(self):
+        if not os.path.exists(self.snapshot_name):
+            return
+        with open(self.snapshot_name, encoding='utf-8') as file:
+            self.__revision = json.loads(file.readline())['revision']
+            for line in file:
+                self.__place(Contact(*json.loads(line)), sort=False)
+
+    def __replayLog(self):
+        if not os.path.exists(self.log_name):
+            return
+        valid_size: int = 0  # Размер журнала без недописанной при сбое последней записи.
+        with open(self.log_name, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    revision, operation, *fields = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                if revision > self.__revision:  # Операции, уже попавшие в снимок, пропускаются.
+                    self.__apply(Commands(operation), Contact(*fields), revision, sort=False)
+                    self.__operations += 1
+        if valid_size < os.path.getsize(self.log_name):
+            os.truncate(self.log_name, valid_size)
+
+    @staticmethod
+    def __checkOperation(pbr: Contact):
+        """Проверяет контакт до записи операции в журнал, чтобы в журнал не попала операция, которую нельзя применить."""
+        if not all(isinstance(value, str) for value in (pbr.name, pbr.surname, pbr.patronymic, pbr.number)) \
+                or not (pbr.note is None or isinstance(pbr.note, str)):
+            raise ValueError('Некорректный контакт: {0}.'.format(pbr))
+
+    def __commit(self, operations: list[tuple[Commands, Contact]]) -> int:
+        """Записывает операции в журнал одной записью, применяет их к данным и возвращает новую ревизию. 
+        Вызывается под write_lock.
+
+        Если операцию всё же не удалось применить, из журнала удаляются записи невыполненных операций: ревизия 
+        сдвигается только выполненными операциями, и следующая запись журнала не повторяет уже записанную ревизию."""
+        for operation, pbr in operations:
+            self.__checkOperation(pbr)
+        first: int = self.__revision + 1
+        lines: list[str] = [json.dumps([revision, operation.value, pbr.name, pbr.surname, pbr.patronymic, pbr.number, pbr.note],
+                                       ensure_ascii=False) + '\n' for revision, (operation, pbr) in enumerate(operations, start=first)]
+        position: int = os.path.getsize(self.log_name)  # Журнал сброшен на диск после предыдущей записи.
+        self.__log.write(''.join(lines))
+        self.__log.flush()
+        if self.fsync:
+            os.fsync(self.__log.fileno())
+        try:
+            with self.__lock:
+                if len(operations) > 1 and all(operation == Commands.ADD for operation, pbr in operations):
+                    self.__placeMany([pbr for operation, pbr in operations])
+                    self.__changelog.extend((revision, operation, pbr) for revision, (operation, pbr) in enumerate(operations, start=first))
+                    self.__revision += len(operations)
+                else:
+                    for revision, (operation, pbr) in enumerate(operations, start=first):
+                        self.__apply(operation, pbr, revision)
+        finally:
+            applied: int = self.__revision - first + 1
+            if applied < len(operations):
+                os.truncate(self.log_name, position + len(''.join(lines[:applied]).encode('utf-8')))
+                self.__log.seek(0, os.SEEK_END)
+            self.__operations += applied
+        if self.__operations >= max(self.snapshot_interval, len(self.__slots)):
+            self.__writeSnapshot()
+        return self.__revision
+
+    def __writeSnapshot(self):
+        """Записывает снимок и очищает журнал. Вызывается под write_lock: данные не меняются, а чтение не блокируется."""
+        temporary: str = self.snapshot_name + '.tmp'
+        columns: list[list[str | None]] = [self.__columns[field] for field in self.FIELDS]
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'revision': self.__revision}) + '\n')
+            for slot in self.__slots.values():
+                file.write(json.dumps([column[slot] for column in columns], ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.snapshot_name)  # Атомарная замена: при сбое останется прежний снимок.
+
+        self.__log.close()
+        self.__log = open(self.log_name, 'w', encoding='utf-8')
+        self.__operations = 0
+
+    def _commitBatch(self, mutations: list[tuple[Commands, Contact]], timer: QueryTimer) -> tuple[list[bool | Exception], int]:
+        """Проверяет изменения с учётом предыдущих изменений группы и записывает выполнимые в журнал одной записью 
+        (с одним fsync)."""
+        pending: dict[str, Contact | None] = {}  # Номер → контакт после предыдущих изменений группы.
+        operations: list[tuple[Commands, Contact]] = []
+        results: list[bool | Exception] = []
+        for operation, pbr in mutations:
+            try:
+                if pbr.number in pending:
+                    current: Contact | None = pending[pbr.number]
+                else:
+                    slot: int | None = self.__slots.get(pbr.number)
+                    current: Contact | None = None if slot is None else self.__contact(slot)
+                if operation == Commands.ADD:
+                    result: bool = current is None
+                else:
+                    # Как и в SQL-запросе DatabaseConnection, пустая заметка (NULL) не совпадает ни с чем.
+                    result: bool = current is not None and pbr.note is not None and current == pbr
+            except (TypeError, ValueError) as error:  # Некорректный контакт; остальные изменения группы выполняются.
+                results.append(ValueError('Некорректный контакт: {0}'.format(error)))
+                continue
+            if result:
+                pending[pbr.number] = pbr if operation == Commands.ADD else None
+                operations.append((operation, pbr))
+            results.append(result)
+        timer.lap('query')
+        revision: int = self.__commit(operations) if operations else self.__revision
+        timer.lap('commit')
+        return results, revision
+
+    def _getContacts(self, numbers: list[str]) -> dict[str, Contact]:
+        with self.__lock:
+            return {number: self.__contact(self.__slots[number]) for number in numbers if number in self.__slots}
+
+    def _commitChanges(self, changes: list[tuple[Commands, Contact]], timer: QueryTimer) -> int:
+        revision: int = self.__commit(changes)
+        timer.lap('commit')
+        return revision
+
+    def _insertChunk(self, contacts: list[Contact]) -> tuple[list[Contact], int]:
+        inserted: list[Contact] = [pbr for pbr in contacts if pbr.number not in self.__slots]
+        if not inserted:
+            return inserted, self.__revision
+        return inserted, self.__commit([(Commands.ADD, pbr) for pbr in inserted])
+
+    def iterContacts(self, filter: Filter | None) -> Iterator[Contact]:
+        """Перебирает контакты порциями по BULK_CHUNK, захватывая блокировку данных только на время чтения порции.
+
+        Перебираются контакты, удовлетворявшие фильтру в начале перебора. Удалённые во время перебора контакты 
+        пропускаются."""
+        with self.__lock:
+            number_column: list[str | None] = self.__columns['number']
+            numbers: list[str] = [number_column[slot] for slot in self.__matchSlots(filter)]
+        for start in range(0, len(numbers), self.BULK_CHUNK):
+            with self.__lock:
+                slots = (self.__slots.get(number) for number in numbers[start:start + self.BULK_CHUNK])
+                contacts: list[Contact] = [self.__contact(slot) for slot in slots if slot is not None]
+            yield from contacts
+
+    def getRevision(self) -> int:
+        with self.__lock:
+            return self.__revision
+
+    def __select(self, filter: Filter | None, operation: str) -> Snapshot:
+        timer = QueryTimer()
+        with self.__lock:
+            timer.lap('lock')
+            slots: list[int] = self.__matchSlots(filter)
+            timer.lap('query')
+            snapshot = Snapshot(revision=self.__revision, contacts=[self.__contact(slot) for slot in slots])
+            timer.lap('convert')
+        self._logSlow(operation, timer, len(snapshot.contacts), filter=filter)
+        return snapshot
+
+    def getFilteredPhones(self, filter: Filter | None) -> list[Contact]:
+        return self.__select(filter, 'getFilteredPhones').contacts
+
+    def getSnapshot(self, filter: Filter | None) -> Snapshot:
+        return self.__select(filter, 'getSnapshot')
+
+    def _getPage(self, filter: Filter | None, sort: str, descending: bool, after: tuple[str, str] | None,
+                 limit: int) -> tuple[int, int, list[Contact]]:
+        """Без фильтра страница читается по отсортированному списку значений поля sort начиная с ключа after. С фильтром 
+        подсчёт всё равно требует найти все подходящие контакты, из которых затем выбираются limit первых."""
+        with self.__lock:
+            if filter is None:
+                total: int = len(self.__slots)
+                slots: Iterable[int] = itertools.islice(self.__orderedSlots(sort, descending, after), limit)
+            else:
+                matched: list[int] = self.__matchSlots(filter)
+                total: int = len(matched)
+                column: list[str | None] = self.__columns[sort]
+                numbers: list[str | None] = self.__columns['number']
+                key: Callable[[int], tuple] = lambda slot: (column[slot], numbers[slot])
+                if after is not None and limit > 0:
+                    matched = [slot for slot in matched if (key(slot) < after if descending else key(slot) > after)]
+                slots: Iterable[int] = (heapq.nlargest if descending else heapq.nsmallest)(limit, matched, key=key)
+            return self.__revision, total, [self.__contact(slot) for slot in slots]
+
+    def getChanges(self, since: int, filter: Filter | None) -> Delta | None:
+        filter = self.checkFilter(filter)
+        with self.__lock:
+            revision: int = self.__revision
+            if since > revision:
+                return None  # Клиент знает о ревизии, которой нет (например, хранилище было пересоздано).
+            elif since == revision:
+                return Delta(since=since, revision=revision, inserted=[], deleted=[])
+            elif not self.__changelog or self.__changelog[0][0] > since + 1:
+                return None  # Часть изменений уже удалена из журнала.
+            changes: list[tuple[Commands, Contact]] = [(operation, contact) for change_revision, operation, contact
+                                                      in self.__changelog if change_revision > since]
+        return self._collapseChanges(since, revision, changes, filter)
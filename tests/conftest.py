@@ -0,0 +1,64 @@
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import Contact
+from server import AsyncServer, RequestHandler, ThreadedServer
+from storage import DatabaseConnection, MemoryStorage, Storage
+
+
+def make_contact(index: int, surname: str = 'Иванов', note: str | None = 'заметка') -> Contact:
+    return Contact(name='Имя{0}'.format(index), surname=surname, patronymic='Отчество', number='+7{0:010d}'.format(index), note=note)
+
+
+def open_storage(kind: str, directory) -> Storage:
+    """Создаёт хранилище kind в каталоге directory. Повторный вызов открывает те же файлы."""
+    if kind == 'sqlite':
+        storage: Storage = DatabaseConnection(str(directory / 'phonebook.db'))
+    else:
+        storage: Storage = MemoryStorage(str(directory / 'phonebook.snapshot'), str(directory / 'phonebook.log'))
+    storage.createDatabase()
+    return storage
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def storage(request, tmp_path) -> Storage:
+    storage: Storage = open_storage(request.param, tmp_path)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def database(tmp_path) -> DatabaseConnection:
+    storage: DatabaseConnection = open_storage('sqlite', tmp_path)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def handler(storage) -> RequestHandler:
+    return RequestHandler(storage)
+
+
+@pytest.fixture(params=['threads', 'asyncio'])
+def server(request, handler):
+    """Сервер в отдельном потоке. Возвращает сервер и порт."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    max_connections: int = 5
+    if request.param == 'asyncio':
+        server = AsyncServer(listener, handler, max_connections=max_connections)
+    else:
+        server = ThreadedServer(listener, handler, threading.Event(), max_connections=max_connections)
+    thread = threading.Thread(target=server.server_loop, daemon=True)
+    thread.start()
+    yield server, listener.getsockname()[1]
+    server.shutdown()
+    thread.join(10)
+    listener.close()
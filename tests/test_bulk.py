@@ -0,0 +1,95 @@
+import pytest
+
+import bulk
+from common import BulkFormat, Contact, Filter, ImportReport
+from conftest import make_contact
+
+
+CONTACTS: list[Contact] = [
+    make_contact(1),
+    make_contact(2, surname='Щукин', note='запятая, "кавычки"\nи перевод строки'),
+    make_contact(3, note=''),
+    make_contact(4, surname='Ёжиков', note='😀 ' * 50),
+]
+
+
+def read(data: bytes, format: BulkFormat, chunk_size: int = 7) -> tuple[list[tuple[int, Contact]], ImportReport]:
+    """Читает данные, разбитые на фрагменты chunk_size байт (границы проходят и внутри символов UTF-8)."""
+    report = ImportReport()
+    chunks = (data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+    with bulk.open_chunks(chunks) as file:
+        rows: list[tuple[int, Contact]] = list(bulk.read_contacts(file, format, report))
+    return rows, report
+
+
+@pytest.mark.parametrize('format', list(BulkFormat))
+def test_round_trip(format):
+    data: bytes = b''.join(bulk.encode_contacts(CONTACTS, format, chunk_size=100))
+    rows, report = read(data, format)
+    assert report.rejected == 0
+    assert [row for row, contact in rows] == [1, 2, 3, 4]
+    assert [vars(contact) for row, contact in rows] == [vars(contact) for contact in CONTACTS]
+
+
+def test_encode_splits_into_chunks():
+    contacts: list[Contact] = [make_contact(index) for index in range(200)]
+    chunks: list[bytes] = list(bulk.encode_contacts(contacts, BulkFormat.CSV, chunk_size=1000))
+    assert len(chunks) > 1
+    assert all(len(chunk.decode('utf-8')) < 1100 for chunk in chunks)  # Размер фрагмента считается в символах.
+    assert len(read(b''.join(chunks), BulkFormat.CSV)[0]) == 200
+
+
+def test_csv_columns_in_any_order_with_bom():
+    data: bytes = '﻿number,note,patronymic,surname,name\n+1,,c,b,a\n'.encode('utf-8')
+    rows, report = read(data, BulkFormat.CSV)
+    assert [vars(contact) for row, contact in rows] == [vars(Contact(name='a', surname='b', patronymic='c', number='+1', note=''))]
+
+
+def test_csv_rejects_rows():
+    data: bytes = 'name,surname,patronymic,number\na,b,c,+1\na,b\na,b,c,\n'.encode('utf-8')
+    rows, report = read(data, BulkFormat.CSV)
+    assert [row for row, contact in rows] == [1]
+    assert [(conflict.row, conflict.number) for conflict in report.conflicts] == [(2, None), (3, '')]
+    with pytest.raises(ValueError):
+        read(b'name,surname\na,b\n', BulkFormat.CSV)
+    assert read(b'', BulkFormat.CSV)[0] == []  # Пустой файл не содержит контактов.
+
+
+def test_jsonl_rejects_rows():
+    lines: list[str] = ['{"name": "a", "surname": "b", "patronymic": "c", "number": "+1"}', '', 'не JSON', '[1, 2]',
+                        '{"name": "a", "surname": "b", "patronymic": "c", "number": "+2", "note": 5}',
+                        '{"name": "a", "surname": "b", "number": "+3"}']
+    rows, report = read('\n'.join(lines).encode('utf-8'), BulkFormat.JSONL)
+    assert [(row, contact.note) for row, contact in rows] == [(1, None)]
+    assert [(conflict.row, conflict.number) for conflict in report.conflicts] == [(3, None), (4, None), (5, '+2'), (6, '+3')]
+    assert report.rejected == 4
+
+
+def test_report_limits_conflicts(monkeypatch):
+    monkeypatch.setattr(ImportReport, 'MAX_CONFLICTS', 2)
+    report = ImportReport()
+    for row in range(5):
+        report.reject(row, None, 'ошибка')
+    assert (report.rejected, len(report.conflicts)) == (5, 2)
+
+
+@pytest.mark.parametrize('format', list(BulkFormat))
+def test_import_and_export_file(storage, tmp_path, format, monkeypatch):
+    monkeypatch.setattr(storage, 'BULK_CHUNK', 3)  # Загрузка несколькими транзакциями.
+    assert storage.insert(make_contact(5))
+    contacts: list[Contact] = [make_contact(index) for index in range(10)] + [make_contact(7)]
+    path = tmp_path / 'import.{0}'.format(format.value)
+    path.write_bytes(b''.join(bulk.encode_contacts(contacts, format)))
+    assert bulk.guess_format(str(path)) == format
+
+    report: ImportReport = bulk.import_file(storage, str(path), format)
+    assert report.imported == 9
+    assert sorted((conflict.row, conflict.number) for conflict in report.conflicts) == [(6, make_contact(5).number),
+                                                                                        (11, make_contact(7).number)]
+    assert report.revision == storage.getRevision() == 10
+
+    exported = tmp_path / 'export.{0}'.format(format.value)
+    bulk.export_file(storage, str(exported), format, Filter('name', 'Имя'))
+    with open(exported, encoding=bulk.ENCODING, newline='') as file:
+        rows: list[tuple[int, Contact]] = list(bulk.read_contacts(file, format, ImportReport()))
+    assert sorted(contact.number for row, contact in rows) == [make_contact(index).number for index in range(10)]
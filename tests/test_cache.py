@@ -0,0 +1,126 @@
+import threading
+
+from cache import ResponseCache
+
+
+class SlowCompute:
+    """Вычисление ответа, которое не завершается, пока тест не разрешит."""
+    def __init__(self, data: bytes):
+        self.data: bytes = data
+        self.calls: int = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self) -> bytes:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        return self.data
+
+
+def run(target, *args) -> tuple[threading.Thread, list]:
+    """Запускает target в отдельном потоке. Результат (или исключение) попадает в возвращаемый список."""
+    result: list = []
+
+    def __run():
+        try:
+            result.append(target(*args))
+        except Exception as error:
+            result.append(error)
+
+    thread = threading.Thread(target=__run)
+    thread.start()
+    return thread, result
+
+
+def test_hit_and_lru_eviction():
+    cache = ResponseCache(max_size=10)
+    assert cache.get('a', lambda: b'aaaa') == b'aaaa'
+    assert cache.get('a', lambda: b'other') == b'aaaa'
+    cache.get('b', lambda: b'bbbb')
+    cache.get('a', lambda: b'')  # 'a' становится последним использованным.
+    cache.get('c', lambda: b'cccc')  # Не помещается: вытесняется 'b'.
+    assert cache.get('b', lambda: b'BBBB') == b'BBBB'
+    assert cache.get('big', lambda: b'x' * 11) == b'x' * 11  # Ответ больше лимита не сохраняется.
+    statistics: dict[str, int] = cache.statistics()
+    assert statistics['size'] <= 10
+    assert (statistics['hits'], statistics['misses'], statistics['evictions']) == (2, 5, 2)
+
+
+def test_identical_misses_are_coalesced():
+    cache = ResponseCache()
+    compute = SlowCompute(b'answer')
+    owner, owner_result = run(cache.get, 'key', compute)
+    assert compute.started.wait(10)
+    waiters = [run(cache.get, 'key', compute) for _ in range(5)]
+    while cache.statistics()['coalesced'] < 5:
+        threading.Event().wait(0.001)
+    compute.release.set()
+    for thread, result in [(owner, owner_result)] + waiters:
+        thread.join()
+        assert result == [b'answer']
+    assert compute.calls == 1
+    assert cache.statistics()['misses'] == 1
+
+
+def test_invalidation_during_compute():
+    # Ответ, вычисленный до изменения данных, не сохраняется, а новые запросы не ждут его.
+    cache = ResponseCache()
+    stale = SlowCompute(b'old')
+    owner, owner_result = run(cache.get, 'key', stale)
+    assert stale.started.wait(10)
+    waiter, waiter_result = run(cache.get, 'key', stale)
+    while cache.statistics()['coalesced'] < 1:
+        threading.Event().wait(0.001)
+
+    cache.invalidate()
+    assert cache.get('key', lambda: b'new') == b'new'
+    stale.release.set()
+    owner.join()
+    waiter.join()
+    assert owner_result == waiter_result == [b'old']  # Запросы, начатые до изменения, получают прежний ответ.
+    assert cache.get('key', lambda: b'newer') == b'new'
+    assert stale.calls == 1
+
+
+def test_invalidation_while_new_owner_computes():
+    # Завершение устаревшего вычисления не снимает ожидание с вычисления, начатого после инвалидации.
+    cache = ResponseCache()
+    stale, fresh = SlowCompute(b'old'), SlowCompute(b'new')
+    first, first_result = run(cache.get, 'key', stale)
+    assert stale.started.wait(10)
+    cache.invalidate()
+    second, second_result = run(cache.get, 'key', fresh)
+    assert fresh.started.wait(10)
+    stale.release.set()
+    first.join()
+    waiter, waiter_result = run(cache.get, 'key', fresh)
+    while cache.statistics()['coalesced'] < 1:
+        threading.Event().wait(0.001)
+    fresh.release.set()
+    second.join()
+    waiter.join()
+    assert first_result == [b'old']
+    assert second_result == waiter_result == [b'new']
+    assert fresh.calls == 1
+    assert cache.get('key', lambda: b'') == b'new'
+
+
+def test_failed_compute_is_not_cached():
+    cache = ResponseCache()
+    failing = SlowCompute(b'')
+
+    def fail() -> bytes:
+        failing()
+        raise ValueError('ошибка')
+
+    owner, owner_result = run(cache.get, 'key', fail)
+    assert failing.started.wait(10)
+    waiter, waiter_result = run(cache.get, 'key', fail)
+    while cache.statistics()['coalesced'] < 1:
+        threading.Event().wait(0.001)
+    failing.release.set()
+    owner.join()
+    waiter.join()
+    assert isinstance(owner_result[0], ValueError) and isinstance(waiter_result[0], ValueError)
+    assert cache.get('key', lambda: b'ok') == b'ok'
@@ -0,0 +1,180 @@
+import functools
+import socket
+import time
+
+import pytest
+
+import client
+from client import NetworkWorker, PagedContacts
+from common import ClientRequest, Commands, Compression, Contact, Delta, Filter, Page, Query, ServerResponse, UpdateRequest
+from conftest import make_contact
+from phonebook import PhonebookClient
+
+
+class Pages:
+    """Источник страниц для PagedContacts, читающий их из хранилища. Ответ отправляется только по вызову deliver."""
+    def __init__(self, storage):
+        self.storage = storage
+        self.fetched: list[Query] = []
+        self.pending: list = []
+        self.loaded: int = 0  # Сколько раз был вызван on_load.
+
+    def fetch(self, query: Query, callback):
+        self.fetched.append(query)
+        self.pending.append((query, callback))
+
+    def deliver(self):
+        """Отвечает на все запросы (в том числе отправленные во время ответа)."""
+        while self.pending:
+            query, callback = self.pending.pop(0)
+            callback(self.storage.getPage(query))
+
+    def onLoad(self):
+        self.loaded += 1
+
+    def open(self, query: Query) -> PagedContacts:
+        return PagedContacts(self.fetch, query, self.storage.getPage(query), on_load=self.onLoad)
+
+
+@pytest.fixture
+def pages(storage, monkeypatch) -> Pages:
+    monkeypatch.setattr(PagedContacts, 'PAGE_SIZE', 10)
+    monkeypatch.setattr(PagedContacts, 'JUMP_PAGE_SIZE', 40)
+    return Pages(storage)
+
+
+def numbers_of(contacts: list[Contact]) -> list[str]:
+    return [contact.number for contact in contacts]
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_are_loaded_on_demand(storage, pages, descending):
+    for index in range(100):
+        storage.insert(make_contact(index))
+    expected: list[str] = sorted(numbers_of([make_contact(index) for index in range(100)]), reverse=descending)
+    contacts: PagedContacts = pages.open(Query(descending=descending, limit=10))
+    assert len(contacts) == 100
+    assert numbers_of(contacts[:10]) == expected[:10]
+    assert pages.fetched == []
+
+    # Пока страница не получена, возвращаются только загруженные строки, а повторный запрос не отправляется.
+    assert numbers_of(contacts[5:15]) == expected[5:10]
+    assert numbers_of(contacts[5:15]) == expected[5:10]
+    assert [query.limit for query in pages.fetched] == [10]
+    pages.deliver()
+    assert pages.loaded == 1
+    assert numbers_of(contacts[5:15]) == expected[5:15]
+
+    assert contacts[95:96] == []  # Далёкая строка загружается крупными страницами.
+    pages.deliver()
+    contacts[95:96]
+    pages.deliver()
+    assert contacts[95].number == expected[95]
+    assert [query.limit for query in pages.fetched] == [10, 40, 40]
+    assert contacts.complete
+    assert numbers_of(contacts[:]) == expected
+
+
+def test_changes_keep_sort_order(storage, pages):
+    for index in range(0, 60, 2):
+        storage.insert(make_contact(index))
+    contacts: PagedContacts = pages.open(Query(limit=10))
+    revision: int = storage.getRevision()
+
+    storage.insert(make_contact(3))  # Среди загруженных строк.
+    storage.insert(make_contact(51))  # За последней загруженной строкой: будет получен со страницей.
+    storage.delete(make_contact(4))
+    delta: Delta = storage.getChanges(revision, None)
+    contacts.apply(delta)
+    assert len(contacts) == 31
+    while not contacts.complete:
+        contacts[:]
+        pages.deliver()
+    contacts.apply(delta)  # Повторное применение ничего не меняет.
+    expected: list[str] = sorted(numbers_of([make_contact(index) for index in list(range(0, 60, 2)) + [3, 51] if index != 4]))
+    assert numbers_of(contacts[:]) == expected
+
+
+def test_total_follows_filter(storage, pages):
+    for index in range(30):
+        storage.insert(make_contact(index, surname=('Петров', 'Иванов')[index % 2]))
+    contacts: PagedContacts = pages.open(Query(filter=Filter('surname', 'Иван'), sort='surname', limit=10))
+    assert len(contacts) == 15
+    revision: int = storage.getRevision()
+    storage.insert(make_contact(100, surname='Иванов'))
+    contacts.apply(storage.getChanges(revision, Filter('surname', 'Иван')))
+    assert len(contacts) == 16
+
+    # Delta, частично учтённая в total, приводит к повторному подсчёту.
+    storage.insert(make_contact(101, surname='Иванов'))
+    contacts.apply(storage.getChanges(revision, Filter('surname', 'Иван')))
+    assert [query.count_only for query in pages.fetched] == [True]
+    pages.deliver()
+    assert len(contacts) == 17
+
+
+class Events:
+    """Обратные вызовы NetworkWorker, сохраняющие полученные события."""
+    def __init__(self):
+        self.connected: list[str | None] = []
+        self.notifications: list[Delta] = []
+        self.responses: list[ServerResponse] = []
+        self.closed: int = 0
+
+    def open(self, port: int, monkeypatch, timeout: float = 10) -> NetworkWorker:
+        monkeypatch.setattr(client, 'PhonebookClient', functools.partial(PhonebookClient, port=port))
+        return NetworkWorker('127.0.0.1', on_connect=self.connected.append, on_notify=self.notifications.append,
+                             on_close=self.onClose, timeout=timeout, compression=[Compression.ZLIB])
+
+    def onClose(self):
+        self.closed += 1
+
+    @staticmethod
+    def wait(worker: NetworkWorker, condition) -> bool:
+        """Вызывает poll(), пока не выполнится условие. Возвращает результат последнего poll()."""
+        deadline: float = time.monotonic() + 10
+        while True:
+            alive: bool = worker.poll()
+            if condition() or time.monotonic() > deadline:
+                return alive
+            time.sleep(0.005)
+
+
+def test_network_worker(server, monkeypatch):
+    server, port = server
+    events = Events()
+    worker: NetworkWorker = events.open(port, monkeypatch)
+    # Запросы можно отправлять до установки соединения, ответы приходят в порядке отправки.
+    worker.request(ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest()), events.responses.append)
+    worker.request(ClientRequest(command=Commands.ADD, data=make_contact(1)), events.responses.append)
+    worker.request(ClientRequest(command=Commands.UPDATE, data=None), events.responses.append)
+    assert events.wait(worker, lambda: len(events.responses) == 3 and events.notifications)
+    assert events.connected == [None]
+    assert [response.command for response in events.responses] == [Commands.SUBSCRIBE, Commands.ADD, Commands.UPDATE]
+    assert [contact.number for contact in events.responses[2].data] == [make_contact(1).number]
+    assert [delta.revision for delta in events.notifications] == [1]
+
+    worker.close()
+    assert not worker.poll()
+    assert events.closed == 0  # Закрытие соединения клиентом не считается разрывом.
+
+
+def test_network_worker_reports_disconnect(server, monkeypatch):
+    server, port = server
+    events = Events()
+    worker: NetworkWorker = events.open(port, monkeypatch)
+    assert events.wait(worker, lambda: events.connected)
+    server.shutdown()
+    assert not events.wait(worker, lambda: events.closed)
+    assert events.closed == 1
+
+
+def test_network_worker_connection_error(monkeypatch):
+    events = Events()
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        worker: NetworkWorker = events.open(unused.getsockname()[1], monkeypatch)  # Порт никто не слушает.
+        events.wait(worker, lambda: events.connected)
+    assert len(events.connected) == 1 and isinstance(events.connected[0], str)
+    assert not worker.poll()
+    assert events.closed == 0
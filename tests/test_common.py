@@ -0,0 +1,189 @@
+import socket
+import struct
+import threading
+import zlib
+
+import pytest
+
+from common import (CHUNK_SIZE, COMPRESSED_MAGIC, FRAME_HEADER, BatchOperation, BatchRequest, BatchResult, BulkFormat, BulkImport, ClientRequest, Commands, Compression, Contact,
+                    Delta, ExportRequest, Filter, Handshake,
+                    FrameType, ImportReport, Page, ProtocolError, Query, ServerResponse, Snapshot, UpdateRequest, WireFormat,
+                    compress_message, decode_binary, decode_object, decompress_message, encode_binary, encode_object, is_compressed,
+                    receive_message, receive_object, send_message, send_object, tag_message, untag_message, wire_format)
+from conftest import make_contact
+
+
+@pytest.fixture
+def sockets():
+    first, second = socket.socketpair()
+    with first, second:
+        yield first, second
+
+
+def contacts_of(contacts: list[Contact]) -> list[dict]:
+    return [vars(contact) for contact in contacts]
+
+
+@pytest.mark.parametrize('size', [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 3 * CHUNK_SIZE])
+def test_message_round_trip(sockets, size):
+    # Сообщение длиннее кадра разбивается на несколько кадров и собирается обратно; следующее сообщение не смешивается с ним.
+    first, second = sockets
+    message: bytes = bytes(index % 251 for index in range(size))
+    sender = threading.Thread(target=lambda: (send_message(first, message), send_message(first, b'next')))
+    sender.start()
+    assert receive_message(second) == message
+    assert receive_message(second) == b'next'
+    sender.join()
+
+
+def test_object_round_trip(sockets):
+    # Объект сериализуется сразу в сокет и принимается потоково, даже если занимает много кадров.
+    first, second = sockets
+    request = ClientRequest(command=Commands.UPDATE, data=[make_contact(index) for index in range(3000)])
+    sender = threading.Thread(target=lambda: (send_object(first, request), send_object(first, make_contact(1))))
+    sender.start()
+    received: ClientRequest = receive_object(second)
+    assert received.command == Commands.UPDATE
+    assert contacts_of(received.data) == contacts_of(request.data)
+    assert vars(receive_object(second)) == vars(make_contact(1))
+    sender.join()
+
+
+def test_closed_connection(sockets):
+    first, second = sockets
+    first.close()
+    assert receive_message(second) is None
+    assert receive_object(second) is None
+
+
+@pytest.mark.parametrize('data', [
+    FRAME_HEADER.pack(FrameType.MESSAGE, 10) + b'short',  # Соединение закрыто посреди кадра.
+    FRAME_HEADER.pack(9, 0),  # Неизвестный тип кадра.
+    FRAME_HEADER.pack(FrameType.MESSAGE, CHUNK_SIZE + 1),  # Кадр длиннее допустимого.
+    FRAME_HEADER.pack(FrameType.LAST_CHUNK, 1) + b'x',  # Сообщение начинается с последнего фрагмента.
+    FRAME_HEADER.pack(FrameType.CHUNK, 1) + b'x' + FRAME_HEADER.pack(FrameType.MESSAGE, 1) + b'y',
+    FRAME_HEADER.pack(FrameType.CHUNK, 1) + b'x',  # Соединение закрыто между фрагментами.
+    struct.pack('!B', FrameType.MESSAGE),  # Обрезанный заголовок.
+])
+def test_malformed_frames(sockets, data):
+    first, second = sockets
+    first.sendall(data)
+    first.close()
+    with pytest.raises(ProtocolError):
+        receive_message(second)
+
+
+def test_contact_list_round_trip():
+    # Повторяющиеся фамилии и заметки передаются через словарь, пустая заметка — как None.
+    contacts: list[Contact] = [make_contact(index, surname='Фамилия{0}'.format(index % 3), note=None if index % 4 == 0 else 'заметка')
+                               for index in range(1000)]
+    data: bytes = encode_binary(Snapshot(revision=42, contacts=contacts))
+    assert wire_format(data) == WireFormat.BINARY
+    snapshot = decode_binary(data)
+    assert isinstance(snapshot, Snapshot)
+    assert snapshot.revision == 42
+    assert contacts_of(snapshot.contacts) == contacts_of(contacts)
+
+
+@pytest.mark.parametrize('obj', [
+    Delta(since=3, revision=7, inserted=[make_contact(1)], deleted=[make_contact(2), make_contact(3, note=None)]),
+    Page(revision=5, total=2, contacts=[make_contact(1), make_contact(2)], cursor='abc'),
+    ClientRequest(command=Commands.UPDATE, data=Query(filter=Filter('surname', 'Ив'), sort='name', descending=True, limit=10)),
+    ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest(filter=Filter('note', 'x'), revision=12)),
+    ClientRequest(command=Commands.BULK_IMPORT, data=BulkImport(BulkFormat.JSONL)),
+    ClientRequest(command=Commands.BULK_IMPORT, data=b'\x00\xff\x10chunk'),
+    ClientRequest(command=Commands.EXPORT, data=ExportRequest(filter=None, format=BulkFormat.CSV)),
+    ClientRequest(command=Commands.HELLO, data=Handshake([Compression.LZMA, Compression.ZLIB], threshold=100)),
+    ClientRequest(command=Commands.BATCH, data=BatchRequest([BatchOperation.insert(make_contact(1)), BatchOperation.upsert(make_contact(2)),
+                                                             BatchOperation.delete('+1'), BatchOperation.deleteMatching(Filter('name', 'a'))],
+                                                            atomic=False)),
+    ServerResponse(command=Commands.BATCH, flag=False, data=BatchResult([1, 0, 3], committed=False, revision=9)),
+    ServerResponse(command=Commands.UPDATE, flag=True, data=[make_contact(1), make_contact(2, note=None)]),
+    ServerResponse(command=Commands.UPDATE, flag=False, data='ошибка'),
+    ServerResponse(command=Commands.ADD, flag=True, data={'load': [1.5, -2, 2 ** 40], 'name': 'тест', 'empty': None}),
+])
+def test_object_round_trip(obj):
+    decoded = decode_object(encode_object(obj))
+    assert type(decoded) is type(obj)
+    assert encode_binary(decoded) == encode_binary(obj)
+
+
+def test_import_report_round_trip():
+    report = ImportReport()
+    report.imported = 10
+    report.reject(3, '+1', 'Номер уже существует.')
+    report.revision = 11
+    decoded: ImportReport = decode_binary(encode_binary(report))
+    assert (decoded.imported, decoded.rejected, decoded.revision) == (10, 1, 11)
+    assert [str(conflict) for conflict in decoded.conflicts] == [str(conflict) for conflict in report.conflicts]
+
+
+def test_unsupported_value_falls_back_to_pickle():
+    with pytest.raises(TypeError):
+        encode_binary({1, 2})
+    data: bytes = encode_object(ServerResponse(command=Commands.ADD, flag=True, data={1, 2}))
+    assert wire_format(data) == WireFormat.PICKLE
+    assert decode_object(data).data == {1, 2}
+    with pytest.raises(ProtocolError):
+        decode_object(data, allow_pickle=False)
+
+
+@pytest.mark.parametrize('data', [b'', b'PB', b'PB\x63\x00', encode_binary(make_contact(1))[:-3], encode_binary(make_contact(1)) + b'\x00',
+                                  b'PB\x01\x0a\x7f'])
+def test_corrupted_message_is_rejected(data):
+    with pytest.raises(ProtocolError):
+        decode_binary(data)
+
+
+@pytest.mark.parametrize('obj', [Contact('Имя', 'Фамилия', 'Отчество', 5, None), Filter('name', ['Имя']), UpdateRequest('name'),
+                                 Query(limit='10'), ClientRequest(command=3, data=None), Snapshot(revision=1, contacts=['+7']),
+                                 BatchRequest([Contact('Имя', 'Фамилия', 'Отчество', '+7', None)])])
+def test_invalid_field_type_is_rejected(obj):
+    # Двоичный формат передаёт значения любых поддерживаемых типов, поэтому типы полей проверяются при чтении.
+    with pytest.raises(ProtocolError):
+        decode_binary(encode_binary(obj))
+
+
+def test_tagged_round_trip(sockets):
+    first, second = sockets
+    send_object(first, ClientRequest(command=Commands.UPDATE, data=Filter('name', 'Имя'), id=2 ** 20))
+    send_object(first, ServerResponse(command=Commands.ADD, flag=True, id=None), WireFormat.PICKLE)
+    request: ClientRequest = receive_object(second)
+    assert (request.command, request.data, request.id) == (Commands.UPDATE, Filter('name', 'Имя'), 2 ** 20)
+    assert receive_object(second).id is None
+
+    data: bytes = encode_object(ServerResponse(command=Commands.UPDATE, flag=True, data=[make_contact(1)]))
+    assert untag_message(data) == (None, data)
+    id, untagged = untag_message(tag_message(data, 300))
+    assert (id, bytes(untagged)) == (300, data)
+    assert decode_object(tag_message(data, 300)).id == 300
+
+
+@pytest.mark.parametrize('compression', [Compression.ZLIB, Compression.LZMA])
+def test_compressed_round_trip(sockets, compression):
+    response = ServerResponse(command=Commands.UPDATE, flag=True, data=Snapshot(revision=1, contacts=[make_contact(index) for index in range(500)]))
+    data: bytes = compress_message(encode_object(response), compression)
+    assert is_compressed(data)
+    assert len(data) < len(encode_object(response)) // 3
+    assert contacts_of(decode_object(data).data.contacts) == contacts_of(response.data.contacts)
+    first, second = sockets
+    sender = threading.Thread(target=send_message, args=(first, data))
+    sender.start()
+    assert contacts_of(receive_object(second).data.contacts) == contacts_of(response.data.contacts)  # Распаковка при потоковом чтении.
+    sender.join()
+    assert compress_message(b'data', Compression.NONE) == b'data'
+
+
+def test_decompression_is_limited(monkeypatch):
+    monkeypatch.setattr('common.MAX_DECOMPRESSED_SIZE', 1000)
+    assert len(decompress_message(compress_message(b'x' * 1000, Compression.ZLIB))) == 1000
+    for compression in (Compression.ZLIB, Compression.LZMA):
+        with pytest.raises(ProtocolError):  # Сообщение, распаковывающееся в объём больше предела.
+            decompress_message(compress_message(b'x' * 1001, compression))
+
+
+@pytest.mark.parametrize('data', [COMPRESSED_MAGIC, COMPRESSED_MAGIC + b'\x07data', COMPRESSED_MAGIC + b'\x01' + zlib.compress(b'data')[:-2],
+                                  COMPRESSED_MAGIC + b'\x02not lzma', COMPRESSED_MAGIC + b'\x00data'])
+def test_corrupted_compressed_message_is_rejected(data):
+    with pytest.raises(ProtocolError):
+        decompress_message(data)
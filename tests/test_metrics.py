@@ -0,0 +1,98 @@
+import math
+import urllib.error
+import urllib.request
+
+import pytest
+
+from common import Commands
+from conftest import make_contact
+from metrics import LATENCY_BOUNDS, Histogram, MetricsEndpoint, ServerMetrics, render_text
+from phonebook import PhonebookClient
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    for milliseconds in [0.05] * 90 + [3] * 9 + [20000]:
+        histogram.observe(milliseconds / 1000)
+    assert histogram.count == 100 and histogram.max == 20
+    assert histogram.quantile(0.5) == LATENCY_BOUNDS[0]
+    assert histogram.quantile(0.95) == 0.0032  # Граница корзины, а не точное значение.
+    assert histogram.quantile(0.999) == 20  # Последняя корзина: максимум.
+    buckets: list = histogram.statistics()['buckets']
+    assert buckets[-1] == [None, 1] and sum(count for bound, count in buckets) == 100
+
+
+def test_request_timing():
+    metrics = ServerMetrics()
+    timing = metrics.begin(Commands.UPDATE, 10)
+    with metrics.bind(timing):
+        with metrics.stage('storage'):
+            with metrics.stage('encode'):  # Вложенный этап относится к внешнему.
+                pass
+            metrics.received(5)
+        metrics.sent(100)
+    with metrics.stage('send'):  # Вне запроса этапы не отмечаются.
+        pass
+    metrics.finish(timing)
+    metrics.notified(50)
+
+    statistics: dict = metrics.statistics()
+    update: dict = statistics['commands']['UPDATE']
+    assert (update['requests'], update['errors'], update['bytes_in'], update['bytes_out']) == (1, 0, 15, 100)
+    assert update['stages']['storage'] > 0 and update['stages']['encode'] == 0
+    assert update['latency']['count'] == 1
+    assert statistics['commands']['NOTIFY']['bytes_out'] == 50
+    assert set(statistics['commands']) == {'UPDATE', 'NOTIFY'}
+
+
+def test_render_text():
+    metrics = ServerMetrics()
+    metrics.connected()
+    metrics.rejected()
+    metrics.droppedSubscriber()
+    for _ in range(3):
+        metrics.finish(metrics.begin(Commands.ADD, 1))
+    statistics: dict = metrics.statistics()
+    statistics['cache'] = {'hits': 2}
+    lines: list[str] = render_text(statistics).splitlines()
+    assert 'phonebook_connections_active 1' in lines
+    assert 'phonebook_connections_rejected_total 1' in lines
+    assert 'phonebook_dropped_subscribers_total 1' in lines
+    assert 'phonebook_requests_total{command="ADD"} 3' in lines
+    assert 'phonebook_request_duration_seconds_bucket{command="ADD",le="+Inf"} 3' in lines
+    assert 'phonebook_cache{name="hits"} 2' in lines
+    buckets: list[int] = [int(line.rsplit(' ', 1)[1]) for line in lines if line.startswith('phonebook_request_duration_seconds_bucket')]
+    assert buckets == sorted(buckets) and len(buckets) == len(LATENCY_BOUNDS)  # Корзины накопительные.
+    assert all(not math.isnan(float(line.rsplit(' ', 1)[1])) for line in lines if not line.startswith('#'))
+
+
+def test_metrics_endpoint():
+    metrics = ServerMetrics()
+    endpoint = MetricsEndpoint(0, metrics.statistics)
+    endpoint.start()
+    try:
+        url: str = 'http://127.0.0.1:{0}'.format(endpoint.server_address[1])
+        with urllib.request.urlopen(url + MetricsEndpoint.PATH, timeout=10) as response:
+            assert response.status == 200
+            assert b'phonebook_uptime_seconds' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other', timeout=10)
+    finally:
+        endpoint.shutdown()
+        endpoint.server_close()
+
+
+def test_server_statistics(server):
+    server, port = server
+    with PhonebookClient(host='127.0.0.1', port=port) as client:
+        client.addContacts([make_contact(index) for index in range(10)])
+        statistics: dict = client.getStatistics()
+    commands: dict = statistics['commands']
+    assert commands['ADD']['requests'] == 10
+    assert commands['ADD']['bytes_out'] > 0
+    assert commands['HELLO']['requests'] == 1
+    assert statistics['connections']['active'] >= 1
+    assert 'hits' in statistics['cache'] and 'messages' in statistics['compression']
+    assert statistics['group_commit']['mutations'] == 10
+    assert 'phonebook_requests_total{command="ADD"} 10' in render_text(statistics)
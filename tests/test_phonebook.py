@@ -0,0 +1,142 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+import bulk
+from common import BatchOperation, BatchResult, BulkFormat, Contact, Delta, Filter, Query
+from conftest import make_contact
+from phonebook import AsyncPhonebookClient, ClientError, PhonebookClient, PhonebookClientPool
+
+
+def numbers_of(contacts: list[Contact]) -> list[str]:
+    return sorted(contact.number for contact in contacts)
+
+
+def test_client_requests(server):
+    server, port = server
+    notifications: list[Delta] = []
+    with PhonebookClient(host='127.0.0.1', port=port, on_notify=notifications.append) as client:
+        assert not client.connected
+        assert client.subscribe(Filter('note', 'заметка')).contacts == []
+        assert client.connected and client.handshake is not None
+        assert client.addContacts([make_contact(index) for index in range(50)]) == [True] * 50
+        assert numbers_of(client.getContacts()) == numbers_of([make_contact(index) for index in range(50)])
+        assert client.deleteContacts([make_contact(1), make_contact(1)]) == [True, False]
+        assert client.countContacts(Filter('name', 'Имя2')) == 11
+        page = client.getPage(Query(sort='number', limit=5))
+        assert (len(page.contacts), page.total) == (5, 49)
+        with pytest.raises(ClientError):
+            client.getPage(Query(sort='note'))
+        assert client.getChanges(revision=0).modified
+    assert sum(len(delta.inserted) + len(delta.deleted) for delta in notifications) == 51
+
+
+def test_client_import_and_export(server):
+    server, port = server
+    data: bytes = b''.join(bulk.encode_contacts([make_contact(index) for index in range(300)], BulkFormat.CSV))
+    with PhonebookClient(host='127.0.0.1', port=port) as client:
+        assert client.importFile(io.BytesIO(data), BulkFormat.CSV).imported == 300
+        file = io.BytesIO()
+        client.exportFile(file, BulkFormat.CSV, Filter('name', 'Имя1'))
+        assert len(file.getvalue().splitlines()) == 1 + 111  # Заголовок и контакты Имя1, Имя10.., Имя100...
+        assert client.getContacts(Filter('name', 'Имя299'))[0].number == make_contact(299).number
+
+
+def test_client_concurrent_calls(server):
+    # Запросы разных потоков передаются по одному соединению, и каждый поток получает свой ответ.
+    server, port = server
+    with PhonebookClient(host='127.0.0.1', port=port) as client:
+        client.addContacts([make_contact(index) for index in range(20)])
+        errors: list[str] = []
+
+        def work(index: int):
+            for _ in range(20):
+                contacts: list[Contact] = client.getContacts(Filter('number', make_contact(index).number))
+                if numbers_of(contacts) != [make_contact(index).number]:
+                    errors.append(make_contact(index).number)
+
+        threads: list[threading.Thread] = [threading.Thread(target=work, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+
+def test_client_reports_disconnect(server, monkeypatch):
+    server, port = server
+    monkeypatch.setattr(PhonebookClient, 'BACKOFF', 0.01)
+    disconnected = threading.Event()
+    client = PhonebookClient(host='127.0.0.1', port=port, attempts=2, on_disconnect=disconnected.set)
+    client.connect()
+    server.shutdown()
+    assert disconnected.wait(10)
+    assert not client.connected
+    with pytest.raises(ConnectionError):
+        client.getContacts()  # Повторное подключение не удаётся: сервер остановлен.
+    client.close()
+    with pytest.raises(ConnectionError):
+        client.getContacts()
+
+
+def test_client_pool(server):
+    server, port = server
+    clients: set[int] = set()
+    lock = threading.Lock()
+
+    def work(pool: PhonebookClientPool, index: int):
+        with pool.client() as client:
+            with lock:
+                clients.add(id(client))
+            assert client.addContact(make_contact(index))
+            assert client.deleteContact(make_contact(index, note='другая')) is False
+
+    with PhonebookClientPool(size=3, host='127.0.0.1', port=port) as pool:
+        threads: list[threading.Thread] = [threading.Thread(target=work, args=(pool, index)) for index in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with pool.client() as client:
+            assert numbers_of(client.getContacts()) == numbers_of([make_contact(index) for index in range(30)])
+    assert 1 <= len(clients) <= 3
+
+
+def test_async_client(server):
+    server, port = server
+
+    async def work():
+        notifications: list[Delta] = []
+        async with AsyncPhonebookClient(host='127.0.0.1', port=port, on_notify=notifications.append) as client:
+            await client.subscribe()
+            results: list[bool] = await asyncio.gather(*(client.addContact(make_contact(index)) for index in range(20)))
+            assert results == [True] * 20
+            assert await client.deleteContacts([make_contact(0), make_contact(0)]) == [True, False]
+            assert numbers_of(await client.getContacts()) == numbers_of([make_contact(index) for index in range(1, 20)])
+            assert await client.countContacts() == 19
+            with pytest.raises(ClientError):
+                await client.getPage(Query(sort='note'))
+
+            data = io.BytesIO()
+            await client.exportFile(data, BulkFormat.JSONL)
+            assert len(data.getvalue().splitlines()) == 19
+            assert (await client.importFile(io.BytesIO(data.getvalue()), BulkFormat.JSONL)).rejected == 19
+            while sum(len(delta.inserted) + len(delta.deleted) for delta in notifications) < 21:
+                await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(work(), 30))
+
+
+def test_client_batch(server):
+    server, port = server
+    with PhonebookClient(host='127.0.0.1', port=port) as client:
+        client.addContacts([make_contact(index) for index in range(5)])
+        result: BatchResult = client.applyBatch([BatchOperation.deleteMatching(Filter('name', 'Имя')), BatchOperation.insert(make_contact(1)),
+                                                 BatchOperation.delete(make_contact(2).number)])
+        assert (result.committed, result.results) == (False, [5, 1, 0])
+        assert len(client.getContacts()) == 5  # Атомарный пакет отменён целиком.
+        result = client.applyBatch([BatchOperation.deleteMatching(Filter('name', 'Имя')), BatchOperation.insert(make_contact(1))])
+        assert result.committed and result.revision == 11
+        assert numbers_of(client.getContacts()) == [make_contact(1).number]
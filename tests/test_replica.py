@@ -0,0 +1,57 @@
+import pytest
+
+from common import Contact, Snapshot
+from conftest import make_contact
+from replica import Replica
+
+
+def numbers_of(contacts: list[Contact]) -> list[str]:
+    return sorted(contact.number for contact in contacts)
+
+
+@pytest.fixture
+def replica_name(tmp_path) -> str:
+    return str(tmp_path / 'replica.db')
+
+
+def test_replica_follows_storage(storage, replica_name):
+    for index in range(10):
+        storage.insert(make_contact(index))
+    replica = Replica('server', replica_name)
+    assert (replica.revision, replica.contacts) == (None, [])
+    replica.replace(storage.getSnapshot(None))
+    revision: int = storage.getRevision()
+
+    storage.insert(make_contact(10))
+    storage.delete(make_contact(3))
+    replica.apply(storage.getChanges(revision, None))
+    expected: list[str] = numbers_of(storage.getSnapshot(None).contacts)
+    assert numbers_of(replica.contacts) == expected
+    replica.apply(storage.getChanges(revision, None))  # Уже учтённые изменения ничего не меняют.
+    assert replica.revision == storage.getRevision()
+    replica.close()
+
+    # Копия загружается при следующем запуске, но только для того же сервера.
+    reopened = Replica('server', replica_name)
+    assert reopened.revision == storage.getRevision()
+    assert numbers_of(reopened.contacts) == expected
+    assert [vars(contact) for contact in reopened.contacts if contact.number == make_contact(10).number] == [vars(make_contact(10))]
+    reopened.close()
+    other = Replica('other', replica_name)
+    assert (other.revision, other.contacts) == (None, [])
+    other.close()
+
+
+def test_replica_rejects_gap(storage, replica_name):
+    replica = Replica('server', replica_name)
+    with pytest.raises(ValueError):
+        replica.apply(storage.getChanges(0, None))  # Копии ещё нет.
+    replica.replace(Snapshot(revision=0, contacts=[]))
+    for index in range(3):
+        storage.insert(make_contact(index))
+    with pytest.raises(ValueError):
+        replica.apply(storage.getChanges(1, None))  # Пропущено изменение ревизии 1.
+    assert replica.revision == 0
+    replica.apply(storage.getChanges(0, None))
+    assert numbers_of(replica.contacts) == numbers_of([make_contact(index) for index in range(3)])
+    replica.close()
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from common import Contact, Filter
+from conftest import make_contact
+from search import FieldIndex, SearchCache
+
+
+def numbers_of(contacts: list[Contact]) -> list[str]:
+    return [contact.number for contact in contacts]
+
+
+CONTACTS: list[Contact] = [make_contact(index, surname=surname, note=note) for index, (surname, note) in enumerate([
+    ('Иванов', 'ааа'), ('Петров', None), ('Иванова', ''), ('Сидоров', 'аа'), ('Ив', 'а'), ('Иванов', 'ааа')])]
+
+
+@pytest.mark.parametrize('field, text', [('surname', 'Ив'), ('surname', 'ов'), ('surname', 'Иванова'), ('surname', 'x'),
+                                         ('note', 'а'), ('note', 'аа'), ('number', '+70'), ('name', '5')])
+def test_field_index(field, text):
+    expected: list[int] = [row for row, contact in enumerate(CONTACTS) if Filter(field, text).match(contact)]
+    assert FieldIndex(CONTACTS, field).find(text) == expected
+    assert FieldIndex([], field).find(text) == []
+
+
+def test_search_cache_narrows_results():
+    rng = random.Random(1)
+    contacts: list[Contact] = [make_contact(index, surname=rng.choice(['Иванов', 'Иванова', 'Петров', 'Сидоров']),
+                                            note=rng.choice([None, '', 'работа', 'дом'])) for index in range(500)]
+    cache = SearchCache(size=4)
+    cache.reset(Filter('surname', 'ов'), [contact for contact in contacts if Filter('surname', 'ов').match(contact)])
+    assert cache.covers(Filter('surname', 'Иванов')) and not cache.covers(Filter('surname', 'о'))
+    assert not cache.covers(Filter('note', 'дом')) and not cache.covers(None)
+    assert cache.search(Filter('note', 'дом')) is None
+    assert cache.misses == 1
+
+    # Набор текста: каждый следующий фильтр уточняет предыдущий.
+    for text in ['ов', 'нов', 'анов', 'ванов', 'Иванов', 'Иванова', 'ова']:
+        found: list[Contact] = cache.search(Filter('surname', text))
+        assert numbers_of(found) == numbers_of([contact for contact in cache.contacts if Filter('surname', text).match(contact)])
+    assert cache.search(Filter('surname', 'Ив')) is None  # Не уточняет фильтр данных.
+    assert (cache.hits, cache.misses) == (7, 2)
+
+    cache.reset(None, contacts)
+    for filter in [Filter('note', 'р'), Filter('note', 'рабо'), Filter('note', ''), Filter('number', '+7000000001'), None]:
+        assert numbers_of(cache.search(filter)) == numbers_of([contact for contact in contacts if filter is None or filter.match(contact)])
+
+
+def test_search_cache_keeps_recent_results():
+    cache = SearchCache(size=2)
+    cache.reset(None, CONTACTS)
+    for text in ['И', 'П', 'С']:
+        cache.search(Filter('surname', text))
+    hits: int = cache.hits
+    assert numbers_of(cache.search(Filter('surname', 'С'))) == [make_contact(3).number]
+    assert cache.search(Filter('surname', 'И')) is not None  # Вытесненный результат вычисляется по данным.
+    assert cache.hits == hits + 2
+    assert len(cache._SearchCache__results) == 3  # Два последних результата и данные.
@@ -0,0 +1,337 @@
+import io
+import socket
+import threading
+import time
+
+import pytest
+
+import bulk
+from common import (BulkFormat, BulkImport, ClientRequest, Commands, Compression, Contact, Delta, Filter, Handshake, Page, ProtocolError, Query,
+                    ServerResponse, UpdateRequest, WireFormat, decode_object, encode_object, is_compressed, receive_message,
+                    receive_object, send_object, wire_format)
+from conftest import make_contact
+from phonebook import PhonebookClient
+from server import ClientConnection
+
+
+@pytest.fixture
+def subscriptions(handler):
+    return handler.subscriptions
+
+
+def call(sock: socket.socket, request: ClientRequest) -> ServerResponse:
+    send_object(sock, request)
+    return receive_object(sock)
+
+
+@pytest.fixture
+def connect():
+    """Создаёт подключение ClientConnection и возвращает его вместе с сокетом клиента."""
+    sockets: list[socket.socket] = []
+    connections: list[ClientConnection] = []
+
+    def __connect() -> tuple[ClientConnection, socket.socket]:
+        server_socket, client_socket = socket.socketpair()
+        sockets.extend((server_socket, client_socket))
+        connections.append(ClientConnection(server_socket, None))
+        return connections[-1], client_socket
+
+    yield __connect
+    for connection in connections:
+        connection.close()
+    for sock in sockets:
+        sock.close()
+
+
+def test_notifications_follow_subscription_filter(storage, subscriptions, connect):
+    everything, everything_socket = connect()
+    filtered, filtered_socket = connect()
+    subscriptions.subscribe(everything, None)
+    subscriptions.subscribe(filtered, Filter('surname', 'Пет'))
+
+    storage.insert(make_contact(1, surname='Иванов'))
+    storage.insert(make_contact(2, surname='Петров'))
+    storage.delete(make_contact(1, surname='Иванов'))
+
+    received: list[Delta] = []
+    for _ in range(3):
+        response: ServerResponse = receive_object(everything_socket)
+        assert response.command == Commands.NOTIFY
+        received.append(response.data)
+    assert [(delta.since, delta.revision) for delta in received] == [(0, 1), (1, 2), (2, 3)]
+    assert [contact.number for contact in received[2].deleted] == [make_contact(1).number]
+
+    # Изменение, не удовлетворяющее фильтру, не отправляется, но следующая Delta начинается с его ревизии.
+    delta: Delta = receive_object(filtered_socket).data
+    assert (delta.since, delta.revision) == (1, 2)
+    assert [contact.number for contact in delta.inserted] == [make_contact(2).number]
+
+
+def test_lagging_subscriber_is_dropped(storage, handler, subscriptions, connect):
+    # Клиент, не принимающий уведомлений, не задерживает изменения: его подключение разрывается.
+    lagging, lagging_socket = connect()
+    lagging.MAX_PENDING = 4096
+    lagging.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    good, good_socket = connect()
+    subscriptions.subscribe(lagging, None)
+    subscriptions.subscribe(good, None)
+
+    revisions: list[int] = []
+    reader = threading.Thread(target=lambda: revisions.extend(receive_object(good_socket).data.revision for _ in range(300)))
+    reader.start()
+    started: float = time.monotonic()
+    for index in range(300):
+        storage.insert(make_contact(index, note='x' * 500))
+    assert time.monotonic() - started < 10
+    assert list(subscriptions._Subscriptions__subscriptions) == [good]
+    assert handler.metrics.statistics()['dropped_subscribers'] == 1
+
+    reader.join()
+    assert revisions == list(range(1, 301))
+    lagging_socket.settimeout(10)
+    while receive_object(lagging_socket) is not None:  # После принятых уведомлений соединение закрыто.
+        pass
+
+
+def test_cached_responses_follow_changes(storage, handler, connect):
+    connection, client_socket = connect()
+
+    def update(data) -> ServerResponse:
+        return decode_object(handler.process(connection, ClientRequest(command=Commands.UPDATE, data=data)))
+
+    storage.insert(make_contact(1))
+    assert [contact.number for contact in update(None).data] == [make_contact(1).number]
+    assert update(Filter()).data == update(None).data  # Фильтр без ограничений использует тот же ответ.
+    assert update(UpdateRequest()).data.revision == 1
+    storage.insert(make_contact(2))
+    assert len(update(None).data) == 2
+    assert update(UpdateRequest()).data.revision == 2
+    delta: Delta = update(UpdateRequest(revision=1)).data  # Delta не кэшируется.
+    assert [contact.number for contact in delta.inserted] == [make_contact(2).number]
+    statistics: dict[str, int] = handler.cache.statistics()
+    assert (statistics['hits'], statistics['misses']) == (2, 4)
+
+
+def test_paged_update(storage, handler, connect):
+    connection, client_socket = connect()
+
+    def update(query: Query) -> ServerResponse:
+        return decode_object(handler.process(connection, ClientRequest(command=Commands.UPDATE, data=query)))
+
+    for index in range(5):
+        storage.insert(make_contact(index))
+    first: Page = update(Query(limit=3)).data
+    assert ([contact.number for contact in first.contacts], first.total) == ([make_contact(index).number for index in range(3)], 5)
+    second: Page = update(Query(limit=3, cursor=first.cursor)).data
+    assert [contact.number for contact in second.contacts] == [make_contact(index).number for index in (3, 4)]
+    assert second.cursor is None
+    assert update(Query(limit=3)).data.contacts[0].number == first.contacts[0].number
+    assert handler.cache.statistics()['hits'] == 1
+
+    rejected: ServerResponse = update(Query(sort='name', cursor=first.cursor))  # Курсор другой сортировки.
+    assert not rejected.flag and isinstance(rejected.data, str)
+
+
+def test_requests_and_notifications(server):
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as subscriber, socket.create_connection(('127.0.0.1', port)) as writer:
+        subscribed: ServerResponse = call(subscriber, ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest()))
+        assert (subscribed.command, subscribed.data.revision, subscribed.data.contacts) == (Commands.SUBSCRIBE, 0, [])
+        assert call(writer, ClientRequest(command=Commands.ADD, data=make_contact(1))).flag
+        assert not call(writer, ClientRequest(command=Commands.DELETE, data=make_contact(2))).flag
+        notification: ServerResponse = receive_object(subscriber)
+        assert notification.command == Commands.NOTIFY
+        assert [contact.number for contact in notification.data.inserted] == [make_contact(1).number]
+        phonebook: ServerResponse = call(writer, ClientRequest(command=Commands.UPDATE, data=None))
+        assert [vars(contact) for contact in phonebook.data] == [vars(make_contact(1))]
+
+
+def test_pipelined_requests(server):
+    # Запросы с идентификаторами отправляются подряд; ADD выполняется только после всех предыдущих запросов.
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        for id in range(1, 21):
+            send_object(client, ClientRequest(command=Commands.UPDATE, data=Filter('name', str(id)), id=id))
+        send_object(client, ClientRequest(command=Commands.ADD, data=make_contact(1), id=21))
+        for id in range(22, 42):
+            send_object(client, ClientRequest(command=Commands.UPDATE, data=None, id=id))
+        send_object(client, ClientRequest(command=Commands.UPDATE, data=None))
+
+        responses: list[ServerResponse] = [receive_object(client) for _ in range(42)]
+        ids: list[int | None] = [response.id for response in responses]
+        assert sorted(ids[:-1]) == list(range(1, 42)) and ids[-1] is None
+        assert set(ids[:ids.index(21)]) == set(range(1, 21))
+        assert all(response.flag for response in responses)
+        assert all(len(response.data) == (response.id is None or response.id > 21) for response in responses
+                   if response.command == Commands.UPDATE)
+
+
+def test_failed_request_gets_response(server, handler, monkeypatch):
+    # Исключение при выполнении запроса не оставляет его без ответа ни в пуле потоков, ни при последовательном выполнении.
+    def fail(*args):
+        raise RuntimeError('сбой хранилища')
+
+    server, port = server
+    monkeypatch.setattr(handler.storage, 'getFilteredPhones', fail)
+    monkeypatch.setattr(handler.storage, 'insert', fail)
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        send_object(client, ClientRequest(command=Commands.UPDATE, data=Filter('name', 'Имя'), id=1))
+        send_object(client, ClientRequest(command=Commands.ADD, data=make_contact(1), id=2))
+        responses: dict[int, ServerResponse] = {response.id: response for response in (receive_object(client) for _ in range(2))}
+        assert sorted(responses) == [1, 2]
+        for id, command in ((1, Commands.UPDATE), (2, Commands.ADD)):
+            assert (responses[id].command, responses[id].flag) == (command, False)
+            assert 'сбой хранилища' in responses[id].data
+        assert call(client, ClientRequest(command=Commands.UPDATE, data=UpdateRequest())).flag
+
+
+def test_add_reports_duplicate(server):
+    server, port = server
+    with PhonebookClient(host='127.0.0.1', port=port) as client:
+        assert client.addContact(make_contact(1))
+        assert not client.addContact(make_contact(1, note='другая заметка'))
+        assert client.addContacts([make_contact(1), make_contact(2), make_contact(2)]) == [False, True, False]
+
+
+def test_malformed_contact_keeps_connection(server):
+    # Ошибка в данных запроса не прерывает подключение: клиент получает ответ с описанием ошибки.
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        for command in (Commands.ADD, Commands.DELETE):
+            response: ServerResponse = call(client, ClientRequest(command=command, data=Contact('Имя', 'Фамилия', 'Отчество', '', None)))
+            assert (response.command, response.flag) == (command, False)
+            assert 'номер' in response.data
+        assert call(client, ClientRequest(command=Commands.ADD, data=make_contact(1))).flag
+
+
+@pytest.mark.parametrize('command, data', [(Commands.UPDATE, Filter('phone', '1')), (Commands.UPDATE, UpdateRequest(Filter('phone', '1'))),
+                                           (Commands.UPDATE, UpdateRequest(Filter('phone', '1'), revision=0)),
+                                           (Commands.UPDATE, Query(filter=Filter('phone', '1'))), (Commands.SUBSCRIBE, UpdateRequest(Filter('phone', '1')))])
+def test_invalid_filter_keeps_connection(server, command, data):
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        response: ServerResponse = call(client, ClientRequest(command=command, data=data))
+        assert (response.command, response.flag) == (command, False)
+        assert isinstance(response.data, str)
+        assert call(client, ClientRequest(command=Commands.ADD, data=make_contact(1))).flag
+        response = call(client, ClientRequest(command=Commands.UPDATE, data=None))  # Подписка не оформлена: уведомления нет.
+        assert (response.command, response.flag) == (Commands.UPDATE, True)
+
+
+def test_invalid_field_type_is_protocol_error(server, handler):
+    # Запрос с полем недопустимого типа не выполняется: подключение закрывается как при любой ошибке протокола.
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        client.settimeout(10)
+        send_object(client, ClientRequest(command=Commands.UPDATE, data=UpdateRequest(Filter('surname', 5))))
+        assert receive_object(client) is None
+    assert handler.metrics.statistics()['protocol_errors'] == 1
+
+
+def test_connection_limit(server):
+    server, port = server
+    clients: list[socket.socket] = [socket.create_connection(('127.0.0.1', port)) for _ in range(5)]
+    try:
+        for client in clients:  # Все подключения в пределах лимита обслуживаются.
+            assert call(client, ClientRequest(command=Commands.UPDATE, data=None)).flag
+        with socket.create_connection(('127.0.0.1', port)) as extra:
+            extra.settimeout(10)
+            assert receive_object(extra) is None  # Подключение сверх лимита сразу закрывается.
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_shutdown_disconnects_clients(server):
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        assert call(client, ClientRequest(command=Commands.ADD, data=make_contact(1))).flag
+        server.shutdown()
+        client.settimeout(10)
+        assert receive_object(client) is None
+    server.shutdown()  # Повторная остановка ничего не делает.
+
+
+def test_bulk_upload_and_download(server):
+    server, port = server
+    data: bytes = b''.join(bulk.encode_contacts([make_contact(index) for index in range(3000)], BulkFormat.JSONL))
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        response: ServerResponse = bulk.upload(client, io.BytesIO(data), BulkFormat.JSONL)
+        assert response.flag
+        assert (response.data.imported, response.data.rejected) == (3000, 0)
+        file = io.BytesIO()
+        assert bulk.download(client, file, BulkFormat.JSONL).flag
+        assert sorted(file.getvalue().splitlines()) == sorted(data.splitlines())
+
+        response = bulk.upload(client, io.BytesIO(b'name,surname\na,b\n'), BulkFormat.CSV)
+        assert not response.flag  # Ошибка в заголовке: оставшиеся фрагменты пропущены, соединение работает.
+        assert call(client, ClientRequest(command=Commands.DELETE, data=make_contact(0))).flag
+
+
+def test_request_during_bulk_import_is_rejected(server):
+    # Запрос между фрагментами загрузки получает ответ с ошибкой, а загрузка отменяется целиком.
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        send_object(client, ClientRequest(command=Commands.BULK_IMPORT, data=BulkImport(BulkFormat.CSV)))
+        send_object(client, ClientRequest(command=Commands.BULK_IMPORT, data=b'name,surname,patronymic,number,note\na,b,c,+1,d\n'))
+        send_object(client, ClientRequest(command=Commands.ADD, data=make_contact(1), id=7))
+        send_object(client, ClientRequest(command=Commands.BULK_IMPORT, data=b'a,b,c,+2,d\n'))
+        send_object(client, ClientRequest(command=Commands.BULK_IMPORT, data=b''))
+
+        rejected: ServerResponse = receive_object(client)
+        assert (rejected.id, rejected.command, rejected.flag) == (7, Commands.ADD, False)
+        report: ServerResponse = receive_object(client)
+        assert (report.command, report.flag) == (Commands.BULK_IMPORT, False)
+        assert 'ADD' in report.data
+
+        # Соединение остаётся в рабочем состоянии, а из загрузки ничего не добавлено.
+        assert call(client, ClientRequest(command=Commands.UPDATE, data=None)).data == []
+
+
+def test_response_follows_client_format(server, handler):
+    # Клиент предыдущей версии (pickle) получает ответы и уведомления в своём формате.
+    server, port = server
+    handler.allow_pickle = True
+    with socket.create_connection(('127.0.0.1', port)) as old, socket.create_connection(('127.0.0.1', port)) as new:
+        send_object(old, ClientRequest(command=Commands.SUBSCRIBE, data=UpdateRequest()), WireFormat.PICKLE)
+        assert wire_format(receive_message(old)) == WireFormat.PICKLE
+        assert call(new, ClientRequest(command=Commands.ADD, data=make_contact(1))).flag
+        notification: bytes = receive_message(old)
+        assert wire_format(notification) == WireFormat.PICKLE
+        assert decode_object(notification).command == Commands.NOTIFY
+        send_object(new, ClientRequest(command=Commands.UPDATE, data=None))
+        assert wire_format(receive_message(new)) == WireFormat.BINARY
+
+
+def test_pickle_rejected_by_default(server, handler):
+    # Без allow_pickle сообщение pickle считается ошибкой протокола: подключение закрывается без выполнения запроса.
+    with pytest.raises(ProtocolError):
+        handler.decode(None, encode_object(ClientRequest(command=Commands.UPDATE), WireFormat.PICKLE))
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        client.settimeout(10)
+        send_object(client, ClientRequest(command=Commands.ADD, data=make_contact(1)), WireFormat.PICKLE)
+        assert receive_object(client) is None
+    assert handler.storage.getRevision() == 0
+
+
+@pytest.mark.parametrize('offer, threshold, expected', [
+    ([Compression.LZMA, Compression.ZLIB], 100, Compression.LZMA),
+    ([Compression.NONE], 100, Compression.NONE),
+    ([], 100000, Compression.NONE),
+])
+def test_handshake(server, offer, threshold, expected):
+    server, port = server
+    with socket.create_connection(('127.0.0.1', port)) as client:
+        hello: ServerResponse = call(client, ClientRequest(command=Commands.HELLO, data=Handshake(offer, threshold=threshold)))
+        assert hello.flag
+        assert hello.data.compression == [expected]
+        assert hello.data.threshold == max(threshold, Handshake.THRESHOLD)  # Порог не меньше порога сервера.
+
+        for index in range(200):
+            send_object(client, ClientRequest(command=Commands.ADD, data=make_contact(index)))
+            assert not is_compressed(receive_message(client))  # Короткие подтверждения не сжимаются.
+        send_object(client, ClientRequest(command=Commands.UPDATE, data=None))
+        data: bytes = receive_message(client)
+        assert is_compressed(data) == (expected != Compression.NONE)
+        assert len(decode_object(data).data) == 200
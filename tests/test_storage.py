@@ -0,0 +1,466 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from common import BatchOperation, BatchRequest, Commands, Contact, Delta, Filter, ImportReport, Query
+from conftest import make_contact, open_storage
+from storage import DatabaseConnection, MemoryStorage, Storage
+
+
+def numbers_of(contacts: list[Contact]) -> list[str]:
+    return sorted(contact.number for contact in contacts)
+
+
+def test_delta_collapses_changes(storage):
+    for index in range(3):
+        assert storage.insert(make_contact(index))
+    revision: int = storage.getRevision()
+    assert revision == 3
+    assert storage.insert(make_contact(10))
+    assert storage.delete(make_contact(0))
+    assert storage.insert(make_contact(11))  # Добавлен и удалён после revision: в Delta не попадает.
+    assert storage.delete(make_contact(11))
+    assert not storage.insert(make_contact(1))  # Номер уже занят: ревизия не меняется.
+    assert not storage.delete(make_contact(12))
+
+    delta: Delta = storage.getChanges(revision, None)
+    assert (delta.since, delta.revision) == (revision, revision + 4)
+    assert numbers_of(delta.inserted) == [make_contact(10).number]
+    assert numbers_of(delta.deleted) == [make_contact(0).number]
+
+    snapshot = storage.getSnapshot(None)
+    assert snapshot.revision == revision + 4
+    phonebook: list[Contact] = [make_contact(index) for index in range(3)]
+    assert numbers_of(delta.apply(phonebook)) == numbers_of(snapshot.contacts)
+
+
+def test_delta_not_modified_and_filtered(storage):
+    storage.insert(make_contact(1, surname='Петров'))
+    revision: int = storage.getRevision()
+    assert not storage.getChanges(revision, None).modified
+    storage.insert(make_contact(2, surname='Иванов'))
+    storage.insert(make_contact(3, surname='Петров'))
+    delta: Delta = storage.getChanges(revision, Filter('surname', 'Пет'))
+    assert delta.revision == revision + 2  # Ревизия сдвигается и изменениями, не удовлетворяющими фильтру.
+    assert numbers_of(delta.inserted) == [make_contact(3).number]
+
+
+@pytest.mark.parametrize('filter', [Filter('phone', 'Пет'), Filter('surname', 5), 'surname'])
+def test_delta_rejects_invalid_filter(storage, filter):
+    # Фильтр проверяется и тогда, когда изменений нет.
+    with pytest.raises(ValueError):
+        storage.getChanges(storage.getRevision(), filter)
+    storage.insert(make_contact(1))
+    with pytest.raises(ValueError):
+        storage.getChanges(0, filter)
+    with pytest.raises(ValueError):
+        storage.getSnapshot(filter)
+
+
+@pytest.mark.parametrize('kind', ['sqlite', 'memory'])
+def test_delta_unavailable(kind, tmp_path, monkeypatch):
+    # Ревизии, для которых журнал уже не содержит изменений (или которых ещё нет), требуют полного снимка.
+    monkeypatch.setattr(Storage, 'CHANGELOG_SIZE', 3)
+    storage: Storage = open_storage(kind, tmp_path)
+    for index in range(6):
+        storage.insert(make_contact(index))
+    assert storage.getChanges(1, None) is None
+    assert storage.getChanges(3, None).revision == 6
+    assert storage.getChanges(7, None) is None
+    storage.close()
+
+
+def test_delta_apply_replaces_contact():
+    phonebook: list[Contact] = [make_contact(1), make_contact(2)]
+    edited: Contact = make_contact(2, note='другая')
+    delta = Delta(since=1, revision=3, inserted=[edited], deleted=[make_contact(1)])
+    assert [vars(contact) for contact in delta.apply(phonebook)] == [vars(edited)]
+
+
+def test_connection_pool(database):
+    with database.connection() as first:
+        assert first.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+        with database.connection() as second:  # Занятое подключение не выдаётся повторно.
+            assert second is not first
+    with database.connection() as again:
+        assert again is first  # Последнее возвращённое подключение выдаётся первым.
+
+
+def test_pool_rolls_back_open_transaction(database):
+    with database.connection() as connection:
+        connection.execute('INSERT INTO {0} (name, surname, patronymic, number, note) VALUES (?, ?, ?, ?, ?);'.format(database.TABLE),
+                           ('a', 'b', 'c', '+1', 'd'))
+        assert connection.in_transaction
+    with database.connection() as connection:
+        assert not connection.in_transaction
+    assert database.getPhones() == []
+
+
+def test_pool_is_bounded(tmp_path):
+    storage = DatabaseConnection(str(tmp_path / 'phonebook.db'), pool_size=2)
+    storage.createDatabase()
+    contexts = [storage.connection() for _ in range(4)]
+    connections: list[sqlite3.Connection] = [context.__enter__() for context in contexts]
+    for context in contexts:
+        context.__exit__(None, None, None)
+    connections[1].execute('SELECT 1;')
+    with pytest.raises(sqlite3.ProgrammingError):  # Подключения сверх размера пула закрыты.
+        connections[2].execute('SELECT 1;')
+    storage.close()
+
+
+SEARCH_CONTACTS: list[Contact] = [
+    Contact(name='Анна', surname='Иванова', patronymic='Петровна', number='+70000000001', note='звонить после 18:00'),
+    Contact(name='анна', surname='Иванов', patronymic='Петрович', number='+70000000002', note=None),
+    Contact(name='Пётр', surname='О\'Брайен', patronymic='Джон', number='+70000000003', note='сказал "да"'),
+    Contact(name='Олег', surname='Смирнов', patronymic='Ильич', number='+70000000004', note='скидка 10% * 2?'),
+    Contact(name='Ольга', surname='Кузнецова', patronymic='Ивановна', number='+70000000005', note='a_b'),
+]
+
+
+@pytest.mark.parametrize('field, text', [
+    ('name', 'Анна'), ('name', 'анна'), ('name', 'нн'), ('name', 'О'), ('surname', 'Иванов'), ('surname', '\'Бр'),
+    ('surname', 'ова'), ('patronymic', 'Иван'), ('number', '0000000'), ('number', '5'), ('note', '"да"'),
+    ('note', '10%'), ('note', '* 2?'), ('note', '_'), ('note', 'a_b'), ('note', 'нет такого'),
+])
+def test_search_matches_filter(storage, field, text):
+    # Поиск по индексу (и перебором для коротких строк) совпадает с поиском подстроки с учётом регистра.
+    for contact in SEARCH_CONTACTS:
+        assert storage.insert(contact)
+    filter = Filter(field, text)
+    expected: list[str] = numbers_of([contact for contact in SEARCH_CONTACTS if filter.match(contact)])
+    assert numbers_of(storage.getFilteredPhones(filter)) == expected
+
+
+def test_search_index_follows_changes(storage):
+    for contact in SEARCH_CONTACTS:
+        assert storage.insert(contact)
+    assert storage.delete(SEARCH_CONTACTS[0])
+    assert numbers_of(storage.getFilteredPhones(Filter('name', 'Анна'))) == []
+    assert storage.insert(make_contact(1, surname='Иванова'))
+    assert numbers_of(storage.getFilteredPhones(Filter('surname', 'Иванова'))) == [make_contact(1).number]
+
+
+def test_search_index_is_built_for_existing_database(database):
+    for contact in SEARCH_CONTACTS:
+        assert database.insert(contact)
+    with database.connection() as connection:
+        for action in ('insert', 'delete', 'update'):
+            connection.execute('DROP TRIGGER {0}_{1};'.format(database.TABLE, action))
+        connection.execute('DROP TABLE {0};'.format(database.SEARCH_TABLE))
+        connection.commit()
+    database.createDatabase()
+    assert numbers_of(database.getFilteredPhones(Filter('surname', 'Иванов'))) == ['+70000000001', '+70000000002']
+
+
+def test_search_rejects_unknown_field(storage):
+    with pytest.raises(ValueError):
+        storage.getFilteredPhones(Filter('rowid', 'x'))
+
+
+def test_atomic_batch_rollback(storage):
+    existing: Contact = make_contact(1)
+    storage.insert(existing)
+    revision: int = storage.getRevision()
+    notifications: list = []
+    storage.addListener(lambda operation, contacts, revision: notifications.append(revision))
+
+    # Последняя операция невыполнима (номер занят), поэтому не выполняется весь пакет.
+    result = storage.applyBatch(BatchRequest([BatchOperation.insert(make_contact(2)), BatchOperation.delete(existing.number),
+                                              BatchOperation.insert(make_contact(3)), BatchOperation.insert(make_contact(2))]))
+    assert not result.committed
+    assert result.results == [1, 1, 1, 0]
+    assert result.failed == [3]
+    assert result.revision == revision == storage.getRevision()
+    assert notifications == []
+    assert numbers_of(storage.getSnapshot(None).contacts) == [existing.number]
+
+
+def test_non_atomic_batch_skips_failed_operations(storage):
+    storage.insert(make_contact(1))
+    edited: Contact = make_contact(1, note='другая заметка')
+    result = storage.applyBatch(BatchRequest([BatchOperation.insert(make_contact(2)), BatchOperation.delete('+0'),
+                                              BatchOperation.upsert(edited), BatchOperation.insert(make_contact(2))], atomic=False))
+    assert result.committed
+    assert result.results == [1, 0, 1, 0]
+    assert result.revision == storage.getRevision()
+    contacts: dict[str, Contact] = {contact.number: contact for contact in storage.getSnapshot(None).contacts}
+    assert sorted(contacts) == [make_contact(1).number, make_contact(2).number]
+    assert contacts[edited.number].note == edited.note
+
+
+def test_batch_rollback_on_commit_error(tmp_path, monkeypatch):
+    # Ошибка после выполнения части запросов транзакции не должна оставить в базе ни одного изменения пакета.
+    storage: DatabaseConnection = open_storage('sqlite', tmp_path)
+    storage.insert(make_contact(1))
+    revision: int = storage.getRevision()
+
+    def fail(*args):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, '_DatabaseConnection__trimChangelog', fail)
+        with pytest.raises(sqlite3.OperationalError):
+            storage.applyBatch(BatchRequest([BatchOperation.insert(make_contact(2)), BatchOperation.delete(make_contact(1).number)]))
+    assert storage.getRevision() == revision
+    assert numbers_of(storage.getSnapshot(None).contacts) == [make_contact(1).number]
+    assert storage.getChanges(revision, None).modified is False
+    storage.close()
+
+
+def test_concurrent_group_commit(storage):
+    storage.group_delay = 0.01  # Чтобы изменения разных потоков успевали объединиться в группы.
+    contacts: list[Contact] = [make_contact(index) for index in range(40)]
+    notifications: list[tuple[Commands, list[str], int]] = []
+    storage.addListener(lambda operation, changed, revision: notifications.append((operation, numbers_of(changed), revision)))
+    threads_count: int = 6
+    results: dict[tuple[str, int, str], bool] = {}  # (операция, поток, номер) → результат вызова.
+    barrier = threading.Barrier(threads_count)
+
+    def work(thread: int):
+        order: list[Contact] = contacts[:]
+        random.Random(thread).shuffle(order)
+        barrier.wait()
+        for contact in order:
+            results['add', thread, contact.number] = storage.insert(contact)
+        barrier.wait()
+        for contact in order:
+            results['delete', thread, contact.number] = storage.delete(contact)
+
+    threads: list[threading.Thread] = [threading.Thread(target=work, args=(thread,)) for thread in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Каждый номер добавлен и удалён ровно одним из потоков, остальные получили False.
+    for operation in ('add', 'delete'):
+        for contact in contacts:
+            assert sum(results[operation, thread, contact.number] for thread in range(threads_count)) == 1
+    assert storage.getSnapshot(None).contacts == []
+    assert storage.getRevision() == 2 * len(contacts)
+
+    statistics: dict = storage.groupStatistics()
+    assert statistics['mutations'] == 2 * threads_count * len(contacts)
+    assert statistics['largest'] > 1
+
+    # Уведомления идут по возрастанию ревизий, и каждое выполненное изменение попадает ровно в одно уведомление.
+    revisions: list[int] = [revision for operation, changed, revision in notifications]
+    assert revisions == sorted(set(revisions))
+    added: list[str] = [number for operation, changed, revision in notifications if operation == Commands.ADD for number in changed]
+    deleted: list[str] = [number for operation, changed, revision in notifications if operation == Commands.DELETE for number in changed]
+    assert sorted(added) == sorted(deleted) == numbers_of(contacts)
+    assert sum(len(changed) for operation, changed, revision in notifications) == revisions[-1]
+
+
+@pytest.mark.parametrize('contact', [None, Contact('Имя', 'Фамилия', 'Отчество', 5, 'заметка'),
+                                     Contact('Имя', None, 'Отчество', '5', 'заметка'), Contact('Имя', 'Фамилия', 'Отчество', '', None)])
+def test_malformed_mutation_rejected(storage, contact):
+    # Некорректный контакт отклоняется до постановки в очередь групповой фиксации.
+    with pytest.raises(ValueError):
+        storage.insert(contact)
+    with pytest.raises(ValueError):
+        storage.delete(contact)
+    assert storage.getRevision() == 0
+    assert storage.insert(make_contact(1))
+
+
+def test_group_commit_reports_errors_per_mutation(tmp_path):
+    # Изменение, которое база данных не принимает, завершается ошибкой, остальные изменения группы фиксируются.
+    storage: DatabaseConnection = open_storage('sqlite', tmp_path)
+    storage.group_delay = 0.05
+    contacts: list[Contact] = [make_contact(index) for index in range(5)]
+    contacts.insert(2, Contact('Имя', 'Фамилия', 'Отчество', '\ud800', 'заметка'))  # Строку с одиночным суррогатом нельзя передать в SQLite.
+    results: dict[str, bool | Exception] = {}
+
+    def work(contact: Contact):
+        try:
+            results[contact.number] = storage.insert(contact)
+        except ValueError as error:
+            results[contact.number] = error
+
+    threads: list[threading.Thread] = [threading.Thread(target=work, args=(contact,)) for contact in contacts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert isinstance(results.pop('\ud800'), ValueError)
+    assert all(result is True for result in results.values())
+    assert numbers_of(storage.getSnapshot(None).contacts) == numbers_of(contacts[:2] + contacts[3:])
+    assert storage.getRevision() == 5
+
+
+def test_concurrent_group_commit_delta(storage):
+    # Delta между ревизиями, полученными вызывающими потоками, совпадает с фактическими изменениями.
+    storage.group_delay = 0.01
+    revision: int = storage.getRevision()
+    threads: list[threading.Thread] = [threading.Thread(target=storage.insert, args=(make_contact(index),)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    delta = storage.getChanges(revision, None)
+    assert delta.revision == storage.getRevision() == revision + 20
+    assert sorted(numbers_of(delta.inserted)) == numbers_of([make_contact(index) for index in range(20)])
+
+
+def test_memory_storage_recovery(tmp_path):
+    storage: MemoryStorage = open_storage('memory', tmp_path)
+    storage.snapshot_interval = 10  # Часть изменений попадает в снимок, остальные остаются в журнале.
+    for index in range(45):
+        assert storage.insert(make_contact(index, note=None if index % 5 == 0 else 'заметка'))
+    for index in range(1, 45, 4):  # Контакт с пустой заметкой удалить нельзя, как и в базе данных.
+        assert storage.delete(make_contact(index)) == (index % 5 != 0)
+    expected: list[dict] = sorted((vars(contact) for contact in storage.getSnapshot(None).contacts), key=lambda contact: contact['number'])
+    revision: int = storage.getRevision()
+    storage.close()
+    assert os.path.exists(tmp_path / 'phonebook.snapshot')
+    assert os.path.getsize(tmp_path / 'phonebook.log') > 0
+
+    recovered: MemoryStorage = open_storage('memory', tmp_path)
+    assert recovered.getRevision() == revision
+    assert sorted((vars(contact) for contact in recovered.getSnapshot(None).contacts), key=lambda contact: contact['number']) == expected
+    assert numbers_of(recovered.getFilteredPhones(Filter('name', 'Имя4'))) == numbers_of(make_contact(index) for index in (4, 40, 42, 43, 44))
+    # Восстановленное хранилище продолжает нумерацию ревизий и дописывает журнал.
+    assert recovered.insert(make_contact(100))
+    assert recovered.getRevision() == revision + 1
+    recovered.close()
+    again: MemoryStorage = open_storage('memory', tmp_path)
+    assert again.getRevision() == revision + 1
+    again.close()
+
+
+def test_memory_storage_log_matches_data(tmp_path, monkeypatch):
+    # Операции, которые не удалось применить, не остаются в журнале: хранилище открывается с прежней ревизией.
+    storage: MemoryStorage = open_storage('memory', tmp_path)
+    assert storage.insert(make_contact(1))
+    with pytest.raises(ValueError):  # Контакт проверяется до записи в журнал.
+        storage.insertMany([(1, make_contact(2)), (2, Contact('Имя', 'Фамилия', 'Отчество', 5, 'заметка'))], ImportReport())
+
+    place = MemoryStorage._MemoryStorage__place
+
+    def failing_place(self, pbr: Contact, sort: bool = True):
+        if pbr.number == make_contact(4).number:
+            raise MemoryError
+        place(self, pbr, sort)
+
+    monkeypatch.setattr(MemoryStorage, '_MemoryStorage__place', failing_place)
+    with pytest.raises(MemoryError):
+        storage.applyBatch(BatchRequest([BatchOperation.insert(make_contact(3)), BatchOperation.delete(make_contact(1).number),
+                                         BatchOperation.insert(make_contact(4))]))
+    monkeypatch.undo()
+    assert storage.getRevision() == 3
+    assert storage.insert(make_contact(5))
+    expected: list[str] = numbers_of(storage.getSnapshot(None).contacts)
+    storage.close()
+
+    recovered: MemoryStorage = open_storage('memory', tmp_path)
+    assert recovered.getRevision() == 4
+    assert numbers_of(recovered.getSnapshot(None).contacts) == expected == numbers_of([make_contact(3), make_contact(5)])
+
+
+def test_memory_storage_ignores_torn_log_record(tmp_path):
+    storage: MemoryStorage = open_storage('memory', tmp_path)
+    for index in range(3):
+        storage.insert(make_contact(index))
+    storage.close()
+    log: str = str(tmp_path / 'phonebook.log')
+    size: int = os.path.getsize(log)
+    with open(log, 'a', encoding='utf-8') as file:
+        file.write('[4, 1, "Недописанная')  # Запись, прерванная сбоем.
+
+    recovered: MemoryStorage = open_storage('memory', tmp_path)
+    assert recovered.getRevision() == 3
+    assert os.path.getsize(log) == size
+    assert recovered.insert(make_contact(3))
+    recovered.close()
+    again: MemoryStorage = open_storage('memory', tmp_path)
+    assert numbers_of(again.getSnapshot(None).contacts) == numbers_of([make_contact(index) for index in range(4)])
+    again.close()
+
+
+def read_pages(storage: Storage, query: Query) -> list[Contact]:
+    """Читает все страницы запроса, проверяя, что у каждой страницы одинаковое общее число контактов."""
+    contacts: list[Contact] = []
+    total: int | None = None
+    while True:
+        page = storage.getPage(query)
+        assert total is None or page.total == total
+        total = page.total
+        assert len(page.contacts) <= query.limit
+        contacts.extend(page.contacts)
+        if page.cursor is None:
+            assert len(contacts) == total
+            return contacts
+        query = Query(filter=query.filter, sort=query.sort, descending=query.descending, limit=query.limit, cursor=page.cursor)
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 7, 50])
+def test_paging_with_duplicate_sort_keys(storage, descending, limit):
+    # Всего три различные фамилии, поэтому границы страниц проходят внутри групп с одинаковым ключом сортировки.
+    contacts: list[Contact] = [make_contact(index, surname=('Петров', 'Иванов', 'Сидоров')[index % 3]) for index in range(120)]
+    random.Random(1).shuffle(contacts)
+    storage.insertMany(enumerate(contacts, start=1), ImportReport())
+    pages: list[Contact] = read_pages(storage, Query(sort='surname', descending=descending, limit=limit))
+    expected: list[Contact] = sorted(contacts, key=lambda contact: (contact.surname, contact.number), reverse=descending)
+    assert [contact.number for contact in pages] == [contact.number for contact in expected]
+
+
+def test_paging_with_filter(storage):
+    contacts: list[Contact] = [make_contact(index, surname=('Петров', 'Иванов')[index % 2]) for index in range(60)]
+    storage.insertMany(enumerate(contacts, start=1), ImportReport())
+    pages: list[Contact] = read_pages(storage, Query(filter=Filter('surname', 'Иван'), sort='surname', limit=4))
+    assert [contact.number for contact in pages] == sorted(contact.number for contact in contacts if contact.surname == 'Иванов')
+    assert storage.getPage(Query(filter=Filter('surname', 'Иван'), count_only=True)).total == 30
+    # Число контактов учитывает изменения, сделанные после предыдущего запроса.
+    assert storage.insert(make_contact(100, surname='Иванов'))
+    assert storage.getPage(Query(filter=Filter('surname', 'Иван'), count_only=True)).total == 31
+
+
+def test_paging_rejects_foreign_cursor(storage):
+    storage.insertMany(enumerate([make_contact(index) for index in range(5)], start=1), ImportReport())
+    cursor: str = storage.getPage(Query(sort='name', limit=2)).cursor
+    with pytest.raises(ValueError):
+        storage.getPage(Query(sort='number', limit=2, cursor=cursor))
+    with pytest.raises(ValueError):
+        storage.getPage(Query(sort='note'))
+
+
+def test_shared_database_follows_other_processes(tmp_path, monkeypatch):
+    # Два подключения с shared == True ведут себя как процессы-обработчики, работающие с одной базой данных.
+    first, second = (DatabaseConnection(str(tmp_path / 'phonebook.db'), shared=True) for _ in range(2))
+    for storage in (first, second):
+        storage.createDatabase()
+    notifications: list[tuple[Commands, list[str], int]] = []
+    first.addListener(lambda operation, contacts, revision: notifications.append((operation, numbers_of(contacts), revision)))
+    try:
+        assert second.insert(make_contact(1))
+        assert second.insert(make_contact(2))
+        assert first.insert(make_contact(3))  # Перед изменением процесс узнаёт об изменениях другого процесса.
+        assert not first.insert(make_contact(1))
+        # Изменения другого процесса могут прийти одним уведомлением, но все и в порядке ревизий.
+        assert [number for operation, numbers, revision in notifications for number in numbers] == \
+            [make_contact(index).number for index in (1, 2, 3)]
+        assert notifications[-1][2] == 3
+        assert numbers_of(first.getSnapshot(None).contacts) == numbers_of([make_contact(index) for index in (1, 2, 3)])
+
+        assert second.delete(make_contact(2))  # Без изменений в первом процессе его уведомляет фоновый поток.
+        deadline: float = time.monotonic() + 10
+        while notifications[-1][2] < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert notifications[-1] == (Commands.DELETE, [make_contact(2).number], 4)
+
+        monkeypatch.setattr(Storage, 'CHANGELOG_SIZE', 2)
+        for index in range(10, 15):
+            second.insert(make_contact(index))
+        with first.write_lock:  # Журнал уже не содержит части изменений: изменения неизвестны.
+            pass
+        assert notifications[-1] == (Commands.UPDATE, [], 9)
+    finally:
+        first.close()
+        second.close()